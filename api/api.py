@@ -1,14 +1,26 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, status
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 import streamlit as st
-from utils.data_manipulation import make_prediction
+from utils.data_manipulation import filter_data, make_prediction, month_calendar, segment_series, compare_forecasts, segment_label, MAX_SEGMENTS
+import numpy as np
 import pandas as pd
 import os
-from jose import JWTError, jwt
-from utils.db_handler import DatabaseManager
+from jose import JWTError, jwt, jwk
+import uuid
+from utils.db_handler import DatabaseManager, engine
+from utils import admission, bundle, events, profiling, tracing
+from utils.shared_state import get_sales_snapshot
+from utils.revocation import RevocationList
+from utils.sales_cube import get_cube, month_key, DIMENSIONS
+from utils.export import iter_export, export_format, EXPORT_FORMATS
+from utils.serialization import frame_response, BULK_RESPONSES
+from utils.rate_limit import client_ip, check_login, check_signup, retry_after_header
+from utils.simulation import sample_paths, quantile_table, DEFAULT_PATHS, MAX_PATHS, DEFAULT_QUANTILES
+from utils.jobs import JobQueue
 
 # App instance
 app = FastAPI(title="Property Sales API", version="1.0")
@@ -21,8 +33,38 @@ except FileNotFoundError:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Key object built once instead of on every token verification
+SIGNING_KEY = jwk.construct(SECRET_KEY, ALGORITHM)
+
+# Revoked token ids, checked without a database query per request
+REVOKED_TOKENS = RevocationList(DatabaseManager.get_revoked_tokens, DatabaseManager.is_token_revoked)
+events.subscribe(events.TOKEN_REVOKED, lambda event: REVOKED_TOKENS.add(event.payload["jti"]))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    # Each request is a trace; its stages are reported to the client in Server-Timing
+    with tracing.span(f"{request.method} {request.url.path}") as root:
+        response = await call_next(request)
+        root.set("http.status_code", response.status_code)
+    response.headers["Server-Timing"] = tracing.server_timing(root)
+    return response
+
+@app.exception_handler(admission.Overloaded)
+async def forecast_overloaded(request: Request, exc: admission.Overloaded):
+    # Every forecast slot is taken and the queue would outlast the request's deadline
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=retry_after_header(exc.retry_after))
+
+@app.on_event("startup")
+def start_event_listener():
+    # Invalidate this worker's caches when other processes change the data
+    events.start_listener(engine)
+    # Load the offline bundle before the first request needs it
+    bundle.get_bundle()
+    # Run the forecast jobs a stopped process left behind
+    FORECAST_JOBS.recover()
+
 # Pydantic models
 class UserCreate(BaseModel):
     email: EmailStr
@@ -51,10 +93,61 @@ class SaleDelete(BaseModel):
     date_sold: str
     price: float
 
+class ForecastJobCreate(BaseModel):
+    year: int
+    property_type: List[str] = ["house", "unit"]
+    bedrooms: List[int] = [1, 2, 3, 4, 5]
+    granularity: str = Field("Month", pattern="^(Month|Quarter|Year)$")
+    exclude_outliers: bool = True
+
+class ProfilingArm(BaseModel):
+    target: str = Field(..., pattern=f"^({'|'.join(profiling.TARGETS)})$")
+    runs: int = Field(1, ge=0, le=profiling.MAX_RUNS)
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
+# Data helpers
+def load_sales():
+    # Prefer the snapshot shared by all workers; fall back to the cached database read,
+    # then to the offline bundle when the database is unreachable
+    with tracing.span("load_sales") as stage:
+        data = get_sales_snapshot()
+        stage.set("source", "snapshot")
+        if data is None:
+            data = DatabaseManager.load_data()
+            stage.set("source", "database")
+        if data is None:
+            data = bundle.load_sales()
+            stage.set("source", "bundle")
+        stage.set("rows", len(data) if data is not None else 0)
+        return data
+
+def load_sales_range(start_date, end_date):
+    # Same sources as load_sales, but the database and the bundle only read the years asked for
+    with tracing.span("load_sales", start_date=str(start_date), end_date=str(end_date)) as stage:
+        data = get_sales_snapshot()
+        stage.set("source", "snapshot")
+        if data is not None:
+            # The shared snapshot stores dates as datetime64
+            dates = data["datesold"]
+            data = data[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+        else:
+            data = DatabaseManager.load_sales_range(start_date, end_date)
+            stage.set("source", "database")
+        if data is None:
+            data = bundle.load_sales(start_date, end_date)
+            stage.set("source", "bundle")
+        stage.set("rows", len(data) if data is not None else 0)
+        return data
+
+def check_forecast_year(year):
+    # Same horizon as the page: further years only cost ever longer forecasts
+    last_year = datetime.utcnow().year + bundle.HORIZON_YEARS
+    if year > last_year:
+        raise HTTPException(status_code=400, detail=f"Prediction year must be at most {last_year}")
+
 # Auth helpers
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -63,9 +156,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token(token: str):
+    # Verify signature, expiry and revocation; raises JWTError if the token is not valid
+    payload = jwt.decode(token, SIGNING_KEY, algorithms=[ALGORITHM])
+    if payload.get("sub") is None:
+        raise JWTError("Missing subject")
+    if payload.get("jti") and REVOKED_TOKENS.is_revoked(payload["jti"]):
+        raise JWTError("Token revoked")
+    return payload
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,48 +176,106 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
         
         user = DatabaseManager.get_user_by_email(email)
         if not user:
             raise credentials_exception
-        return user
+        return {"email": user.email, "id": str(user.id), "role": user.role, "jti": payload.get("jti")}
+    except JWTError:
+        raise credentials_exception
+
+async def get_token_claims(token: str = Depends(oauth2_scheme)):
+    # Stateless variant of get_current_user for read endpoints: the identity comes
+    # from the signed claims, so no database query is made per request
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = decode_token(token)
     except JWTError:
         raise credentials_exception
 
+    if payload.get("uid") is None or payload.get("role") is None:
+        # Tokens issued before the claims were added
+        user = DatabaseManager.get_user_by_email(payload["sub"])
+        if not user:
+            raise credentials_exception
+        return {"email": user.email, "id": str(user.id), "role": user.role, "jti": payload.get("jti")}
+    return {"email": payload["sub"], "id": payload["uid"], "role": payload["role"], "jti": payload.get("jti")}
+
+async def forecast_admission(current_user: dict = Depends(get_token_claims)):
+    # CPU-heavy endpoints: a token bucket per JWT subject, and a deadline for queueing for a forecast slot.
+    # Async, so the deadline is set in the context the endpoint then runs in
+    wait = admission.check_user(current_user["email"])
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many forecast requests, try again later.", headers=retry_after_header(wait))
+    admission.set_deadline()
+    return current_user
+
 # Auth routes
 @app.post("/register", response_model=dict)
-def register_user(user: UserCreate):
-    if DatabaseManager.verify_duplicate_user(user.email):
+def register_user(user: UserCreate, request: Request):
+    wait = check_signup(client_ip(request.headers, request.client.host if request.client else None))
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many registrations, try again later.", headers=retry_after_header(wait))
+    created = DatabaseManager.register_user(user.email, user.password, user.role, user.extra_input_params)
+    if created is None:
+        raise HTTPException(status_code=500, detail="Failed to register user.")
+    if not created:
         raise HTTPException(status_code=400, detail="Email already registered.")
-    success = DatabaseManager.save_user(user.email, user.password, user.role, user.extra_input_params)
-    if success:
-        return {"message": "User registered successfully"}
-    raise HTTPException(status_code=500, detail="Failed to register user.")
+    return {"message": "User registered successfully"}
 
 @app.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    wait = check_login(client_ip(request.headers, request.client.host if request.client else None), form_data.username)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again later.", headers=retry_after_header(wait))
     user = DatabaseManager.authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
+    user = DatabaseManager.get_user_by_email(form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": form_data.username}, expires_delta=access_token_expires
+        data={"sub": form_data.username, "uid": str(user.id), "role": user.role},
+        expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
+
+@app.post("/logout", response_model=dict)
+def logout(token: str = Depends(oauth2_scheme)):
+    try:
+        payload = decode_token(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    if not payload.get("jti"):
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    if DatabaseManager.revoke_token(payload["jti"], datetime.utcfromtimestamp(payload["exp"])):
+        return {"message": "Logged out"}
+    raise HTTPException(status_code=500, detail="Failed to revoke token.")
     
-@app.get("/users", response_model=List[Dict[str, Any]])
-def get_users(current_user: dict = Depends(get_current_user)):
+@app.get("/users", responses=BULK_RESPONSES)
+def get_users(
+    request: Request,
+    email: Optional[str] = Query(None, description="Only users whose email contains this text"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    layout: str = Query("records", regex="^(records|columns)$", description="JSON layout: 'records' or 'columns'"),
+    current_user: dict = Depends(get_current_user)
+):
     # Verificar si el usuario tiene permisos de administrador
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="No tienes permisos para ver todos los usuarios")
     
-    users_df = DatabaseManager.get_all_users()
-    return users_df.to_dict(orient="records")
+    users = DatabaseManager.get_all_users(email, limit=limit, offset=offset)
+    return frame_response(users, request, layout)
 
 @app.get("/users/{email}", response_model=Dict[str, Any])
 def get_user_id(email: str, current_user: dict = Depends(get_current_user)):
@@ -130,7 +291,7 @@ def get_user_id(email: str, current_user: dict = Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"email": user["email"], "id": user["id"]}
+    return {"email": user.email, "id": user.id}
     
 
 @app.put("/users/role", response_model=dict)
@@ -153,37 +314,64 @@ def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current_user)
         return {"message": "Sale inserted successfully"}
     raise HTTPException(status_code=500, detail="Failed to insert sale.")
 
-@app.get("/sales/user/{id}", response_model=List[Dict[str, Any]])
-def get_sales_by_user(id: str, current_user: dict = Depends(get_current_user)):
+@app.get("/sales/user/{id}", responses=BULK_RESPONSES)
+def get_sales_by_user(
+    id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    layout: str = Query("records", regex="^(records|columns)$", description="JSON layout: 'records' or 'columns'"),
+    current_user: dict = Depends(get_token_claims)
+):
     # Verificar si el usuario está consultando sus propias ventas o es admin
-    if current_user["id"] != id and current_user["role"] != "admin":
+    if str(current_user["id"]) != id and current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="No puedes ver las ventas de otros usuarios")
 
     
-    df = DatabaseManager.get_sales_by_user(id)
-    return df.to_dict(orient="records")
+    sales = DatabaseManager.get_sales_by_user(id, limit=limit, offset=offset)
+    return frame_response(sales, request, layout)
 
-@app.get("/sales", response_model=List[Dict[str, Any]])
+@app.get("/sales", responses=BULK_RESPONSES)
+@profiling.profiled("filter_sales")
 def filter_sales(
+    request: Request,
     start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
     end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
+    layout: str = Query("records", regex="^(records|columns)$", description="JSON layout: 'records' or 'columns'"),
 ):
-    df = DatabaseManager.load_data()
-    if df is None or df.empty:
-        raise HTTPException(status_code=404, detail="No sales data found")
     if start_date is None or end_date is None:
         raise HTTPException(status_code=400, detail="Both start_date and end_date must be provided")
     print(f"Start Date: {start_date}, End Date: {end_date}")
-    from datetime import datetime
-
-    if start_date:
+    try:
         start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-        df = df[df["datesold"] >= start_date]
-    if end_date:
         end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-        df = df[df["datesold"] <= end_date]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
 
-    return df.to_dict(orient="records")
+    df = load_sales_range(start_date, end_date)
+    if df is None:
+        raise HTTPException(status_code=404, detail="No sales data found")
+    if pd.api.types.is_datetime64_any_dtype(df["datesold"]):
+        df = df.assign(datesold=df["datesold"].dt.date)
+
+    return frame_response(df, request, layout)
+
+@app.get("/sales/export")
+def export_sales(
+    format: str = Query("csv", regex="^(csv|parquet)$", description="Export format: 'csv' or 'parquet'"),
+    compress: bool = Query(False, description="Gzip-compress the export"),
+    current_user: dict = Depends(get_token_claims)
+):
+    # Verificar si el usuario es analista o admin
+    if current_user["role"] not in ("analyst", "admin"):
+        raise HTTPException(status_code=403, detail="No tienes permisos para exportar las ventas")
+
+    media_type, file_name = EXPORT_FORMATS[export_format(format, compress)]
+    return StreamingResponse(
+        iter_export(format, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+    )
 
 @app.delete("/sales", response_model=dict)
 def delete_sale(sale: SaleDelete, current_user: dict = Depends(get_current_user)):
@@ -191,67 +379,306 @@ def delete_sale(sale: SaleDelete, current_user: dict = Depends(get_current_user)
     if current_user["email"] != sale.user_email and current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="No puedes eliminar ventas de otros usuarios")
         
-    user_id = DatabaseManager.get_user_id(sale.user_email)
-    if not user_id:
-        raise HTTPException(status_code=404, detail="User not found")
-        
-    success = DatabaseManager.delete_sale(sale.date_sold, sale.price, user_id)
+    # Look up the user and delete the sale on one connection and transaction
+    with DatabaseManager.unit_of_work():
+        user_id = DatabaseManager.get_user_id(sale.user_email)
+        if not user_id:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        success = DatabaseManager.delete_sale(sale.date_sold, sale.price, user_id)
     if success:
         return {"message": "Sale deleted successfully"}
     raise HTTPException(status_code=500, detail="Failed to delete sale.")
 
-@app.get("/predict/months", response_model=Dict[str, Any])
-def get_best_and_worst_months(
+@app.get("/stats", response_model=List[Dict[str, Any]])
+def get_sales_stats(
+    group_by: Optional[str] = Query(None, description="Comma-separated dimensions: month, property_type, bedrooms, postcode"),
+    start_month: Optional[str] = Query(None, description="First month in YYYY-MM format"),
+    end_month: Optional[str] = Query(None, description="Last month in YYYY-MM format"),
+    property_type: Optional[List[str]] = Query(None),
+    bedrooms: Optional[List[int]] = Query(None),
+    postcode: Optional[List[str]] = Query(None),
+    current_user: dict = Depends(get_token_claims)
+):
+    cube = get_cube(load_sales)
+    if cube is None:
+        raise HTTPException(status_code=404, detail="No sales data found")
+
+    dimensions = [dim.strip() for dim in group_by.split(",") if dim.strip()] if group_by else []
+    unknown = [dim for dim in dimensions if dim not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+
+    try:
+        start = month_key(start_month) if start_month else None
+        end = month_key(end_month) if end_month else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Months must be in YYYY-MM format")
+
+    return cube.query(
+        group_by=dimensions,
+        start_month=start,
+        end_month=end,
+        property_types=[p.lower() for p in property_type] if property_type else None,
+        bedrooms=bedrooms,
+        postcodes=postcode,
+    )
+
+@app.get("/simulate", response_model=Dict[str, Any])
+def simulate_prices(
     year: int,
-    action: str = Query(..., regex="^(buy|sell)$", description="Action must be 'buy' or 'sell'"),
-    current_user: dict = Depends(get_current_user)
+    property_type: List[str] = Query(["house", "unit"]),
+    bedrooms: List[int] = Query([1, 2, 3, 4, 5]),
+    month: Optional[List[int]] = Query(None, description="Months of the year to report (all by default)"),
+    quantile: List[float] = Query(DEFAULT_QUANTILES, description="Quantiles between 0 and 1"),
+    paths: int = Query(DEFAULT_PATHS, ge=100, le=MAX_PATHS, description="Number of simulated price paths"),
+    exclude_outliers: bool = Query(True, description="Ignore sales flagged as price outliers"),
+    current_user: dict = Depends(forecast_admission)
 ):
+    if any(not 0 <= q <= 1 for q in quantile):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    if month and any(not 1 <= m <= 12 for m in month):
+        raise HTTPException(status_code=400, detail="Months must be between 1 and 12")
+
+    data = load_sales()
+    if data is None or data.empty:
+        raise HTTPException(status_code=404, detail="No sales data found")
+    property_type = [p.lower() for p in property_type]
+    series = filter_data(data, property_type, bedrooms, exclude_outliers)
+    if series.empty:
+        raise HTTPException(status_code=404, detail="No sales found for this segment")
+    if year <= series["time"].max().year:
+        raise HTTPException(status_code=400, detail="Simulation year must be in the future")
+
+    # The paths are simulated once per series; other years, months and quantiles reuse them
+    dates, samples = sample_paths(series, paths)
+    table = quantile_table(dates, samples, quantile, year=year, months=month)
+    if table.empty:
+        raise HTTPException(status_code=400, detail="Simulation year is beyond the simulated horizon")
+
+    return {
+        "segment": {"property_type": property_type, "bedrooms": bedrooms, "exclude_outliers": exclude_outliers},
+        "paths": paths,
+        "months": [
+            {
+                "time": row["time"].strftime("%Y-%m"),
+                "mean": round(row["mean"]),
+                "quantiles": {label: round(row[label]) for label in table.columns[2:]},
+            }
+            for _, row in table.iterrows()
+        ],
+    }
+
+@app.get("/metrics/pool", response_model=Dict[str, Any])
+def get_pool_metrics(current_user: dict = Depends(get_current_user)):
+    # Verificar si el usuario tiene permisos de administrador
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos para ver las métricas")
+    return DatabaseManager.pool_status()
+
+@app.get("/predict/compare", response_model=Dict[str, Any])
+def compare_segments(
+    year: int,
+    property_type: List[str] = Query(["house"], description="Property types; each is compared separately"),
+    bedrooms: List[int] = Query([2, 3, 4], description="Bedroom counts; each is compared separately"),
+    granularity: str = Query("Month", regex="^(Month|Quarter|Year)$"),
+    exclude_outliers: bool = Query(True, description="Ignore sales flagged as price outliers"),
+    current_user: dict = Depends(forecast_admission)
+):
+    # One segment per property type and bedroom count, all built in one pass over the sales
+    segments = [((t.lower(),), (n,)) for t in dict.fromkeys(property_type) for n in dict.fromkeys(bedrooms)]
+    if len(segments) > MAX_SEGMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SEGMENTS} segments can be compared")
+    # Each segment gets its own forecast, bounded like the page's; years the data already covers need no steps
+    check_forecast_year(year)
+
+    data = load_sales()
+    if data is None or data.empty:
+        raise HTTPException(status_code=404, detail="No sales data found")
+    with tracing.span("segment_series", rows_in=len(data), segments=len(segments)) as stage:
+        series = segment_series(data, segments, exclude_outliers)
+        stage.set("segments_found", len(series))
+    if not series:
+        raise HTTPException(status_code=404, detail="No sales found for these segments")
+    with tracing.span("compare_forecasts", granularity=granularity, segments=len(series)):
+        forecasts = compare_forecasts(series, granularity, year)
+
+    return {
+        "granularity": granularity,
+        "segments": [
+            {
+                "property_type": segment[0][0],
+                "bedrooms": segment[1][0],
+                "label": segment_label(segment),
+                "forecast": [
+                    {
+                        "time": row["time"].strftime("%Y-%m-%d"),
+                        "price": float(row["price"]),
+                        "lowest_price": float(row["lowest price"]),
+                        "highest_price": float(row["highest price"]),
+                    }
+                    for _, row in forecasts[segment].iterrows()
+                ],
+            }
+            for segment in series
+        ],
+    }
+
+@app.get("/metrics/admission", response_model=Dict[str, Any])
+def get_admission_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos para ver las métricas")
+    return admission.ADMISSION.snapshot()
+
+@app.get("/profiling", response_model=Dict[str, Any])
+def get_profiling(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos para perfilar la aplicación")
+    return profiling.status()
+
+@app.post("/profiling", response_model=Dict[str, Any])
+def arm_profiling(request: ProfilingArm, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos para perfilar la aplicación")
+    # Every worker profiles its next runs of the target; 0 runs stops profiling
+    profiling.arm(request.target, request.runs)
+    return profiling.status()
+
+def monthly_forecast(year, exclude_outliers):
+    """Monthly forecast of all sales up to the end of `year`, raising the API's errors."""
+    check_forecast_year(year)
     # Load and filter data
-    data = DatabaseManager.load_data()
+    data = load_sales()
     if data is None or data.empty:
         raise HTTPException(status_code=404, detail="No sales data found")
+    with tracing.span("filter_data", rows_in=len(data), exclude_outliers=exclude_outliers) as stage:
+        if exclude_outliers and "is_outlier" in data.columns:
+            data = data[~data["is_outlier"].astype(bool)]
+        stage.set("rows", len(data))
 
-    try:
-        # Calculate number of months to predict
-        data.rename(columns={'datesold': 'time'}, inplace=True)
-        last_date = data['time'].max()
-        prediction_end = pd.Timestamp(year=year, month=12, day=31)
-        months_to_predict = (prediction_end.year - last_date.year) * 12 + (prediction_end.month - last_date.month)
+    # Calculate number of months to predict
+    data = data.rename(columns={'datesold': 'time'})
+    last_date = data['time'].max()
+    prediction_end = pd.Timestamp(year=year, month=12, day=31)
+    months_to_predict = (prediction_end.year - last_date.year) * 12 + (prediction_end.month - last_date.month)
 
-        if months_to_predict <= 0:
-            raise HTTPException(status_code=400, detail="Prediction year must be in the future")
+    if months_to_predict <= 0:
+        raise HTTPException(status_code=400, detail="Prediction year must be in the future")
 
+    with tracing.span("make_prediction", granularity="Month", steps=months_to_predict, rows_in=len(data)) as stage:
         forecast = make_prediction(data, months_to_predict, "Month")
-        forecast = forecast[forecast['time'].dt.year == year]
+        stage.set("rows", len(forecast))
+    return forecast
+
+def month_kpis(kpis, action):
+    """Best and worst month of a year as /predict/months reports them."""
+    difference = "savings" if action == "buy" else "profit_diff"
+    return {
+        "best_month": kpis["best_month"],
+        "best_price": int(kpis["best_price"]),
+        "worst_month": kpis["worst_month"],
+        "worst_price": int(kpis["worst_price"]),
+        difference: int(kpis["spread"]),
+    }
 
-        if forecast.empty:
-            raise HTTPException(status_code=404, detail="No forecast data available for selected year")
+@app.get("/predict/months", response_model=Dict[str, Any])
+@profiling.profiled("predict_months")
+def get_best_and_worst_months(
+    year: int,
+    action: str = Query(..., regex="^(buy|sell)$", description="Action must be 'buy' or 'sell'"),
+    exclude_outliers: bool = Query(True, description="Ignore sales flagged as price outliers"),
+    current_user: dict = Depends(forecast_admission)
+):
+    try:
+        forecast = monthly_forecast(year, exclude_outliers)
+        with tracing.span("month_calendar", rows_in=len(forecast)):
+            kpis = month_calendar(forecast).year(year, action)
 
-        best_row = forecast.loc[forecast['price'].idxmax()]
-        worst_row = forecast.loc[forecast['price'].idxmin()]
+        if kpis is None:
+            raise HTTPException(status_code=404, detail="No forecast data available for selected year")
 
-        if action == "buy":
-            result = {
-                "best_month": worst_row['time'].strftime("%B"),
-                "best_price": int(worst_row['price']),
-                "worst_month": best_row['time'].strftime("%B"),
-                "worst_price": int(best_row['price']),
-                "savings": int(best_row['price'] - worst_row['price'])
-            }
-        else:  # sell
-            result = {
-                "best_month": best_row['time'].strftime("%B"),
-                "best_price": int(best_row['price']),
-                "worst_month": worst_row['time'].strftime("%B"),
-                "worst_price": int(worst_row['price']),
-                "profit_diff": int(best_row['price'] - worst_row['price'])
-            }
+        return month_kpis(kpis, action)
 
-        return result
+    except (HTTPException, admission.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+@app.get("/predict/calendar", response_model=Dict[str, Any])
+def get_month_calendar(
+    year: int = Query(..., description="Last year of the calendar"),
+    action: str = Query(..., regex="^(buy|sell)$", description="Action must be 'buy' or 'sell'"),
+    exclude_outliers: bool = Query(True, description="Ignore sales flagged as price outliers"),
+    current_user: dict = Depends(forecast_admission)
+):
+    try:
+        forecast = monthly_forecast(year, exclude_outliers)
+        # Every year of the horizon from one years × 12 matrix
+        with tracing.span("month_calendar", rows_in=len(forecast)):
+            calendar = month_calendar(forecast)
+            kpis = calendar.kpis(action)
+    except (HTTPException, admission.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+    return {
+        "action": action,
+        "years": [
+            {
+                "year": int(row["year"]),
+                "months": int(row["months"]),
+                **month_kpis(row, action),
+                "spread_pct": round(float(row["spread_pct"]), 2),
+                "prices": [None if np.isnan(price) else int(price) for price in prices],
+            }
+            for row, prices in zip(kpis.to_dict("records"), calendar.prices)
+        ],
+    }
+
+def run_forecast_job(params):
+    """Forecast of a segment up to the end of a year, for the job queue."""
+    data = load_sales()
+    if data is None or data.empty:
+        raise ValueError("No sales data found")
+    series = filter_data(data, params["property_type"], params["bedrooms"], params["exclude_outliers"])
+    if series.empty:
+        raise ValueError("No sales match the selected property types and bedrooms")
+    steps = bundle.horizon_steps(series["time"].max(), params["granularity"], params["year"])
+    if steps <= 0:
+        raise ValueError("Prediction year must be in the future")
+    forecast = make_prediction(series, steps, params["granularity"])
+    return {
+        "granularity": params["granularity"],
+        "forecast": [
+            {"time": time.strftime("%Y-%m-%d"), "price": float(price)}
+            for time, price in zip(forecast["time"], forecast["price"])
+        ],
+    }
+
+FORECAST_JOBS = JobQueue("forecast", run_forecast_job)
+
+@app.post("/predict/jobs", response_model=Dict[str, Any], status_code=status.HTTP_202_ACCEPTED)
+def create_forecast_job(job: ForecastJobCreate, current_user: dict = Depends(forecast_admission)):
+    # Long forecasts run in the background; identical pending jobs are shared
+    check_forecast_year(job.year)
+    params = job.model_dump()
+    params["property_type"] = sorted({value.strip().lower() for value in params["property_type"]})
+    params["bedrooms"] = sorted(set(params["bedrooms"]))
+    try:
+        queued, created = FORECAST_JOBS.submit(params, current_user["id"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to queue the forecast: {e}")
+    return {**queued, "deduplicated": not created}
+
+@app.get("/predict/jobs/{job_id}", response_model=Dict[str, Any])
+def get_forecast_job(job_id: str, current_user: dict = Depends(get_token_claims)):
+    # Other users' jobs are not found, so their ids cannot be probed
+    job = FORECAST_JOBS.get(job_id, None if current_user["role"] == "admin" else current_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 
 if __name__ == "__main__":
     import uvicorn 
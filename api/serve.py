@@ -0,0 +1,91 @@
+"""Production launcher for the API.
+
+Creates this year's and next year's sales partitions, refreshes the outlier
+flags, loads the sales table once, publishes it as memory-mapped column files
+and fits the hot forecasting model into the shared model store before starting
+N uvicorn workers. Workers map the snapshot read-only instead of each holding a copy of
+the DataFrame, and load fitted models instead of refitting them.
+
+Usage (from the repository root):
+
+    python -m api.serve --workers 4 --port 8000
+"""
+import argparse
+import os
+import tempfile
+import time
+import uvicorn
+
+
+def warm_up(build_bundle=False):
+    """Publish the sales snapshot and fit the models served by /predict/months."""
+    # Imported here so the modules read the SHARED_STATE_DIR set by main()
+    from utils import bundle, partitions
+    from utils.db_handler import DatabaseManager, commit, connection
+    from utils.shared_state import publish_sales_snapshot
+    from utils.forecast_engines import fit_prophet
+
+    # New sales of the coming year land in their own partition rather than the default one
+    year = time.localtime().tm_year
+    try:
+        with connection() as conn:
+            created = partitions.ensure_partitions(conn, year, year + 1)
+            commit(conn)
+        if created:
+            print(f"Created sales partitions for {created}")
+    except Exception as e:
+        print(f"Failed to create sales partitions: {e}")
+
+    start = time.perf_counter()
+    flagged = DatabaseManager.update_outlier_flags()
+    if flagged is not None:
+        print(f"Flagged {flagged} outlier sales in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    data = DatabaseManager.load_data()
+    if data is None or data.empty:
+        print("⚠️ No sales data loaded; workers will read from the database.")
+        return
+    version = publish_sales_snapshot(data)
+    print(f"Published sales snapshot {version} ({len(data)} rows) in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    # The series /predict/months fits by default, without the flagged outliers, so the stored model matches it
+    hot = data[~data["is_outlier"].astype(bool)] if "is_outlier" in data.columns else data
+    fit_prophet(hot.rename(columns={"datesold": "time"}))
+    print(f"Fitted hot models in {time.perf_counter() - start:.1f}s")
+
+    if build_bundle:
+        start = time.perf_counter()
+        os.makedirs(bundle.BUNDLE_DIR, exist_ok=True)
+        version = bundle.build_bundle(data, source="db")
+        print(f"Built offline bundle {version} in {time.perf_counter() - start:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Property Sales API with N workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--state-dir", default=os.getenv("SHARED_STATE_DIR"),
+                        help="Directory for the shared snapshot and model store")
+    parser.add_argument("--skip-warm-up", action="store_true")
+    parser.add_argument("--build-bundle", action="store_true",
+                        help="Rebuild the offline bundle from the database before starting")
+    args = parser.parse_args()
+
+    # Workers inherit the environment, so they all find the same shared state
+    state_dir = args.state_dir or os.path.join(tempfile.gettempdir(), "property-sales-state")
+    os.makedirs(state_dir, exist_ok=True)
+    os.environ["SHARED_STATE_DIR"] = state_dir
+    # Forecast jobs share the cores between the workers
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+
+    if not args.skip_warm_up:
+        warm_up(args.build_bundle)
+
+    uvicorn.run("api.api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 #!/bin/bash
-uvicorn api.api:app --host 0.0.0.0 --port ${PORT:-8000}
+python -m api.serve --host 0.0.0.0 --port ${PORT:-8000} --workers ${WEB_CONCURRENCY:-1}
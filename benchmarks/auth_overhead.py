@@ -0,0 +1,100 @@
+"""Micro-benchmark of per-request authentication overhead.
+
+Compares the database-backed `get_current_user` dependency with the stateless
+`get_token_claims` one on a seeded SQLite stand-in, reporting the time and the
+number of database queries per request.
+
+Usage (from the repository root):
+
+    python -m benchmarks.auth_overhead --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.load_test import seed_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(dependency, token, n_requests, queries):
+    async def run():
+        for _ in range(n_requests):
+            await dependency(token)
+
+    queries.clear()
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return {
+        "us_per_request": round(elapsed / n_requests * 1e6, 2),
+        "queries_per_request": round(len(queries) / n_requests, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--revoked", type=int, default=1000, help="Revoked tokens to seed")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "auth_overhead.json"))
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory()
+    database_url = f"sqlite:///{os.path.join(workdir.name, 'auth.db')}"
+    emails = seed_database(database_url, n_users=1, sales_per_user=0, seed=0)
+
+    # The API reads its configuration at import time
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("DB_ECHO", "false")
+    os.environ.setdefault("EVENTS_BACKEND", "none")
+    from sqlalchemy import event, text
+    from api.api import create_access_token, get_current_user, get_token_claims
+    from utils.db_handler import DatabaseManager, engine
+
+    expires = datetime.utcnow() + timedelta(days=1)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE revoked_tokens (jti VARCHAR PRIMARY KEY, expires_at TIMESTAMP NOT NULL)"))
+        conn.execute(
+            text("INSERT INTO revoked_tokens (jti, expires_at) VALUES (:jti, :expires_at)"),
+            [{"jti": uuid.uuid4().hex, "expires_at": expires} for _ in range(args.revoked)],
+        )
+
+    user = DatabaseManager.get_user_by_email(emails[0])
+    token = create_access_token(
+        {"sub": user.email, "uid": str(user.id), "role": user.role}, timedelta(minutes=30)
+    )
+
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a, **k: queries.append(1))
+
+    # Warm up: load the revocation filter and the connection pool
+    measure(get_token_claims, token, 10, queries)
+    measure(get_current_user, token, 10, queries)
+
+    results = {
+        "get_current_user": measure(get_current_user, token, args.requests, queries),
+        "get_token_claims": measure(get_token_claims, token, args.requests, queries),
+    }
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"requests": args.requests, "revoked": args.revoked},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in results.items():
+        print(f"{name:<18} {stats['us_per_request']:>9.1f} µs/request  {stats['queries_per_request']:.3f} queries/request")
+    print(f"Results written to {args.output}")
+    engine.dispose()
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Rolling-origin backtest of the forecasting engines.
+
+Builds the monthly series that `filter_data` produces for every segment the app
+offers, then for each engine and segment repeatedly fits on the history up to an
+origin and forecasts the following months. Reports MAPE and RMSE together with
+fit/predict wall time and peak Python memory, so a cheap engine can be chosen
+where it is accurate enough.
+
+Peak memory is measured with tracemalloc inside the worker process; Prophet's
+Stan optimisation runs in a CmdStan subprocess and is not included.
+
+Usage (from the repository root):
+
+    python -m benchmarks.backtest --engines prophet,linear_trend --folds 6 --horizon 12
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from utils.bundle import segment_name, ui_segments
+from utils.data_manipulation import filter_data
+from utils.forecast_engines import ENGINES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CSV = os.path.join(ROOT, "data", "property_sales.csv")
+
+
+def load_sales(source):
+    """Load sales from the database ('db') or a CSV file."""
+    if source == "db":
+        from utils.db_handler import DatabaseManager
+        data = DatabaseManager.load_data()
+        if data is None:
+            raise RuntimeError("Could not load sales from the database")
+        return data
+    data = pd.read_csv(source).rename(columns={"date_sold": "datesold"})
+    data["datesold"] = pd.to_datetime(data["datesold"]).dt.date
+    return data
+
+
+def build_series(data, segments):
+    series = {}
+    for segment in segments:
+        types, bedrooms = segment
+        # filter_data renames columns in place, so give it its own copy
+        series[segment_name(segment)] = filter_data(data.copy(), list(types), list(bedrooms))
+    return series
+
+
+def errors(actual, predicted):
+    """Align forecast and actuals by calendar month and compute MAPE and RMSE."""
+    actual = actual.assign(period=actual["time"].dt.to_period("M"))
+    predicted = predicted.assign(period=predicted["time"].dt.to_period("M"))
+    merged = actual.merge(predicted, on="period", suffixes=("", "_hat"))
+    if merged.empty:
+        return None, None, 0
+    y, y_hat = merged["price"].to_numpy(), merged["price_hat"].to_numpy()
+    mape = float(np.mean(np.abs(y - y_hat) / np.abs(y)) * 100)
+    rmse = float(np.sqrt(np.mean((y - y_hat) ** 2)))
+    return mape, rmse, len(merged)
+
+
+def backtest(engine, name, series, folds, horizon, step):
+    """Rolling-origin evaluation of one engine on one segment series."""
+    fit, predict = ENGINES[engine]
+    results = []
+    for fold in range(folds):
+        origin = len(series) - horizon - (folds - 1 - fold) * step
+        if origin < 24:
+            continue  # Keep at least two seasonal cycles of history
+        train, test = series.iloc[:origin], series.iloc[origin:origin + horizon]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        model = fit(train)
+        fitted = time.perf_counter()
+        predicted = predict(model, horizon, "Month")
+        predicted_at = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        mape, rmse, n = errors(test, predicted)
+        results.append({
+            "origin": test["time"].iloc[0].strftime("%Y-%m"),
+            "mape": mape,
+            "rmse": rmse,
+            "points": n,
+            "fit_s": fitted - start,
+            "predict_s": predicted_at - fitted,
+            "peak_mb": peak / 2 ** 20,
+        })
+
+    return {"engine": engine, "segment": name, "folds": results, **summarise(results)}
+
+
+def summarise(folds):
+    scored = [fold for fold in folds if fold["mape"] is not None]
+    if not scored:
+        return {"mape": None, "rmse": None, "fit_s": None, "predict_s": None, "peak_mb": None}
+    return {
+        "mape": round(float(np.mean([f["mape"] for f in scored])), 3),
+        "rmse": round(float(np.mean([f["rmse"] for f in scored])), 1),
+        "fit_s": round(float(np.mean([f["fit_s"] for f in folds])), 4),
+        "predict_s": round(float(np.mean([f["predict_s"] for f in folds])), 4),
+        "peak_mb": round(float(np.max([f["peak_mb"] for f in folds])), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", default=",".join(ENGINES), help="Comma-separated engine names")
+    parser.add_argument("--source", default=SEED_CSV, help="CSV file, or 'db' to read the configured database")
+    parser.add_argument("--folds", type=int, default=6, help="Forecast origins per segment")
+    parser.add_argument("--horizon", type=int, default=12, help="Months forecast from each origin")
+    parser.add_argument("--step", type=int, default=6, help="Months between origins")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "backtest.json"))
+    args = parser.parse_args()
+
+    engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+    unknown = [engine for engine in engines if engine not in ENGINES]
+    if unknown:
+        parser.error(f"Unknown engines: {', '.join(unknown)}")
+
+    series = build_series(load_sales(args.source), ui_segments())
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(backtest, engine, name, data, args.folds, args.horizon, args.step)
+            for engine in engines for name, data in series.items()
+        ]
+        for future in as_completed(futures):
+            results.append(future.result())
+    results.sort(key=lambda r: (r["segment"], r["engine"]))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"engines": engines, "folds": args.folds, "horizon": args.horizon, "step": args.step},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'segment':<18} {'engine':<16} {'MAPE %':>8} {'RMSE':>10} {'fit s':>8} {'predict s':>10} {'peak MB':>8}")
+    for r in results:
+        if r["mape"] is None:
+            print(f"{r['segment']:<18} {r['engine']:<16} {'not enough history':>48}")
+            continue
+        print(f"{r['segment']:<18} {r['engine']:<16} {r['mape']:>8.2f} {r['rmse']:>10.0f} "
+              f"{r['fit_s']:>8.3f} {r['predict_s']:>10.3f} {r['peak_mb']:>8.1f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Load test for the FastAPI service.
+
+Seeds a SQLite stand-in database from data/property_sales.csv, starts the API
+against it with uvicorn and drives a weighted mix of requests from concurrent
+asyncio workers. Throughput, p50/p95/p99 latency and error rate per route are
+written to a JSON file so runs can be diffed between commits.
+
+Usage (from the repository root):
+
+    python -m benchmarks.load_test --duration 60 --concurrency 16
+    python -m benchmarks.load_test --url http://localhost:8000 --database-url postgresql+psycopg2://...
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timezone
+
+import bcrypt
+import httpx
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CSV = os.path.join(ROOT, "data", "property_sales.csv")
+
+# Relative weight of each scenario in the request mix
+DEFAULT_MIX = {
+    "login": 10,
+    "sales_range": 40,
+    "sales_user": 25,
+    "create_sale": 20,
+    "predict_months": 5,
+}
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE users (
+        id VARCHAR PRIMARY KEY,
+        email VARCHAR UNIQUE NOT NULL,
+        hashed_password VARCHAR NOT NULL,
+        role VARCHAR NOT NULL,
+        name VARCHAR,
+        surname VARCHAR
+    )""",
+    """CREATE TABLE property_sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        datesold DATE NOT NULL,
+        price FLOAT NOT NULL,
+        postcode VARCHAR NOT NULL,
+        property_type VARCHAR NOT NULL,
+        bedrooms INTEGER NOT NULL,
+        user_id VARCHAR REFERENCES users(id),
+        is_outlier BOOLEAN NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX property_sales_user_datesold_idx ON property_sales (user_id, datesold DESC, id DESC)",
+    """CREATE TABLE revoked_tokens (
+        jti VARCHAR PRIMARY KEY,
+        expires_at TIMESTAMP NOT NULL
+    )""",
+]
+
+
+def seed_database(database_url, n_users, sales_per_user, seed):
+    """Create the schema and load the CSV plus benchmark users and their sales."""
+    rng = random.Random(seed)
+    engine = create_engine(database_url)
+    sales = pd.read_csv(SEED_CSV)
+    sales = sales.rename(columns={"date_sold": "datesold"})
+    sales["datesold"] = pd.to_datetime(sales["datesold"]).dt.strftime("%Y-%m-%d")
+    sales["postcode"] = sales["postcode"].astype(str)
+    sales["user_id"] = None
+
+    # Every benchmark user shares one password so logins exercise bcrypt for real
+    hashed_password = bcrypt.hashpw(b"benchmark", bcrypt.gensalt()).decode("utf-8")
+    users = [
+        {"id": str(uuid.UUID(int=rng.getrandbits(128))), "email": f"bench{i}@example.com",
+         "hashed_password": hashed_password, "role": "user"}
+        for i in range(n_users)
+    ]
+    owned = sales.sample(n=min(len(sales), n_users * sales_per_user), random_state=seed).index
+    sales.loc[owned, "user_id"] = [users[i % n_users]["id"] for i in range(len(owned))]
+
+    with engine.begin() as conn:
+        for statement in SQLITE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(
+            text("INSERT INTO users (id, email, hashed_password, role) VALUES (:id, :email, :hashed_password, :role)"),
+            users,
+        )
+        conn.execute(
+            text("""
+                INSERT INTO property_sales (datesold, price, postcode, property_type, bedrooms, user_id)
+                VALUES (:datesold, :price, :postcode, :property_type, :bedrooms, :user_id)
+            """),
+            sales[["datesold", "price", "postcode", "property_type", "bedrooms", "user_id"]].to_dict(orient="records"),
+        )
+    engine.dispose()
+    return [user["email"] for user in users]
+
+
+def start_server(database_url, port):
+    """Start uvicorn on the API and wait until it accepts requests."""
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=ROOT)
+    # Every simulated user logs in from this machine: lift the brute-force limits
+    env.setdefault("LOGIN_LIMIT_PER_IP", "1000000/1")
+    env.setdefault("LOGIN_LIMIT_PER_EMAIL", "1000000/1")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API server exited during start-up")
+        try:
+            if httpx.get(f"{url}/openapi.json", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API server did not start within 60 seconds")
+
+
+class LoadTest:
+    """Weighted request mix driven by concurrent asyncio workers."""
+
+    def __init__(self, url, emails, password, mix, seed):
+        self.url = url
+        self.emails = emails
+        self.password = password
+        self.scenarios = list(mix)
+        self.weights = [mix[name] for name in self.scenarios]
+        self.seed = seed
+        self.sessions = {}
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def login(self, client, email):
+        response = await client.post("/login", data={"username": email, "password": self.password})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        me = await client.get("/users/me", headers=headers)
+        me.raise_for_status()
+        self.sessions[email] = {"headers": headers, "id": me.json()["id"]}
+
+    async def timed(self, route, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        self.latencies[route].append(time.perf_counter() - start)
+        if failed:
+            self.errors[route] += 1
+
+    def request(self, client, scenario, rng):
+        email = rng.choice(self.emails)
+        session = self.sessions[email]
+        if scenario == "login":
+            data = {"username": email, "password": self.password}
+            return "POST /login", client.post("/login", data=data)
+        if scenario == "sales_range":
+            start = date(rng.randint(2007, 2018), rng.randint(1, 12), 1)
+            end = date(start.year + 1, start.month, 1)
+            params = {"start_date": start.isoformat(), "end_date": end.isoformat()}
+            return "GET /sales", client.get("/sales", params=params)
+        if scenario == "sales_user":
+            return "GET /sales/user/{id}", client.get(f"/sales/user/{session['id']}", headers=session["headers"])
+        if scenario == "create_sale":
+            sale = {
+                "date_sold": date(2019, rng.randint(1, 12), rng.randint(1, 28)).isoformat(),
+                "price": float(rng.randrange(200_000, 1_500_000, 5_000)),
+                "postcode": str(rng.randint(2600, 2620)),
+                "property_type": rng.choice(["house", "unit"]),
+                "bedrooms": rng.randint(1, 5),
+            }
+            return "POST /sales", client.post("/sales", json=sale, headers=session["headers"])
+        if scenario == "predict_months":
+            params = {"year": datetime.now().year + rng.randint(1, 3), "action": rng.choice(["buy", "sell"])}
+            return "GET /predict/months", client.get("/predict/months", params=params, headers=session["headers"])
+        raise ValueError(f"Unknown scenario '{scenario}'")
+
+    async def worker(self, client, worker_id, deadline):
+        rng = random.Random(self.seed + worker_id)
+        while time.monotonic() < deadline:
+            scenario = rng.choices(self.scenarios, self.weights)[0]
+            route, request = self.request(client, scenario, rng)
+            await self.timed(route, request)
+
+    async def run(self, duration, concurrency, timeout):
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=self.url, timeout=timeout, limits=limits) as client:
+            for email in self.emails:
+                await self.login(client, email)
+            start = time.monotonic()
+            deadline = start + duration
+            await asyncio.gather(*(self.worker(client, i, deadline) for i in range(concurrency)))
+            return time.monotonic() - start
+
+    def report(self, elapsed):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies_ms = np.array(latencies) * 1000
+            routes[route] = {
+                "requests": len(latencies),
+                "errors": self.errors[route],
+                "error_rate": round(self.errors[route] / len(latencies), 4),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+                "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+            }
+        total = sum(route["requests"] for route in routes.values())
+        errors = sum(route["errors"] for route in routes.values())
+        return {
+            "total": {
+                "requests": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "throughput_rps": round(total / elapsed, 2),
+            },
+            "routes": routes,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for item in value.split(","):
+        name, weight = item.split("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}'")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load after warm-up")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent workers")
+    parser.add_argument("--users", type=int, default=10, help="Benchmark users to seed")
+    parser.add_argument("--sales-per-user", type=int, default=50)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Scenario weights, e.g. 'login=5,predict_months=0'")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="Target an already running API instead of starting one")
+    parser.add_argument("--database-url", help="Database to seed (defaults to a temporary SQLite file)")
+    parser.add_argument("--no-seed", action="store_true", help="Do not seed the database")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "load_test.json"))
+    args = parser.parse_args()
+    if args.url and not (args.database_url or args.no_seed):
+        parser.error("--url needs --database-url (the server's database) or --no-seed")
+
+    workdir = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir.name, 'bench.db')}"
+    if args.no_seed:
+        emails = [f"bench{i}@example.com" for i in range(args.users)]
+    else:
+        emails = seed_database(database_url, args.users, args.sales_per_user, args.seed)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(database_url, args.port)
+    try:
+        load_test = LoadTest(url, emails, "benchmark", args.mix, args.seed)
+        elapsed = asyncio.run(load_test.run(args.duration, args.concurrency, args.timeout))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        workdir.cleanup()
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "mix": args.mix,
+            "seed": args.seed,
+            "database": "sqlite" if args.database_url is None else database_url.split(":")[0],
+        },
+        **load_test.report(elapsed),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+    for route, stats in result["routes"].items():
+        print(f"{route:<22} {stats['throughput_rps']:>8.1f} req/s  p50 {stats['p50_ms']:>8.1f} ms  "
+              f"p95 {stats['p95_ms']:>8.1f} ms  p99 {stats['p99_ms']:>8.1f} ms  errors {stats['error_rate']:.1%}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark of the vectorised outlier flagging over a large sales table.
+
+Builds a synthetic table by resampling data/property_sales.csv with log-normal
+price noise, multiplies a small share of prices by 10 or 100 to mimic mis-keyed
+entries, and times `utils.outliers.flag_outliers` over the whole table. Reports
+time, throughput, peak traced memory (in a separate run) and how many injected errors were flagged.
+
+Usage (from the repository root):
+
+    python -m benchmarks.outliers --rows 10000000
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from utils.outliers import flag_outliers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CSV = os.path.join(ROOT, "data", "property_sales.csv")
+
+
+def synthetic_sales(n_rows, error_rate, seed):
+    rng = np.random.default_rng(seed)
+    sales = pd.read_csv(SEED_CSV).rename(columns={"date_sold": "datesold"})
+    sales["datesold"] = pd.to_datetime(sales["datesold"])
+    rows = rng.integers(0, len(sales), n_rows)
+    data = pd.DataFrame({
+        "datesold": sales["datesold"].to_numpy()[rows],
+        "price": sales["price"].to_numpy(dtype=np.float64)[rows] * rng.lognormal(0, 0.05, n_rows),
+        "property_type": pd.Categorical(sales["property_type"].to_numpy()[rows]),
+        "bedrooms": sales["bedrooms"].to_numpy()[rows],
+    })
+    injected = rng.random(n_rows) < error_rate
+    data.loc[injected, "price"] *= rng.choice([10.0, 100.0], injected.sum())
+    return data, injected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.001, help="Share of prices mis-keyed on purpose")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "outliers.json"))
+    args = parser.parse_args()
+
+    data, injected = synthetic_sales(args.rows, args.error_rate, args.seed)
+
+    start = time.perf_counter()
+    flags = flag_outliers(data)
+    elapsed = time.perf_counter() - start
+
+    # Tracing slows allocations down, so memory is measured in a second run
+    tracemalloc.start()
+    flag_outliers(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(args.rows / elapsed),
+        "peak_mb": round(peak / 2**20, 1),
+        "flagged": int(flags.sum()),
+        "injected": int(injected.sum()),
+        "injected_flagged": int((flags & injected).sum()),
+    }
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"rows": args.rows, "error_rate": args.error_rate, "seed": args.seed},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Flagged {results['flagged']:,} of {args.rows:,} sales in {results['seconds']:.2f}s "
+          f"({results['rows_per_second']:,} rows/s, peak {results['peak_mb']} MB)")
+    print(f"Injected errors flagged: {results['injected_flagged']:,} of {results['injected']:,}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
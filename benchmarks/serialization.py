@@ -0,0 +1,96 @@
+"""Benchmark of bulk response serialisation per format.
+
+Encodes the sales data (repeated to the requested size) the way `GET /sales`
+used to, through `to_dict(orient="records")`, response-model validation and
+FastAPI's JSON encoder, and with each format `utils.serialization` negotiates.
+Reports the encoding time and the payload size, raw and gzipped.
+
+Usage (from the repository root):
+
+    python -m benchmarks.serialization --rows 100000 --repeat 5
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from utils.serialization import ARROW_STREAM, JSON, PARQUET, encode_frame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CSV = os.path.join(ROOT, "data", "property_sales.csv")
+
+
+def sales_frame(n_rows):
+    data = pd.read_csv(SEED_CSV).rename(columns={"date_sold": "datesold"})
+    data = pd.concat([data] * (n_rows // len(data) + 1), ignore_index=True).head(n_rows)
+    data["datesold"] = pd.to_datetime(data["datesold"]).dt.date
+    data["postcode"] = data["postcode"].astype(str)
+    data.insert(0, "id", range(1, len(data) + 1))
+    data["user_id"] = [uuid.uuid4() for _ in range(len(data))]
+    return data
+
+
+def response_model_json(data):
+    # The previous path: per-row dicts, validated against List[Dict[str, Any]]
+    records = TypeAdapter(List[Dict[str, Any]]).validate_python(data.to_dict(orient="records"))
+    return json.dumps(jsonable_encoder(records), separators=(",", ":")).encode("utf-8")
+
+
+FORMATS = {
+    "response_model": response_model_json,
+    "orjson_records": lambda data: encode_frame(data, JSON, "records"),
+    "orjson_columns": lambda data: encode_frame(data, JSON, "columns"),
+    "arrow_stream": lambda data: encode_frame(data, ARROW_STREAM),
+    "parquet": lambda data: encode_frame(data, PARQUET),
+}
+
+
+def measure(encode, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = encode(data)
+        timings.append(time.perf_counter() - start)
+    return {
+        "ms": round(min(timings) * 1000, 2),
+        "bytes": len(payload),
+        "gzip_bytes": len(gzip.compress(payload, compresslevel=6)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "serialization.json"))
+    args = parser.parse_args()
+
+    data = sales_frame(args.rows)
+    results = {name: measure(encode, data, args.repeat) for name, encode in FORMATS.items()}
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"rows": args.rows, "repeat": args.repeat},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = results["response_model"]["ms"]
+    print(f"{'format':<16} {'ms':>9} {'speedup':>8} {'bytes':>12} {'gzip bytes':>12}")
+    for name, stats in results.items():
+        speedup = baseline / stats["ms"] if stats["ms"] else float("inf")
+        print(f"{name:<16} {stats['ms']:>9.1f} {speedup:>7.1f}x {stats['bytes']:>12,} {stats['gzip_bytes']:>12,}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,14 @@ from page.login_page import login_page
 from page.signup_page import signup_page
 from page.streamlit_app import app_page
 from utils.init_session import init_session, reset_session
+from utils.db_handler import engine
+from utils import bundle, events, profiling
+from utils.tracing import span
+
+# Invalidate this process' caches when other processes change the data
+events.start_listener(engine)
+# Load the offline bundle before the first prediction needs it
+bundle.get_bundle()
 
 init_session()
 
@@ -16,7 +24,9 @@ for input_param in st.session_state['extra_input_params'].keys():
 
 
 if st.session_state['authenticated']:
-    app_page()
+    # One trace per render, with a span per pipeline stage
+    with span("app_page", role=st.session_state.get('role') or "guest"), profiling.profiled("app_page"):
+        app_page()
 else:
     if st.session_state['page'] == 'login':
         reset_session()
@@ -1,6 +1,52 @@
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from utils.db_handler import DatabaseManager
-import time
+from utils.rate_limit import client_ip, check_login
+
+# Credential checks (bcrypt plus database round trips) run here, off the script thread
+AUTH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="auth")
+
+# Seconds between checks of a pending login
+POLL_SECONDS = 0.2
+
+
+def session_ip():
+    return client_ip(st.context.headers, "local")
+
+
+def check_credentials(email, password):
+    """Role of the user if the credentials are valid, else None."""
+    if not DatabaseManager.authenticate_user(email, password):
+        return None
+    return DatabaseManager.get_user_role(email)
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def login_progress():
+    # Reruns on its own until the credential check finishes, then reruns the whole app
+    email, future = st.session_state["login_pending"]
+    if not future.done():
+        st.status("Checking credentials...", state="running")
+        return
+    del st.session_state["login_pending"]
+    try:
+        user_role = future.result()
+    except Exception as e:
+        print(f"Login failed: {e}")
+        user_role = None
+    if user_role is None:
+        st.session_state["login_error"] = "Invalid login credentials"
+    else:
+        st.session_state['authenticated'] = True
+        st.session_state['email'] = email
+        st.session_state['guest_mode'] = False
+
+        # ✅ Guardar el rol del usuario
+        st.session_state['role'] = user_role
+
+        st.session_state['page'] = 'app'
+    st.rerun()
+
 
 # Pages
 def login_page(guest_mode=False):
@@ -19,23 +65,26 @@ def login_page(guest_mode=False):
             email = st.text_input("E-mail")
             password = st.text_input("Password", type="password")
 
-            if st.button("Login"):
-                time.sleep(2)
+            if "signup_notice" in st.session_state:
+                st.success(st.session_state.pop("signup_notice"))
+
+            pending = "login_pending" in st.session_state
+            if st.button("Login", disabled=pending):
                 if not (email and password):
                     st.error("Please provide email and password")
-                elif DatabaseManager.authenticate_user(email, password):
-                    st.session_state['authenticated'] = True
-                    st.session_state['email'] = email
-                    st.session_state['guest_mode'] = False
-                    
-                    # ✅ Obtener y guardar el rol del usuario
-                    user_role = DatabaseManager.get_user_role(email)
-                    st.session_state['role'] = user_role
-                    
-                    st.session_state['page'] = 'app'
-                    st.rerun()
                 else:
-                    st.error("Invalid login credentials")
+                    # Token buckets per address and per account instead of a fixed delay
+                    wait = check_login(session_ip(), email)
+                    if wait:
+                        st.error(f"Too many login attempts. Try again in {wait:.0f} seconds.")
+                    else:
+                        st.session_state["login_pending"] = (email, AUTH_EXECUTOR.submit(check_credentials, email, password))
+                        pending = True
+
+            if pending:
+                login_progress()
+            elif "login_error" in st.session_state:
+                st.error(st.session_state.pop("login_error"))
 
             if st.button("Sign Up"):
                 st.session_state['page'] = 'signup'
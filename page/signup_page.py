@@ -1,7 +1,8 @@
 import streamlit as st
 import re
 from utils.db_handler import DatabaseManager
-import time
+from utils.rate_limit import check_signup
+from page.login_page import AUTH_EXECUTOR, POLL_SECONDS, session_ip
 
 def is_valid_email(email):
     email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -13,6 +14,28 @@ def input_field(input_param, type):
     elif type == 'number':
         st.session_state[input_param] = st.number_input(input_param, step=1)
 
+@st.fragment(run_every=POLL_SECONDS)
+def signup_progress():
+    # Reruns on its own until the registration finishes
+    future = st.session_state["signup_pending"]
+    if not future.done():
+        st.status("Creating your account...", state="running")
+        return
+    del st.session_state["signup_pending"]
+    try:
+        created = future.result()
+    except Exception as e:
+        print(f"Registration failed: {e}")
+        created = None
+    if created:
+        st.session_state["signup_notice"] = "Registration successful, you can now log in"
+        st.session_state['page'] = 'login'
+    elif created is False:
+        st.session_state["signup_error"] = "User already exists"
+    else:
+        st.session_state["signup_error"] = "Registration failed. Please try again."
+    st.rerun()
+
 def signup_page(extra_input_params=False, confirmPass=False):
     if st.button("Back to Login"):
         st.session_state['page'] = 'login'
@@ -41,19 +64,24 @@ def signup_page(extra_input_params=False, confirmPass=False):
             if extra_input_params and not all(st.session_state.get(param) for param in st.session_state['extra_input_params']):
                 st.error("Please fill in all required fields")
             else:
-                if st.button("Register"):
-                    if DatabaseManager.verify_duplicate_user(st.session_state['email']):
-                        st.error("User already exists")
+                pending = "signup_pending" in st.session_state
+                if st.button("Register", disabled=pending):
+                    wait = check_signup(session_ip())
+                    if wait:
+                        st.error(f"Too many registrations. Try again in {wait / 60:.0f} minutes.")
                     else:
                         extra_params_values = {param.lower(): st.session_state.get(param) for param in st.session_state['extra_input_params']}
                         role = "user"  
-                        if DatabaseManager.save_user(st.session_state['email'], st.session_state['password'], role, extra_params_values):
-                            st.success("Registration successful")
-                            time.sleep(1)
-                            st.session_state['page'] = 'login'
-                            st.rerun()
-                        else: 
-                            st.error("Registration failed. Please try again.")
+                        # One INSERT ... ON CONFLICT round trip reports duplicates, off the script thread
+                        st.session_state["signup_pending"] = AUTH_EXECUTOR.submit(
+                            DatabaseManager.register_user, st.session_state['email'], st.session_state['password'], role, extra_params_values
+                        )
+                        pending = True
+
+                if pending:
+                    signup_progress()
+                elif "signup_error" in st.session_state:
+                    st.error(st.session_state.pop("signup_error"))
         else:
             if confirmPass and st.session_state['password'] != confirm_password:
                 st.error("Passwords do not match")
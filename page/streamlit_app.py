@@ -1,7 +1,61 @@
 import streamlit as st
 import pandas as pd
-from utils.data_manipulation import filter_data, make_prediction, prediction_graph
+import tempfile
+from utils.data_manipulation import (
+    filter_data, make_prediction, prediction_graph, segment_series, compare_forecasts, comparison_graph, segment_label,
+    month_calendar, calendar_graph,
+)
 from utils.db_handler import DatabaseManager
+from utils import bundle
+from utils.tracing import span
+from utils.memory_cache import MEMORY_BUDGET, process_memory
+from utils.admission import ADMISSION
+from utils import profiling
+from utils.export import write_export, export_format, EXPORT_FORMATS
+from utils.pagination import page_controls, reset_page
+
+# Rows rendered per page in the sales history and user tables
+PAGE_SIZE = 20
+
+def comparison_view(raw_data, property_types, num_rooms, exclude_outliers, selected_year, action):
+    # One segment per property type and number of rooms, all built in one pass over the sales
+    segments = [((property_type,), (rooms,)) for property_type in property_types for rooms in num_rooms]
+    with span("segment_series", rows_in=len(raw_data), segments=len(segments)) as stage:
+        series = segment_series(raw_data, segments, exclude_outliers)
+        stage.set("segments_found", len(series))
+    if not series:
+        st.write("No sales found for the selected segments.")
+        return
+
+    # Best and worst month of the selected year for each segment
+    with span("compare_forecasts", purpose="kpi", granularity="Month", segments=len(series)):
+        monthly = compare_forecasts(series, "Month", selected_year)
+    rows = []
+    for segment, forecast in monthly.items():
+        forecast = forecast[forecast['time'].dt.year == selected_year]
+        if forecast.empty:
+            continue
+        highest = forecast.loc[forecast['price'].idxmax()]
+        lowest = forecast.loc[forecast['price'].idxmin()]
+        best, worst = (lowest, highest) if action == "Buy" else (highest, lowest)
+        rows.append({
+            "Segment": segment_label(segment),
+            f"Best Month to {action}": best['time'].strftime("%B"),
+            "Estimated Price": f"${best['price']:,.0f}".replace(",", "."),
+            f"Worst Month to {action}": worst['time'].strftime("%B"),
+            "Estimated Price (worst)": f"${worst['price']:,.0f}".replace(",", "."),
+            "Difference": f"${highest['price'] - lowest['price']:,.0f}".replace(",", "."),
+        })
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    st.write("\n" * 5)
+
+    # Every segment in one chart
+    granularity = st.selectbox("Select the time unit of the graph", ["Month", "Quarter", "Year"], key="compare_granularity")
+    with span("compare_forecasts", purpose="graph", granularity=granularity, segments=len(series)):
+        forecasts = compare_forecasts(series, granularity, selected_year)
+    with span("comparison_graph", granularity=granularity):
+        final_chart = comparison_graph(series, forecasts, granularity)
+    st.altair_chart(final_chart, use_container_width=True)
 
 def app_page():
     print(st.session_state["email"])
@@ -39,6 +93,8 @@ def app_page():
     with col2:
         property_types = st.multiselect("Select the property type", ["House", "Unit"], default=["House", "Unit"])
         property_types = [property.lower() for property in property_types]
+        exclude_outliers = st.checkbox("Exclude outlier prices", value=True, help="Ignore sales whose price is far from similar properties sold the same year")
+        compare = st.checkbox("Compare segments", value=False, help="Forecast each selected property type and number of rooms separately")
     with col3:
         if "house" in property_types and "unit" not in property_types:
             num_rooms = st.multiselect("Select number of rooms", options=[2, 3, 4, 5], default=[2,3,4,5])
@@ -52,8 +108,17 @@ def app_page():
     st.write("\n" * 10)
 
 
-    # Load data
-    raw_data = DatabaseManager.load_data()
+    # Load data, from the offline bundle if the database is unreachable
+    with span("load_data") as stage:
+        raw_data = DatabaseManager.load_data()
+        if raw_data is None:
+            stage.set("source", "bundle")
+            raw_data = bundle.load_sales()
+            if raw_data is None:
+                st.error("The database is unavailable and no offline data is installed.")
+                return
+            st.warning(f"The database is unavailable: showing offline data up to {bundle.get_bundle().manifest['last_date']}.")
+        stage.set("rows", len(raw_data))
 
     # Time parameters
     today = pd.Timestamp.today()     
@@ -73,27 +138,31 @@ def app_page():
     st.write("\n" * 5)
 
 
-    if property_types and num_rooms:
+    if property_types and num_rooms and compare:
+        comparison_view(raw_data, property_types, num_rooms, exclude_outliers, selected_year, action)
+
+    elif property_types and num_rooms:
         # Data transformation
-        data_filtered = filter_data(raw_data, property_types, num_rooms)
+        with span("filter_data", rows_in=len(raw_data)) as stage:
+            data_filtered = filter_data(raw_data, property_types, num_rooms, exclude_outliers)
+            stage.set("rows", len(data_filtered))
 
         # Make prediction
         today = data_filtered['time'].max()
         selected_date = pd.Timestamp(year=selected_year, month=12, day=31)
         steps = (selected_date.year - today.year) * 12 + selected_date.month - today.month
-        future_price_KPI = make_prediction(data_filtered, steps, "Month")
-
-        # KPI Calculation
-        future_price_KPI = future_price_KPI[future_price_KPI['time'].dt.year == selected_year]
+        with span("make_prediction", purpose="kpi", granularity="Month", steps=steps, rows_in=len(data_filtered)):
+            future_price_KPI = make_prediction(data_filtered, steps, "Month")
 
-        max_price_month = future_price_KPI.loc[future_price_KPI['price'].idxmax()]
-        min_price_month = future_price_KPI.loc[future_price_KPI['price'].idxmin()]
+        # KPI Calculation: highest and lowest priced months of the selected year
+        with span("month_calendar", rows_in=len(future_price_KPI)):
+            kpis = month_calendar(future_price_KPI).year(selected_year, "sell")
 
         col1, col2, col3 = st.columns(3)
-        best_month = max_price_month['time'].strftime("%B")
-        worst_month = min_price_month['time'].strftime("%B")
-        best_price = max_price_month['price']
-        worst_price = min_price_month['price']
+        best_month = kpis['best_month']
+        worst_month = kpis['worst_month']
+        best_price = kpis['best_price']
+        worst_price = kpis['worst_price']
 
         if action == "Buy":
             with col1:
@@ -130,11 +199,28 @@ def app_page():
             steps = selected_date.year - today.year
 
         # Make prediction
-        future_price_graph = make_prediction(data_filtered, steps, granularity)
-        final_chart = prediction_graph(data_filtered, future_price_graph, granularity)
+        with span("make_prediction", purpose="graph", granularity=granularity, steps=steps, rows_in=len(data_filtered)):
+            future_price_graph = make_prediction(data_filtered, steps, granularity)
+        with span("prediction_graph", granularity=granularity):
+            final_chart = prediction_graph(data_filtered, future_price_graph, granularity)
         
         # Display 
         st.altair_chart(final_chart, use_container_width=True)
+
+        # Best month of every year up to the selected one
+        if st.checkbox(f"Show the best month to {action.lower()} of every year"):
+            with span("calendar_graph", rows_in=len(future_price_KPI)):
+                calendar_chart = calendar_graph(future_price_KPI, action.lower())
+                calendar_kpis = month_calendar(future_price_KPI).kpis(action.lower())
+            st.altair_chart(calendar_chart, use_container_width=True)
+            st.dataframe(
+                calendar_kpis.assign(spread_pct=calendar_kpis["spread_pct"].round(1)).rename(columns={
+                    "year": "Year", "months": "Months", "best_month": f"Best Month to {action}", "best_price": "Estimated Price",
+                    "worst_month": f"Worst Month to {action}", "worst_price": "Estimated Price (worst)",
+                    "spread": "Difference", "spread_pct": "Difference (% of mean)",
+                }).style.format({"Estimated Price": "${:,.0f}", "Estimated Price (worst)": "${:,.0f}", "Difference": "${:,.0f}"}),
+                hide_index=True, use_container_width=True,
+            )
         
     else:
         st.write("Please select a property type to make a prediction.")
@@ -149,10 +235,10 @@ def app_page():
         user_id = DatabaseManager.get_user_id(user_email)  # Asegúrate de que devuelve solo el UUID
 
         if user_id:
-            # Obtener ventas asociadas al usuario
-            user_sales = DatabaseManager.get_sales_by_user(user_id)
+            # Obtener solo la página visible de ventas asociadas al usuario
+            total_sales = DatabaseManager.count_sales_by_user(user_id)
 
-            if not user_sales.empty:
+            if total_sales:
                 st.subheader("Your Sales History")
 
                 st.write("\n" * 5)
@@ -169,8 +255,11 @@ def app_page():
 
                 st.write("\n" * 5)
 
+                offset = page_controls("sales_history", total_sales, PAGE_SIZE)
+                user_sales = DatabaseManager.get_sales_by_user(user_id, limit=PAGE_SIZE, offset=offset)
+
                 # Mostrar cada venta con un botón de eliminación
-                for index, row in user_sales.iterrows():
+                for index, row in enumerate(user_sales.records()):
                     col1, _, col2, _, col3, _, col4, _, col5, _, col6 = st.columns([5, 0.7, 5, 0.7, 5, 0.7, 5, 0.7, 5, 0.7, 5])
                     col1.write(row["Date Sold"])
                     col2.write(f"${row['Price']:,.0f}".replace(",", "."))
@@ -179,11 +268,8 @@ def app_page():
                     col5.write(f"{row['Bedrooms']} rooms")
 
                     # Botón de eliminación
-                    if col6.button("Delete", key=f"delete_{index}"):
+                    if col6.button("Delete", key=f"delete_{offset + index}"):
                         DatabaseManager.delete_sale(row["Date Sold"], row["Price"], user_id)
-                        filter_data.clear()
-                        make_prediction.clear()
-                        prediction_graph.clear()
                         st.success("Sale deleted successfully!")
                         st.rerun()  # Recargar la página para actualizar la lista
             else:
@@ -241,9 +327,6 @@ def app_page():
                         }
 
                         DatabaseManager.insert_sale(new_entry)
-                        filter_data.clear()
-                        make_prediction.clear()
-                        prediction_graph.clear()
                         st.rerun()
                         st.success("Form successfully submitted!")
                     else:
@@ -255,15 +338,13 @@ def app_page():
             st.write("\n" * 5)
             st.write("\n" * 5)
 
-            # Filtro por correo electrónico
-            email_filter = st.text_input("🔍 Filter by email", "")
-            
-            # Obtener todos los usuarios
-            users = DatabaseManager.get_all_users()
+            # Filtro por correo electrónico (se aplica en la base de datos)
+            email_filter = st.text_input("🔍 Filter by email", "", on_change=reset_page, args=("users",))
+            total_users = DatabaseManager.count_users(email_filter)
+            offset = page_controls("users", total_users, PAGE_SIZE)
 
-            # Filtrar los usuarios por correo electrónico, si hay un filtro
-            if email_filter:
-                users = users[users['email'].str.contains(email_filter, case=False, na=False)]
+            # Obtener solo la página visible de usuarios
+            users = DatabaseManager.get_all_users(email_filter, limit=PAGE_SIZE, offset=offset)
             
             # Mostrar la tabla de usuarios
             col1, col2, col3 = st.columns([4, 3, 2])
@@ -272,11 +353,11 @@ def app_page():
             col3.write("🗑️ Actions")
 
             # Mostrar los usuarios filtrados
-            for index, user in users.iterrows():
+            for index, user in enumerate(users.records()):
                 col1, col2, col3 = st.columns([4, 3, 2])
                 col1.write(user["email"])
                 col2.write(user["role"])
-                if col3.button("Delete", key=f"del_user_{index}"):
+                if col3.button("Delete", key=f"del_user_{offset + index}"):
                     DatabaseManager.delete_user(user["email"])
                     st.success(f"Deleted user {user['email']}")
                     st.rerun()
@@ -293,32 +374,82 @@ def app_page():
                     else:
                         st.warning("Please enter a valid email and role.")
 
+            with st.expander("🩺 Diagnostics"):
+                # Memory held by the budgeted caches of this Streamlit process
+                report = MEMORY_BUDGET.report()
+                total = report.pop("total")
+                memory = process_memory()
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Cache memory", f"{total['bytes'] / 2**20:,.1f} MB", f"of {total['budget_bytes'] / 2**20:,.0f} MB budget", delta_color="off")
+                if memory["resident_bytes"] is not None:
+                    col2.metric("Process memory", f"{memory['resident_bytes'] / 2**20:,.0f} MB")
+                if memory["peak_resident_bytes"] is not None:
+                    col3.metric("Peak process memory", f"{memory['peak_resident_bytes'] / 2**20:,.0f} MB")
+
+                caches = pd.DataFrame.from_dict(report, orient="index")
+                caches["MB"] = (caches.pop("bytes") / 2**20).round(2)
+                caches["compute_seconds"] = caches["compute_seconds"].round(2)
+                st.dataframe(caches)
+                if st.button("Clear caches"):
+                    MEMORY_BUDGET.clear()
+                    st.rerun()
+
+                st.write("Connection pool")
+                st.json(DatabaseManager.pool_status())
+
+                st.write("Forecast slots")
+                st.json(ADMISSION.snapshot())
+
+                # Profile the next runs of a code path in every process
+                st.write("Profiling")
+                col1, col2, col3 = st.columns([2, 1, 1])
+                target = col1.selectbox("Code path", profiling.TARGETS, key="profiling_target")
+                runs = col2.number_input("Runs", min_value=0, max_value=profiling.MAX_RUNS, value=5, key="profiling_runs")
+                if col3.button("Profile", help="0 runs stops profiling"):
+                    profiling.arm(target, int(runs))
+                st.json(profiling.status())
+
 
         if role == "analyst":
             st.markdown("---")
             st.subheader("📊 Data Export (Analysts only)")
 
-            # Cargar los datos de ventas desde la base de datos
-            data = DatabaseManager.load_data()
+            # Cargar solo una vista previa de los datos de ventas
+            preview = DatabaseManager.get_sales_preview()
 
-            if data is not None:
-                if 'user_id' in data.columns:
-                    data = data.drop(columns=['user_id'])
+            if preview is not None:
                 # Mostrar los primeros registros como ejemplo
                 st.write("These are the first registers of sales data: ")
-                st.dataframe(data.head())  # Muestra una vista previa de los primeros datos
-
-                # Crear un archivo CSV de los datos cargados desde la base de datos
-                csv = data.to_csv(index=False)
-
-                # Crear un botón para permitir la descarga del archivo CSV
-                st.markdown("### 📥 Download Data as CSV")
-                st.download_button(
-                    label="Download CSV",
-                    data=csv,
-                    file_name="sales_data.csv",
-                    mime="text/csv"
-                )
+                st.dataframe(preview)
+
+                st.markdown("### 📥 Download Data")
+                export_choice = st.selectbox("Export format", ["CSV", "CSV (gzip)", "Parquet"])
+                file_format = "parquet" if export_choice == "Parquet" else "csv"
+                compress = export_choice == "CSV (gzip)"
+
+                # The export is only generated on request, streamed in chunks to a temporary file
+                if st.button("Prepare export"):
+                    export_file = tempfile.TemporaryFile()
+                    try:
+                        write_export(export_file, file_format, compress)
+                    except Exception as e:
+                        export_file.close()
+                        st.error(f"Export failed: {e}")
+                    else:
+                        if st.session_state.get("export_file") is not None:
+                            st.session_state["export_file"].close()
+                        st.session_state["export_file"] = export_file
+                        st.session_state["export_format"] = export_format(file_format, compress)
+
+                if st.session_state.get("export_file") is not None:
+                    mime, file_name = EXPORT_FORMATS[st.session_state["export_format"]]
+                    st.session_state["export_file"].seek(0)
+                    st.download_button(
+                        label=f"Download {file_name}",
+                        data=st.session_state["export_file"],
+                        file_name=file_name,
+                        mime=mime
+                    )
             else:
                 st.warning("No data available to download.")
 
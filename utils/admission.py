@@ -0,0 +1,138 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+from utils import tracing
+from utils.rate_limit import bucket_from_env
+
+
+# Forecasts computed at once by each process; by default the cores are shared between the API workers
+FORECAST_SLOTS = int(os.getenv(
+    "FORECAST_SLOTS",
+    max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", 1)))),
+))
+
+# Seconds an API request may wait for a forecast slot before it is turned away
+FORECAST_DEADLINE_SECONDS = float(os.getenv("FORECAST_DEADLINE_SECONDS", 20))
+
+# Forecast requests per user: 30 a minute
+FORECAST_PER_USER = bucket_from_env("FORECAST_LIMIT_PER_USER", "30/60")
+
+# Monotonic time by which the request running in this context needs its forecast (None to wait as long as it takes)
+_deadline = contextvars.ContextVar("forecast_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """No forecast slot can be had before the caller's deadline."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Forecasting is at capacity, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounds concurrent forecasts with a semaphore and sheds queued callers that would miss their deadline.
+
+    The expected wait of a new caller is estimated from the callers ahead of it
+    and the recent average forecast time, so requests that cannot be served in
+    time are rejected at once rather than after waiting for nothing.
+    """
+
+    def __init__(self, slots, window=1000):
+        self.slots = slots
+        self._semaphore = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self._service_seconds = None  # Moving average of the time a slot is held
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+
+    def expected_wait(self, ahead):
+        """Seconds until a slot frees up for a caller with `ahead` callers queued before it."""
+        if self.running + ahead < self.slots:
+            return 0.0
+        service = self._service_seconds or 1.0
+        return (ahead // self.slots + 1) * service
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold a forecast slot for the enclosed block, or raise Overloaded."""
+        deadline = _deadline.get()
+        start = time.monotonic()
+        with self._lock:
+            expected = self.expected_wait(self.waiting)
+            if deadline is not None and start + expected > deadline:
+                self.shed += 1
+                raise Overloaded(expected)
+            self.waiting += 1
+        try:
+            acquired = self._semaphore.acquire(timeout=None if deadline is None else max(deadline - start, 0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        waited = time.monotonic() - start
+        if not acquired:
+            with self._lock:
+                self.timeouts += 1
+                expected = self.expected_wait(self.waiting)
+            raise Overloaded(expected)
+
+        with self._lock:
+            self.running += 1
+            self.admitted += 1
+            self._waits.append(waited)
+            self.max_wait = max(self.max_wait, waited)
+        tracing.annotate("admission.wait_ms", round(waited * 1000, 1))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            with self._lock:
+                self.running -= 1
+                self._service_seconds = held if self._service_seconds is None else 0.8 * self._service_seconds + 0.2 * held
+            self._semaphore.release()
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            state = {
+                "slots": self.slots,
+                "running": self.running,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "timeouts": self.timeouts,
+                "service_avg_ms": round(1000 * (self._service_seconds or 0.0), 3),
+            }
+        p95 = waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+        state.update({
+            "wait_avg_ms": round(1000 * sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95_ms": round(1000 * p95, 3),
+            "wait_max_ms": round(1000 * self.max_wait, 3),
+        })
+        return state
+
+
+ADMISSION = AdmissionController(FORECAST_SLOTS)
+
+
+def forecast_slot():
+    return ADMISSION.slot()
+
+
+def set_deadline(seconds=FORECAST_DEADLINE_SECONDS):
+    """Give the forecasts of the request running in this context `seconds` to start."""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def check_user(subject):
+    """Seconds the user must wait before another forecast request (0 if it may proceed)."""
+    return FORECAST_PER_USER.consume(subject)
@@ -0,0 +1,299 @@
+"""Offline bundle: a versioned sales snapshot with precomputed forecasts.
+
+The app and the API read it at boot so the first forecasts need no fit, and
+serve from it when the database is unreachable. A bundle lives in its own
+version directory; the `current` pointer file is switched atomically once a new
+one is complete, and running processes pick it up on their next check. Its
+sales are stored as Parquet partitioned by year, so reads over a date range
+only open the files of the years they cover.
+
+Build one from the seed CSV (or from the database with `--source db`):
+
+    python -m utils.bundle
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from utils.memory_cache import budget_cache
+
+try:
+    import pyarrow  # noqa: F401  (Parquet support for pandas)
+except ImportError:  # Without pyarrow there is no bundle
+    pyarrow = None
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CSV = os.path.join(ROOT, "data", "property_sales.csv")
+
+BUNDLE_DIR = os.getenv("BUNDLE_DIR", os.path.join(ROOT, "bundle"))
+
+# Seconds between checks of the `current` pointer for a fresher bundle
+CHECK_SECONDS = int(os.getenv("BUNDLE_CHECK_SECONDS", 30))
+
+# Bundle versions kept on disk, the current one included
+KEEP_VERSIONS = 2
+
+POINTER = "current"
+MANIFEST = "manifest.json"
+SALES_DIR = "sales"  # One year=YYYY directory of Parquet files per year
+SALES_FILE = "sales.parquet"  # Single file of bundles built before partitioning
+FORECASTS_FILE = "forecasts.parquet"
+
+# Bedroom options the page offers for each property type selection
+UI_BEDROOMS = {
+    ("house",): [2, 3, 4, 5],
+    ("unit",): [1, 2, 3],
+    ("house", "unit"): [1, 2, 3, 4, 5],
+}
+
+# The page predicts up to this many years after the current one
+HORIZON_YEARS = 20
+
+Bundle = namedtuple("Bundle", ["version", "manifest", "sales_path", "forecasts"])
+
+_bundle = None
+_checked_at = None
+_bundle_lock = threading.Lock()
+
+
+def ui_segments():
+    """Default selection for each property type choice plus every single type/bedroom pair."""
+    segments = [(types, tuple(bedrooms)) for types, bedrooms in UI_BEDROOMS.items()]
+    for types, bedrooms in UI_BEDROOMS.items():
+        if len(types) == 1:
+            segments.extend((types, (n,)) for n in bedrooms)
+    return segments
+
+
+def segment_name(segment):
+    types, bedrooms = segment
+    return f"{'+'.join(types)}:{','.join(str(n) for n in bedrooms)}"
+
+
+# Building
+
+def seed_sales(path=SEED_CSV):
+    """Sales table shaped like `property_sales`, read from a CSV file."""
+    from utils.outliers import flag_outliers
+
+    data = pd.read_csv(path).rename(columns={"date_sold": "datesold"})
+    data["datesold"] = pd.to_datetime(data["datesold"]).dt.date
+    data["postcode"] = data["postcode"].astype(str)
+    data.insert(0, "id", range(1, len(data) + 1))
+    data["user_id"] = None
+    data["is_outlier"] = flag_outliers(data)
+    return data
+
+
+def horizon_steps(last_date, granularity, end_year=None):
+    """Periods from the last observation to the end of `end_year` (the furthest year the page offers by default)."""
+    end = pd.Timestamp(year=end_year or pd.Timestamp.today().year + HORIZON_YEARS, month=12, day=31)
+    last_date = pd.Timestamp(last_date)
+    months = (end.year - last_date.year) * 12 + end.month - last_date.month
+    return {"Month": months, "Quarter": months // 3 + 1, "Year": end.year - last_date.year}[granularity]
+
+
+def training_series(sales):
+    """Every series the page and the API forecast by default, by name."""
+    from utils.data_manipulation import filter_data
+
+    series = {}
+    for segment in ui_segments():
+        types, bedrooms = segment
+        series[segment_name(segment)] = filter_data(sales.copy(), list(types), list(bedrooms), True)
+    # /predict/months forecasts every sale that is not an outlier
+    series["api:predict_months"] = sales[~sales["is_outlier"].astype(bool)].rename(columns={"datesold": "time"})
+    return series
+
+
+def build_forecasts(sales, engine="prophet"):
+    from utils.forecast_engines import ENGINES
+    from utils.model_store import series_key
+
+    fit, predict = ENGINES[engine]
+    frames = []
+    for name, data in training_series(sales).items():
+        model = fit(data)
+        last_date = pd.to_datetime(data["time"]).max()
+        for granularity in ("Month", "Quarter", "Year"):
+            frame = predict(model, horizon_steps(last_date, granularity), granularity).reset_index(drop=True)
+            frames.append(frame.assign(series=name, key=series_key(data), engine=engine, granularity=granularity))
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_sales(sales, path):
+    """Write the sales as Parquet partitioned by year of sale. Returns the years written."""
+    import pyarrow.parquet as pq
+
+    years = pd.to_datetime(sales["datesold"]).dt.year
+    table = pyarrow.Table.from_pandas(sales.assign(year=years), preserve_index=False)
+    pq.write_to_dataset(table, path, partition_cols=["year"])
+    return sorted(int(year) for year in years.unique())
+
+
+def prune_versions(directory, current, keep=KEEP_VERSIONS):
+    versions = sorted(name for name in os.listdir(directory) if name.startswith("bundle-"))
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def build_bundle(sales, directory=None, source="csv"):
+    """Write a new bundle version and make it the current one."""
+    directory = directory or BUNDLE_DIR
+    version = f"bundle-{time.time_ns()}"
+    target = os.path.join(directory, version)
+    os.makedirs(target)
+
+    forecasts = build_forecasts(sales)
+    years = write_sales(sales, os.path.join(target, SALES_DIR))
+    forecasts.to_parquet(os.path.join(target, FORECASTS_FILE), index=False)
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source": source,
+        "rows": len(sales),
+        "last_date": str(max(sales["datesold"])),
+        "years": years,
+        "series": sorted(forecasts["series"].unique().tolist()),
+    }
+    with open(os.path.join(target, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    temporary = os.path.join(directory, f".{POINTER}.{os.getpid()}")
+    with open(temporary, "w") as f:
+        f.write(version)
+    os.replace(temporary, os.path.join(directory, POINTER))
+    prune_versions(directory, version)
+    return version
+
+
+# Reading
+
+def current_version(directory=None):
+    path = os.path.join(directory or BUNDLE_DIR, POINTER)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+def load_bundle(directory=None, version=None):
+    directory = directory or BUNDLE_DIR
+    version = version or current_version(directory)
+    if version is None:
+        return None
+    target = os.path.join(directory, version)
+    with open(os.path.join(target, MANIFEST)) as f:
+        manifest = json.load(f)
+    sales_path = os.path.join(target, SALES_DIR)
+    if not os.path.isdir(sales_path):
+        sales_path = os.path.join(target, SALES_FILE)
+    forecasts = {
+        (key, engine, granularity): frame.drop(columns=["series", "key", "engine", "granularity"]).reset_index(drop=True)
+        for (key, engine, granularity), frame in pd.read_parquet(os.path.join(target, FORECASTS_FILE)).groupby(
+            ["key", "engine", "granularity"], sort=False
+        )
+    }
+    return Bundle(version, manifest, sales_path, forecasts)
+
+
+def get_bundle():
+    """Return the current bundle, switching to a fresher one when the pointer moves (None if there is none)."""
+    global _bundle, _checked_at
+    if pyarrow is None:
+        return None
+    with _bundle_lock:
+        if _checked_at is not None and time.monotonic() - _checked_at < CHECK_SECONDS:
+            return _bundle
+        _checked_at = time.monotonic()
+        try:
+            version = current_version()
+            if version is not None and (_bundle is None or _bundle.version != version):
+                _bundle = load_bundle(version=version)
+        except Exception as e:
+            # Keep serving the bundle already loaded
+            print(f"Failed to load the offline bundle: {e}")
+        return _bundle
+
+
+@budget_cache
+def read_sales(path, first_year=None, last_year=None):
+    """Bundled sales of the given years (all by default), reading only those years' partitions."""
+    if not os.path.isdir(path):
+        sales = pd.read_parquet(path)
+        years = pd.to_datetime(sales["datesold"]).dt.year
+        return sales[years.between(first_year or years.min(), last_year or years.max())].reset_index(drop=True)
+    filters = []
+    if first_year is not None:
+        filters.append(("year", ">=", first_year))
+    if last_year is not None:
+        filters.append(("year", "<=", last_year))
+    sales = pd.read_parquet(path, filters=filters or None).drop(columns="year")
+    # Partitions come back year by year: restore the table order
+    return sales.sort_values("id", kind="stable").reset_index(drop=True)
+
+
+def load_sales(start_date=None, end_date=None):
+    """The bundled sales table, optionally only the sales between two dates (both included).
+
+    None without a bundle.
+    """
+    bundle = get_bundle()
+    if bundle is None:
+        return None
+    sales = read_sales(
+        bundle.sales_path,
+        start_date.year if start_date is not None else None,
+        end_date.year if end_date is not None else None,
+    )
+    if start_date is None and end_date is None:
+        return sales
+    dates = pd.to_datetime(sales["datesold"])
+    selected = dates.between(pd.Timestamp(start_date or dates.min()), pd.Timestamp(end_date or dates.max()))
+    return sales[selected].reset_index(drop=True)
+
+
+def lookup_forecast(data, steps, granularity, engine="prophet"):
+    """Precomputed forecast of this exact series, or None if the bundle does not cover it."""
+    bundle = get_bundle()
+    if bundle is None:
+        return None
+    from utils.model_store import series_key
+
+    frame = bundle.forecasts.get((series_key(data), engine, granularity))
+    if frame is None or len(frame) < steps:
+        return None
+    return frame.head(steps).copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline sales and forecast bundle.")
+    parser.add_argument("--source", default=SEED_CSV, help="CSV file to seed from, or 'db' for the database")
+    parser.add_argument("--directory", default=BUNDLE_DIR)
+    args = parser.parse_args()
+
+    if args.source == "db":
+        from utils.db_handler import DatabaseManager
+        sales = DatabaseManager.load_data()
+        if sales is None:
+            raise SystemExit("Could not load sales from the database")
+    else:
+        sales = seed_sales(args.source)
+
+    start = time.perf_counter()
+    os.makedirs(args.directory, exist_ok=True)
+    version = build_bundle(sales, args.directory, source="db" if args.source == "db" else "csv")
+    print(f"Built {version} ({len(sales)} sales) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
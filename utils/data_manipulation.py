@@ -1,15 +1,31 @@
-import streamlit as st
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from prophet import Prophet
 import altair as alt
+from utils.forecast_engines import forecast
+from utils import bundle, events, tracing
+from utils.admission import FORECAST_SLOTS
+from utils.memory_cache import budget_cache
 
 
+# Segments forecast side by side at most
+MAX_SEGMENTS = 10
 
-@st.cache_data
-def filter_data(data_filtered, property_type, num_rooms):
+# Forecasts of a comparison run in parallel, bounded again by the admission slots
+COMPARE_EXECUTOR = ThreadPoolExecutor(max_workers=FORECAST_SLOTS, thread_name_prefix="compare")
+
+
+
+@budget_cache
+def filter_data(data_filtered, property_type, num_rooms, exclude_outliers=True):
     
     # Rename date sold column 
-    data_filtered.rename(columns={'datesold': 'time'}, inplace=True)
+    data_filtered = data_filtered.rename(columns={'datesold': 'time'})
+
+    # Drop the sales flagged as outliers at ingest
+    if exclude_outliers and 'is_outlier' in data_filtered.columns:
+        data_filtered = data_filtered[~data_filtered['is_outlier'].astype(bool)]
 
     # Filter by property type
     data_filtered = data_filtered[data_filtered['property_type'].isin(property_type)]
@@ -23,6 +39,16 @@ def filter_data(data_filtered, property_type, num_rooms):
     # Group by day
     data_filtered = data_filtered[["time", "price"]].groupby(['time']).mean().reset_index()
 
+    return monthly_series(data_filtered)
+
+
+def monthly_series(data_filtered):
+    """Monthly price series from the mean price of each sale date, interpolating the days without sales."""
+
+    # No sales match: an empty series, which callers report as such
+    if data_filtered.empty:
+        return pd.DataFrame({'time': pd.Series(dtype='datetime64[ns]'), 'price': pd.Series(dtype='float64')})
+
     # Interpolate missing values
     date_range = pd.date_range(start=data_filtered['time'].min(), end=data_filtered['time'].max())
     data_filtered = data_filtered.set_index('time').reindex(date_range).interpolate().reset_index()
@@ -39,53 +65,201 @@ def filter_data(data_filtered, property_type, num_rooms):
         
     return data_filtered
 
-@st.cache_data
-def make_prediction(data, steps, granularity):
-    # Prepare data
-    data = data.rename(columns={'time': 'ds', 'price': 'y'})
+def segment_label(segment):
+    types, bedrooms = segment
+    return f"{'/'.join(t.capitalize() for t in types)} {','.join(str(n) for n in bedrooms)} bed"
 
-    # Fit model
-    model = Prophet()
-    model.fit(data)
-    
-    # Create future dataframe based on granularity
-    if granularity == "Month":
-        future = model.make_future_dataframe(periods=steps, freq='M')
-    if granularity == "Quarter":
-        future = model.make_future_dataframe(periods=steps, freq='Q')
-    elif granularity == "Year":
-        future = model.make_future_dataframe(periods=steps, freq='Y')
-
-    forecast = model.predict(future)
-    
-    # Round the predicted price to the nearest integer
-    forecast['yhat'] = forecast[['yhat']].round(0)
-    
-    # Return the predicted price at the specified time
-    forecast = forecast.rename(columns={'ds': 'time', 'yhat': 'price', 'yhat_lower': 'lowest price', 'yhat_upper': 'highest price'})
-    return forecast[['time', 'price', 'lowest price', 'highest price']].tail(steps)
+
+@budget_cache
+def segment_series(data, segments, exclude_outliers=True):
+    """Monthly series of several segments, each as `filter_data` builds it, from one pass over the sales.
+
+    `segments` is a list of (property types, bedrooms) pairs. The sales are
+    summed and counted once per day, type and bedrooms; every segment then
+    combines the rows of that much smaller table. Returns {segment: series},
+    leaving out segments without sales.
+    """
+    if exclude_outliers and 'is_outlier' in data.columns:
+        data = data[~data['is_outlier'].astype(bool)]
+    daily = data.groupby(['datesold', 'property_type', 'bedrooms'], sort=False)['price'].agg(['sum', 'count']).reset_index()
+
+    series = {}
+    for segment in segments:
+        types, bedrooms = segment
+        rows = daily[daily['property_type'].isin(types) & daily['bedrooms'].isin(bedrooms)]
+        if rows.empty:
+            continue
+        totals = rows.groupby('datesold')[['sum', 'count']].sum()
+        means = pd.DataFrame({'time': totals.index, 'price': (totals['sum'] / totals['count']).to_numpy()})
+        series[tuple(segment)] = monthly_series(means)
+    return series
+
+
+def compare_forecasts(series, granularity, end_year):
+    """Forecast every series up to the end of `end_year`, in parallel. Returns {segment: forecast}."""
+    futures = {}
+    for segment, data in series.items():
+        steps = bundle.horizon_steps(data['time'].max(), granularity, end_year)
+        # Each task runs in a copy of this context, keeping the request's trace and deadline
+        futures[segment] = COMPARE_EXECUTOR.submit(
+            contextvars.copy_context().run, make_prediction, data, max(steps, 0), granularity
+        )
+    return {segment: future.result() for segment, future in futures.items()}
+
+
+@budget_cache
+def make_prediction(data, steps, granularity, engine="prophet"):
+    # Serve the forecast precomputed in the offline bundle when it covers this series
+    precomputed = bundle.lookup_forecast(data, steps, granularity, engine)
+    tracing.annotate("forecast.precomputed", precomputed is not None)
+    if precomputed is not None:
+        return precomputed
+
+    # Fit the forecasting engine and predict the next steps
+    return forecast(data, steps, granularity, engine)
+
+
+# Pandas period and chart axis format of each granularity
+PERIODS = {"Month": "M", "Quarter": "Q", "Year": "Y"}
+AXIS_FORMATS = {
+    "Month": '%b %Y',  # Month format (e.g., Jan 2023)
+    "Quarter": '%Y-Q%q',  # Quarter format
+    "Year": '%Y',  # Year format
+}
+
+
+class SeriesPyramid:
+    """A monthly price series with its quarterly and yearly means, computed once.
+
+    Each level is kept as read-only arrays of period starts and prices, so
+    reading a granularity (or a date range of it) is a slice, and nothing
+    handed out can alter the stored series.
+    """
+
+    __slots__ = ("levels",)
+
+    def __init__(self, monthly):
+        months = pd.DatetimeIndex(pd.to_datetime(monthly["time"])).to_period("M")
+        prices = monthly["price"].to_numpy(np.float64)
+        self.levels = {}
+        for granularity, period in PERIODS.items():
+            # Quarters and years average the monthly prices, as the chart always has
+            level = pd.Series(prices).groupby(months.asfreq(period).to_timestamp(), sort=True).mean()
+            times = level.index.to_numpy("datetime64[ns]")
+            values = level.to_numpy(np.float64)
+            times.flags.writeable = False
+            values.flags.writeable = False
+            self.levels[granularity] = (times, values)
+
+    def level(self, granularity, start=None, end=None):
+        """The series at a granularity, optionally between two dates (both included), as a new DataFrame over the stored arrays."""
+        times, values = self.levels[granularity]
+        first = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start)), "left")
+        last = len(times) if end is None else np.searchsorted(times, np.datetime64(pd.Timestamp(end)), "right")
+        return pd.DataFrame({"time": times[first:last], "price": values[first:last]}, copy=False)
+
+
+@budget_cache
+def series_pyramid(data):
+    """Pyramid of a monthly series from `filter_data`, built once per version of the data."""
+    return SeriesPyramid(data)
 
 
-@st.cache_data
+MONTH_NAMES = np.array(pd.date_range("2000-01-01", periods=12, freq="MS").strftime("%B"))
+
+
+class MonthCalendar:
+    """A monthly forecast laid out as a years × 12 price matrix, with the KPIs of every year computed at once.
+
+    Months the forecast does not cover (before its start) are NaN, so the first
+    year may be partial; `months` tells how many months each year has.
+    """
+
+    __slots__ = ("years", "prices", "months", "highest", "lowest")
+
+    def __init__(self, forecast):
+        times = pd.DatetimeIndex(pd.to_datetime(forecast["time"]))
+        years = times.year.to_numpy()
+        self.years = np.unique(years)
+        self.prices = np.full((len(self.years), 12), np.nan)
+        self.prices[np.searchsorted(self.years, years), times.month.to_numpy() - 1] = forecast["price"].to_numpy(np.float64)
+        # Every listed year has at least one month, so no row is all NaN
+        self.months = np.count_nonzero(~np.isnan(self.prices), axis=1)
+        self.highest = np.nanargmax(self.prices, axis=1)
+        self.lowest = np.nanargmin(self.prices, axis=1)
+        for array in (self.years, self.prices, self.months, self.highest, self.lowest):
+            array.flags.writeable = False
+
+    def kpis(self, action="buy"):
+        """Best and worst month of every year to buy (lowest price) or sell (highest price), and their spread."""
+        rows = np.arange(len(self.years))
+        highest_price = self.prices[rows, self.highest]
+        lowest_price = self.prices[rows, self.lowest]
+        best, worst = (self.lowest, self.highest) if action == "buy" else (self.highest, self.lowest)
+        best_price, worst_price = (lowest_price, highest_price) if action == "buy" else (highest_price, lowest_price)
+        spread = highest_price - lowest_price
+        return pd.DataFrame({
+            "year": self.years,
+            "months": self.months,
+            "best_month": MONTH_NAMES[best],
+            "best_price": best_price,
+            "worst_month": MONTH_NAMES[worst],
+            "worst_price": worst_price,
+            "spread": spread,
+            "spread_pct": 100 * spread / np.nanmean(self.prices, axis=1),
+        })
+
+    def year(self, year, action="buy"):
+        """The KPIs of one year as a dictionary, or None if the forecast does not reach it."""
+        index = np.searchsorted(self.years, year)
+        if index == len(self.years) or self.years[index] != year:
+            return None
+        return self.kpis(action).iloc[index].to_dict()
+
+
+@budget_cache
+def month_calendar(forecast):
+    """Calendar of a monthly forecast from `make_prediction`, built once per forecast."""
+    return MonthCalendar(forecast)
+
+
+@budget_cache
+def calendar_graph(forecast, action):
+    """Heatmap of each month's price against its year's mean, with the best month of every year marked."""
+    calendar = month_calendar(forecast)
+    prices = calendar.prices
+    relative = 100 * (prices / np.nanmean(prices, axis=1, keepdims=True) - 1)
+    best = calendar.lowest if action == "buy" else calendar.highest
+    cells = pd.DataFrame({
+        "year": np.repeat(calendar.years, 12).astype(str),
+        "month": np.tile(MONTH_NAMES, len(calendar.years)),
+        "price": prices.ravel(),
+        "relative": relative.ravel(),
+        "best": (np.arange(12) == best[:, None]).ravel(),
+    }).dropna(subset=["price"])
+
+    heatmap = alt.Chart(cells).mark_rect().encode(
+        x=alt.X('month:N', title='Month', sort=list(MONTH_NAMES)),
+        y=alt.Y('year:O', title='Year'),
+        color=alt.Color('relative:Q', title='% vs year mean', scale=alt.Scale(scheme='redyellowgreen', reverse=action != "buy")),
+        tooltip=['year:O', 'month:N', alt.Tooltip('price:Q', format=',.0f'), alt.Tooltip('relative:Q', format='+.1f')],
+    )
+    marks = alt.Chart(cells[cells["best"]]).mark_text(text='★', color='black').encode(
+        x=alt.X('month:N', sort=list(MONTH_NAMES)),
+        y='year:O',
+    )
+    return heatmap + marks
+
+
+@budget_cache
 def prediction_graph(historical_data, future_data, granularity):
-    
-    # Convert dates according to the selected granularity
-    if granularity == "Month":
-        historical_data['time'] = historical_data['time'].dt.to_period('M').dt.to_timestamp()  # Month
-        x_axis_format = '%b %Y'  # Month format (e.g., Jan 2023)
-    elif granularity == "Quarter":
-        historical_data['time'] = historical_data['time'].dt.to_period('Q').dt.to_timestamp()  # Quarter
-        x_axis_format = '%Y-Q%q'  # Quarter format
-    elif granularity == "Year":
-        historical_data['time'] = historical_data['time'].dt.to_period('Y').dt.to_timestamp()  # Year
-        x_axis_format = '%Y'  # Year format
-
-    # Group historical data by adjusted time according to granularity
-    historical_data = historical_data.groupby(['time'], sort=False).mean().reset_index()
-    
+
+    # The historical series at the selected granularity: a slice of its pyramid
+    x_axis_format = AXIS_FORMATS[granularity]
+    historical_data = series_pyramid(historical_data).level(granularity).assign(type='Historical')
+
     # Combine historical and future data
-    historical_data['type'] = 'Historical'
-    future_data['type'] = 'Future'
+    future_data = future_data.assign(type='Future')
     combined_data = pd.concat([historical_data, future_data])
 
     # Create Altair chart for historical and future data lines with different colors
@@ -112,3 +286,38 @@ def prediction_graph(historical_data, future_data, granularity):
 
     # Combine historical and future data lines with confidence interval area
     return line_chart + confidence_area
+
+
+@budget_cache
+def comparison_graph(series, forecasts, granularity):
+    """One chart with the history and forecast of each segment, a colour per segment."""
+    frames = []
+    for segment, data in series.items():
+        label = segment_label(segment)
+        frames.append(series_pyramid(data).level(granularity).assign(segment=label, type='Historical'))
+        frames.append(forecasts[segment][['time', 'price']].assign(segment=label, type='Future'))
+    combined_data = pd.concat(frames, ignore_index=True)
+
+    return alt.Chart(combined_data).mark_line().encode(
+        x=alt.X('time:T', title='Time', axis=alt.Axis(format=AXIS_FORMATS[granularity], labelAngle=45)),
+        y='price:Q',
+        color=alt.Color('segment:N', title='Segment'),
+        strokeDash=alt.StrokeDash('type:N', scale=alt.Scale(domain=['Historical', 'Future'], range=[[1, 0], [6, 3]])),
+        detail='type:N',
+        tooltip=['segment:N', 'time:T', 'price:Q', 'type:N'],
+    )
+
+
+def clear_prediction_caches(event):
+    """Sales changed: cached series, forecasts and charts are stale."""
+    filter_data.clear()
+    series_pyramid.clear()
+    segment_series.clear()
+    make_prediction.clear()
+    prediction_graph.clear()
+    comparison_graph.clear()
+    month_calendar.clear()
+    calendar_graph.clear()
+
+
+events.subscribe(events.SALE_EVENTS, clear_prediction_caches)
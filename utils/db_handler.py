@@ -1,9 +1,21 @@
 import streamlit as st
-from sqlalchemy import create_engine, URL, text
+from sqlalchemy import create_engine, URL, text, bindparam, Date
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from contextlib import contextmanager
+from collections import deque
+import contextvars
+from datetime import datetime
+import threading
+import time
 import uuid
+import numpy as np
 import pandas as pd
 import bcrypt
 import os
+from utils.sales_cube import SALES_CUBE
+from utils import events, outliers
+from utils.memory_cache import budget_cache
+from utils.records import ResultSet, User
 
 # Load configuration from Streamlit secrets
 try:
@@ -18,8 +30,8 @@ except FileNotFoundError:
         "database": os.getenv("DB_NAME"),
     }
 
-# Create the database URL
-db_url = URL.create(
+# Create the database URL (DATABASE_URL overrides it, e.g. with a local SQLite stand-in)
+db_url = os.getenv("DATABASE_URL") or URL.create(
     drivername="postgresql+psycopg2",
     username=DB_CONFIG["user"],
     password=DB_CONFIG["password"],
@@ -28,51 +40,229 @@ db_url = URL.create(
     database=DB_CONFIG["database"],
 )
 
+# Pool settings per deployment: [pool] in Streamlit secrets, else DB_POOL_* environment variables
+try:
+    POOL_CONFIG = dict(st.secrets["pool"])
+except (FileNotFoundError, KeyError):
+    POOL_CONFIG = {}
+
+def pool_setting(name, default):
+    value = POOL_CONFIG.get(name, os.getenv(f"DB_{name.upper()}", default))
+    if isinstance(default, bool):
+        return str(value).lower() in ("1", "true", "yes")
+    if isinstance(default, int):
+        return int(float(value))  # "10.0" from an environment variable is still a count
+    return type(default)(value)
+
 # Create the engine with a connection pool
 engine = create_engine(
     db_url,
-    pool_size=10,
-    max_overflow=5,
-    pool_timeout=30,
-    pool_recycle=1800,
-    echo=True  # Optional: show queries in the console
+    pool_size=pool_setting("pool_size", 10),
+    max_overflow=pool_setting("max_overflow", 5),
+    pool_timeout=pool_setting("pool_timeout", 30.0),  # Seconds, fractions allowed
+    pool_recycle=pool_setting("pool_recycle", 1800),
+    pool_pre_ping=pool_setting("pool_pre_ping", True),  # Replace dead connections on checkout
+    echo=pool_setting("echo", True)  # Optional: show queries in the console
 )
 
+
+class PoolMetrics:
+    """Checkout wait times and timeouts of the connection pool."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self._waits.append(seconds)
+            self.checkouts += 1
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+        p95 = waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(1000 * sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95_ms": round(1000 * p95, 3),
+            "wait_max_ms": round(1000 * self.max_wait, 3),
+        }
+
+
+POOL_METRICS = PoolMetrics()
+
+# Connection of the unit of work running in the current context, if any
+_unit_of_work = contextvars.ContextVar("unit_of_work", default=None)
+
+@contextmanager
+def checkout():
+    """Check a connection out of the pool, recording how long it took."""
+    start = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeoutError:
+        POOL_METRICS.record_timeout()
+        raise
+    POOL_METRICS.record_wait(time.perf_counter() - start)
+    with conn:
+        yield conn
+
+@contextmanager
+def connection():
+    """Reuse the current unit of work's connection, or check out a new one."""
+    shared = _unit_of_work.get()
+    if shared is not None:
+        yield shared
+    else:
+        with checkout() as conn:
+            yield conn
+
+def commit(conn):
+    """Commit unless the connection belongs to a unit of work, which commits at its end."""
+    if conn is not _unit_of_work.get():
+        conn.commit()
+        events.flush(conn)
+
+def email_pattern(email_filter):
+    """Build an ILIKE pattern matching emails that contain the filter literally."""
+    if not email_filter:
+        return None
+    escaped = email_filter.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def sale_record(row):
+    """JSON-friendly copy of a sale, as carried by sale events."""
+    return {
+        "datesold": str(row.get("datesold", row.get("date_sold"))),
+        "price": float(row["price"]),
+        "postcode": str(row["postcode"]),
+        "property_type": str(row["property_type"]),
+        "bedrooms": int(row["bedrooms"]),
+    }
+
+# Columns exposed by data exports (user ids are never exported)
+EXPORT_COLUMNS = ["id", "datesold", "price", "postcode", "property_type", "bedrooms"]
+
+# Columns of a user's sales history, as the API returns them
+USER_SALES_COLUMNS = ["Date Sold", "Price", "Postcode", "Property Type", "Bedrooms"]
+USER_SALES_DTYPES = {"Price": np.float64, "Bedrooms": np.int64}
+
+USER_LIST_COLUMNS = ["email", "role", "id"]
+
 class DatabaseManager:
     @staticmethod
-    @st.cache_data
+    @contextmanager
+    def unit_of_work():
+        """Run every DatabaseManager call in the block on one connection and one transaction."""
+        if _unit_of_work.get() is not None:
+            yield _unit_of_work.get()  # Nested: join the outer unit of work
+            return
+        with checkout() as conn:
+            token = _unit_of_work.set(conn)
+            try:
+                yield conn
+                conn.commit()
+                events.flush(conn)
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                _unit_of_work.reset(token)
+
+    @staticmethod
+    def pool_status():
+        """Pool occupancy and checkout wait metrics."""
+        pool = engine.pool
+        status = {"pool": pool.__class__.__name__}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                status[name] = getattr(pool, name)()
+        status.update(POOL_METRICS.snapshot())
+        return status
+
+    @staticmethod
+    @budget_cache
     def load_data():
         """Load data from the database."""
         try:
-            with engine.connect() as conn:
-                query = text("SELECT * FROM property_sales;")
+            with connection() as conn:
+                # Typing datesold keeps it a date on backends that store it as text
+                query = text("SELECT * FROM property_sales;").columns(datesold=Date)
                 df = pd.read_sql_query(query, conn)
                 return df
         except Exception as e:
             print(f"Failed to connect to the database: {e}")
             return None
-        
+
+    @staticmethod
+    @budget_cache
+    def load_sales_range(start_date, end_date):
+        """Load the sales made between two dates, both included.
+
+        On a table partitioned by year only the partitions of those years are read.
+        """
+        try:
+            with connection() as conn:
+                query = text("""
+                    SELECT * FROM property_sales
+                    WHERE datesold >= :start_date AND datesold <= :end_date
+                    ORDER BY id
+                """).bindparams(bindparam("start_date", type_=Date), bindparam("end_date", type_=Date))
+                query = query.columns(datesold=Date)
+                return pd.read_sql_query(query, conn, params={"start_date": start_date, "end_date": end_date})
+        except Exception as e:
+            print(f"Failed to load sales between {start_date} and {end_date}: {e}")
+            return None
+
+    @staticmethod
+    def get_sales_preview(limit=5):
+        """Load the first sales records, without the user id."""
+        try:
+            with connection() as conn:
+                query = text(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM property_sales ORDER BY id LIMIT :limit")
+                return pd.read_sql_query(query, conn, params={"limit": limit})
+        except Exception as e:
+            print(f"Failed to load sales preview: {e}")
+            return None
+
+    @staticmethod
+    def stream_sales(chunk_size=10000):
+        """Yield lists of sales rows (without the user id) from a server-side cursor."""
+        with checkout() as conn:
+            query = text(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM property_sales ORDER BY id").columns(datesold=Date)
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+            for rows in result.partitions():
+                yield rows
+
     @staticmethod
     def get_user_by_email(email):
-        """Get user details by email."""
+        """Get a user by email, as a `User` (None if not found)."""
         try:
-            with engine.connect() as conn:
-                query = text("SELECT * FROM users WHERE email = :email")
+            with connection() as conn:
+                query = text("SELECT id, email, role FROM users WHERE email = :email")
                 result = conn.execute(query, {"email": email}).fetchone()
-                if result:
-                    result_dict = dict(result._mapping)  # Convert the row to a dictionary
-                    return result_dict
-                else:
-                    return None  # User not found
+                return User.from_row(result) if result else None
         except Exception as e:
             print(f"Error retrieving user by email: {e}")
             return None
         
     @staticmethod
     def get_user_id(email):
+        """Get the id of the user with the given email."""
         try:
-            user = DatabaseManager.get_user_by_email(email)
-            return user["id"]
+            with connection() as conn:
+                query = text("SELECT id FROM users WHERE email = :email")
+                return conn.execute(query, {"email": email}).scalar()
         except Exception as e:
             print(f"Error checking finding user id: {e}")
             return None
@@ -82,7 +272,7 @@ class DatabaseManager:
     def get_user_role(email):
         """Get the role of the user with the given email."""
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("SELECT role FROM users WHERE email = :email")
                 result = conn.execute(query, {"email": email}).fetchone()
                 if result:
@@ -97,56 +287,92 @@ class DatabaseManager:
 
     @staticmethod
     def insert_sale(entry):
-        """Insert a record into the property_sales table."""
+        """Insert a record into the property_sales table, flagging it if its price is an outlier."""
         try:
-            with engine.connect() as conn:
+            bounds = outliers.get_bounds(DatabaseManager.load_data)
+            entry = {**entry, "is_outlier": outliers.is_outlier(bounds, entry)}
+            with connection() as conn:
                 query = text("""
-                    INSERT INTO property_sales (datesold, price, postcode, property_type, bedrooms, user_id) 
-                    VALUES (:date_sold, :price, :postcode, :property_type, :bedrooms, :user_id)
+                    INSERT INTO property_sales (datesold, price, postcode, property_type, bedrooms, user_id, is_outlier) 
+                    VALUES (:date_sold, :price, :postcode, :property_type, :bedrooms, :user_id, :is_outlier)
                 """)
                 conn.execute(query, entry)
-                conn.commit()
+                events.publish(events.SALE_INSERTED, {"sales": [sale_record(entry)]}, conn)
+                commit(conn)
                 print("✅ Sale successfully inserted.")
-                DatabaseManager.load_data.clear()
                 return True
         except Exception as e:
             print(f"Failed to insert sale: {e}")
             return False
 
     @staticmethod
-    def get_sales_by_user(user_id):
+    def update_outlier_flags(batch_size=10000):
+        """Recompute the outlier flag of every sale in one pass and store the ones that changed."""
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("""
+                    SELECT id, datesold, price, property_type, bedrooms, is_outlier FROM property_sales
+                """).columns(datesold=Date)
+                data = pd.read_sql_query(query, conn)
+                flags = outliers.flag_outliers(data)
+                changed = flags != data["is_outlier"].astype(bool).to_numpy()
+                updates = [
+                    {"id": int(sale_id), "is_outlier": bool(flag)}
+                    for sale_id, flag in zip(data["id"].to_numpy()[changed], flags[changed])
+                ]
+                query = text("UPDATE property_sales SET is_outlier = :is_outlier WHERE id = :id")
+                for start in range(0, len(updates), batch_size):
+                    conn.execute(query, updates[start:start + batch_size])
+                if updates:
+                    events.publish(events.SALES_FLAGGED, {"changed": len(updates)}, conn)
+                commit(conn)
+                outliers.invalidate_bounds()
+                return int(flags.sum())
+        except Exception as e:
+            print(f"Failed to update outlier flags: {e}")
+            return None
+
+    @staticmethod
+    def get_sales_by_user(user_id, limit=None, offset=0):
+        """Get the sales of a user as a `ResultSet`, newest first, optionally one page at a time."""
+        try:
+            with connection() as conn:
+                query = text(f"""
                     SELECT datesold, price, postcode, property_type, bedrooms 
                     FROM property_sales 
                     WHERE user_id = :user_id
-                    ORDER BY datesold DESC
-                """)
-                result = conn.execute(query, {"user_id": user_id})
-                sales = result.fetchall()
-
-                # Convertir a DataFrame
-                if sales:
-                    df = pd.DataFrame(sales, columns=["Date Sold", "Price", "Postcode", "Property Type", "Bedrooms"])
-                    return df
-                else:
-                    return pd.DataFrame()  # Devuelve un DataFrame vacío si no hay datos
+                    ORDER BY datesold DESC, id DESC
+                    {"LIMIT :limit OFFSET :offset" if limit is not None else ""}
+                """).columns(datesold=Date)
+                result = conn.execute(query, {"user_id": user_id, "limit": limit, "offset": offset})
+                return ResultSet.from_rows(USER_SALES_COLUMNS, result.fetchall(), USER_SALES_DTYPES)
         except Exception as e:
             print(f"Error retrieving sales data: {e}")
-            return pd.DataFrame()
+            return ResultSet.empty(USER_SALES_COLUMNS, USER_SALES_DTYPES)
+
+    @staticmethod
+    def count_sales_by_user(user_id):
+        """Count the sales of a user."""
+        try:
+            with connection() as conn:
+                query = text("SELECT COUNT(*) FROM property_sales WHERE user_id = :user_id")
+                return conn.execute(query, {"user_id": user_id}).scalar()
+        except Exception as e:
+            print(f"Error counting sales: {e}")
+            return 0
         
     @staticmethod
     def delete_sale(date_sold, price, user_id):
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("""
                     DELETE FROM property_sales 
                     WHERE datesold = :date_sold AND price = :price AND user_id = :user_id
+                    RETURNING datesold, price, postcode, property_type, bedrooms
                 """)
-                conn.execute(query, {"date_sold": date_sold, "price": price, "user_id": user_id})
-                conn.commit()
-                DatabaseManager.load_data.clear()
+                deleted = conn.execute(query, {"date_sold": date_sold, "price": price, "user_id": user_id}).fetchall()
+                events.publish(events.SALE_DELETED, {"sales": [sale_record(row._mapping) for row in deleted]}, conn)
+                commit(conn)
                 return True
         except Exception as e:
             print(f"Error deleting sale: {e}")
@@ -159,7 +385,7 @@ class DatabaseManager:
     def verify_duplicate_user(email):
         """Check if a user already exists in the database."""
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("SELECT COUNT(*) FROM users WHERE email = :email")
                 result = conn.execute(query, {"email": email}).scalar()
                 return result > 0
@@ -171,7 +397,7 @@ class DatabaseManager:
     def authenticate_user(email, password):
         """Authenticate a user by comparing the provided password with the stored hash."""
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("SELECT hashed_password FROM users WHERE email = :email")
                 result = conn.execute(query, {"email": email}).fetchone()
 
@@ -187,71 +413,134 @@ class DatabaseManager:
             return False
 
     @staticmethod
-    def save_user(email, password, role, extra_input_params):
-        """Save a new user in the database with a role."""
+    def register_user(email, password, role, extra_input_params):
+        """Create a user in a single round trip.
+
+        Returns True if the user was created, False if the email is already
+        registered and None if the insert failed.
+        """
         try:
-            with engine.connect() as conn:
-                # Hash the password before storing it
-                hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode("utf-8")
+            # Hash the password before storing it (outside the transaction: bcrypt is slow on purpose)
+            hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode("utf-8")
 
-                # Construct the SQL query dynamically
-                columns = ["id", "email", "hashed_password", "role"]  # 
-                values = {
-                    "id": uuid.uuid4(),
-                    "email": email,
-                    "hashed_password": hashed_password,
-                    "role": role  
-                }
+            # Construct the SQL query dynamically
+            columns = ["id", "email", "hashed_password", "role"]
+            values = {
+                "id": str(uuid.uuid4()),
+                "email": email,
+                "hashed_password": hashed_password,
+                "role": role
+            }
 
-                for key, value in extra_input_params.items():
-                    columns.append(key)
-                    values[key] = value
+            for key, value in extra_input_params.items():
+                columns.append(key)
+                values[key] = value
 
-                columns_str = ", ".join(columns)
-                placeholders = ", ".join([f":{key}" for key in values.keys()])
+            columns_str = ", ".join(columns)
+            placeholders = ", ".join([f":{key}" for key in values.keys()])
 
-                query = text(f"INSERT INTO users ({columns_str}) VALUES ({placeholders})")
+            # The unique email constraint settles concurrent registrations of the same address
+            query = text(f"""
+                INSERT INTO users ({columns_str}) VALUES ({placeholders})
+                ON CONFLICT (email) DO NOTHING
+                RETURNING id
+            """)
 
-                conn.execute(query, values)
-                conn.commit()
+            with connection() as conn:
+                created = conn.execute(query, values).fetchone() is not None
+                if created:
+                    events.publish(events.USER_CHANGED, {"email": email}, conn)
+                commit(conn)
+            if created:
                 print("User successfully registered.")
-                DatabaseManager.load_data.clear()
-                return True
+            return created
         except Exception as e:
             print(f"Failed to save user: {e}")
-            return False
-        
+            return None
 
     @staticmethod
-    def get_all_users():
-        """Retrieve all users with their emails and roles."""
-        try:
-            with engine.connect() as conn:
-                query = text("SELECT email, role, id FROM users ORDER BY email ASC")
-                result = conn.execute(query).fetchall()
+    def save_user(email, password, role, extra_input_params):
+        """Save a new user in the database with a role."""
+        return DatabaseManager.register_user(email, password, role, extra_input_params) is True
 
-                if result:
-                    df = pd.DataFrame(result, columns=["email", "role", "id"])
-                    return df
-                else:
-                    return pd.DataFrame(columns=["email", "role"])  # Retorna DataFrame vacío si no hay usuarios
+
+    @staticmethod
+    def get_all_users(email_filter=None, limit=None, offset=0):
+        """Retrieve users with their emails and roles as a `ResultSet`, optionally filtered by email and paged."""
+        try:
+            with connection() as conn:
+                query = text(f"""
+                    SELECT email, role, id FROM users
+                    {"WHERE email ILIKE :pattern" if email_filter else ""}
+                    ORDER BY email ASC
+                    {"LIMIT :limit OFFSET :offset" if limit is not None else ""}
+                """)
+                params = {"pattern": email_pattern(email_filter), "limit": limit, "offset": offset}
+                return ResultSet.from_rows(USER_LIST_COLUMNS, conn.execute(query, params).fetchall())
         except Exception as e:
             print(f"Error retrieving users: {e}")
-            return pd.DataFrame(columns=["email", "role"])
+            return ResultSet.empty(USER_LIST_COLUMNS)
+
+    @staticmethod
+    def count_users(email_filter=None):
+        """Count the users, optionally filtered by email."""
+        try:
+            with connection() as conn:
+                query = text(f"SELECT COUNT(*) FROM users {'WHERE email ILIKE :pattern' if email_filter else ''}")
+                return conn.execute(query, {"pattern": email_pattern(email_filter)}).scalar()
+        except Exception as e:
+            print(f"Error counting users: {e}")
+            return 0
         
 
+    @staticmethod
+    def revoke_token(jti, expires_at):
+        """Record a revoked token id until the token would have expired anyway."""
+        try:
+            with connection() as conn:
+                query = text("INSERT INTO revoked_tokens (jti, expires_at) VALUES (:jti, :expires_at)")
+                conn.execute(query, {"jti": jti, "expires_at": expires_at})
+                events.publish(events.TOKEN_REVOKED, {"jti": jti}, conn)
+                commit(conn)
+                return True
+        except Exception as e:
+            print(f"Failed to revoke token: {e}")
+            return False
+
+    @staticmethod
+    def get_revoked_tokens():
+        """Ids of revoked tokens that have not expired yet, or None on failure."""
+        try:
+            with connection() as conn:
+                query = text("SELECT jti FROM revoked_tokens WHERE expires_at > :now")
+                return [row[0] for row in conn.execute(query, {"now": datetime.utcnow()})]
+        except Exception as e:
+            print(f"Error retrieving revoked tokens: {e}")
+            return None
+
+    @staticmethod
+    def is_token_revoked(jti):
+        """Exact revocation check; fails closed if the database cannot be reached."""
+        try:
+            with connection() as conn:
+                query = text("SELECT COUNT(*) FROM revoked_tokens WHERE jti = :jti")
+                return conn.execute(query, {"jti": jti}).scalar() > 0
+        except Exception as e:
+            print(f"Error checking token revocation: {e}")
+            return True
+
     @staticmethod
     def set_user_role(email, new_role):
         """Change the role of a user."""
         try:
-            with engine.connect() as conn:
+            with connection() as conn:
                 query = text("UPDATE users SET role = :role WHERE email = :email")
                 result = conn.execute(query, {"role": new_role, "email": email})
                 
                 if result.rowcount > 0:
-                    conn.commit()
+                    events.publish(events.USER_CHANGED, {"email": email}, conn)
+                    commit(conn)
                     print(f"User {email}'s role has been updated to {new_role}.")
-                    DatabaseManager.load_data.clear()
                     return True
                 else:
                     print(f"User with email {email} not found.")
@@ -261,3 +550,16 @@ class DatabaseManager:
             return False
 
 
+def refresh_sales_caches(event):
+    """Drop the cached sales table and apply the change to the sales cube."""
+    DatabaseManager.load_data.clear()
+    DatabaseManager.load_sales_range.clear()
+    if "sales" not in event.payload:
+        SALES_CUBE.invalidate()
+    elif event.type == events.SALE_INSERTED:
+        SALES_CUBE.add_sales(event.payload["sales"])
+    else:
+        SALES_CUBE.remove_sales(event.payload["sales"])
+
+
+events.subscribe(events.SALE_EVENTS, refresh_sales_caches)
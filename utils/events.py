@@ -0,0 +1,217 @@
+import json
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict, namedtuple
+from sqlalchemy import event as sa_event, text
+
+
+# Event types
+SALE_INSERTED = "sale_inserted"
+SALE_DELETED = "sale_deleted"
+USER_CHANGED = "user_changed"
+TOKEN_REVOKED = "token_revoked"
+SALES_FLAGGED = "sales_flagged"
+PROFILING_ARMED = "profiling_armed"
+SALE_EVENTS = (SALE_INSERTED, SALE_DELETED, SALES_FLAGGED)
+
+# Postgres channel, and local log file used when Postgres is not available
+CHANNEL = "property_events"
+EVENTS_FILE = os.getenv("EVENTS_FILE", os.path.join(tempfile.gettempdir(), "property_events.log"))
+
+# The events file is rotated to EVENTS_FILE + ".1" once it grows past this size
+EVENTS_FILE_MAX_BYTES = int(os.getenv("EVENTS_FILE_MAX_BYTES", 10 * 2**20))
+
+# NOTIFY payloads are limited to 8000 bytes
+MAX_PAYLOAD_BYTES = 7900
+
+# Identifies this process so it does not handle its own events twice
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+Event = namedtuple("Event", ["type", "payload", "origin"])
+
+_handlers = defaultdict(list)
+# Deliveries waiting for the commit of the connection that published them
+_pending = weakref.WeakKeyDictionary()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(event_types, handler):
+    """Call `handler(event)` for every event of the given type(s), local or remote."""
+    if isinstance(event_types, str):
+        event_types = (event_types,)
+    for event_type in event_types:
+        _handlers[event_type].append(handler)
+
+
+def dispatch(event):
+    """Run the handlers registered for the event."""
+    for handler in _handlers[event.type]:
+        try:
+            handler(event)
+        except Exception as e:
+            print(f"Event handler failed for {event.type}: {e}")
+
+
+def backend_name(dialect_name):
+    """Pick the transport: EVENTS_BACKEND if set, else NOTIFY on Postgres and the local file otherwise."""
+    backend = os.getenv("EVENTS_BACKEND")
+    if backend:
+        return backend
+    return "postgres" if dialect_name == "postgresql" else "file"
+
+
+def encode(event):
+    message = json.dumps({"type": event.type, "payload": event.payload, "origin": event.origin}, default=str)
+    if len(message.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+        # Receivers fall back to a full refresh when the details are missing
+        message = json.dumps({"type": event.type, "payload": {"truncated": True}, "origin": event.origin})
+    return message
+
+
+def decode(message):
+    data = json.loads(message)
+    return Event(data["type"], data["payload"], data["origin"])
+
+
+def append_to_file(message):
+    try:
+        if os.path.getsize(EVENTS_FILE) > EVENTS_FILE_MAX_BYTES:
+            # Listeners finish reading the rotated file, then reopen the new one
+            os.replace(EVENTS_FILE, EVENTS_FILE + ".1")
+    except FileNotFoundError:
+        pass
+    # Single appends of one line are atomic enough for a local stand-in
+    with open(EVENTS_FILE, "a", encoding="utf-8") as f:
+        f.write(message + "\n")
+
+
+def publish(event_type, payload=None, conn=None):
+    """Publish an event to this process and to every other listening process.
+
+    When `conn` has an open transaction the event is sent as part of it and only
+    delivered once `flush(conn)` runs after the commit has succeeded.
+    """
+    event = Event(event_type, payload or {}, PROCESS_ID)
+    message = encode(event)
+    backend = backend_name(conn.dialect.name if conn is not None else None)
+
+    def deliver(*_):
+        if backend == "file":
+            append_to_file(message)
+        dispatch(event)
+
+    try:
+        if backend == "postgres" and conn is not None:
+            # NOTIFY is transactional: listeners only see it after commit
+            conn.execute(text("SELECT pg_notify(:channel, :message)"), {"channel": CHANNEL, "message": message})
+    except Exception as e:
+        print(f"Failed to publish {event_type}: {e}")
+
+    if conn is not None and conn.in_transaction():
+        if conn not in _pending:
+            _pending[conn] = []
+            sa_event.listen(conn, "rollback", discard)
+        _pending[conn].append(deliver)
+    else:
+        deliver()
+
+
+def flush(conn):
+    """Deliver the events published on `conn`, once its transaction has committed."""
+    for deliver in _pending.pop(conn, []):
+        deliver()
+
+
+def discard(conn):
+    # The transaction rolled back: its events never happened
+    _pending.pop(conn, None)
+
+
+# Listening
+
+def handle_message(message):
+    try:
+        event = decode(message)
+    except (ValueError, KeyError) as e:
+        print(f"Ignoring malformed event: {e}")
+        return
+    if event.origin != PROCESS_ID:
+        dispatch(event)
+
+
+def listen_postgres(engine, stop):
+    """Receive NOTIFY messages on a dedicated connection, reconnecting on errors."""
+    while not stop.is_set():
+        try:
+            connection = engine.raw_connection()
+            connection.detach()  # Keep the long-lived LISTEN connection out of the pool
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL};")
+            while not stop.is_set():
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    handle_message(dbapi_connection.notifies.pop(0).payload)
+        except Exception as e:
+            print(f"Event listener error, reconnecting: {e}")
+            time.sleep(5)
+
+
+def listen_file(stop, interval=0.5):
+    """Tail the local events file for lines written by other processes, following its rotations."""
+    open(EVENTS_FILE, "a").close()
+    f = open(EVENTS_FILE, "r", encoding="utf-8")
+    f.seek(0, os.SEEK_END)
+    try:
+        while not stop.is_set():
+            position = f.tell()
+            line = f.readline()
+            if line.endswith("\n"):
+                handle_message(line)
+                continue
+            f.seek(position)
+            try:
+                current = os.stat(EVENTS_FILE)
+            except FileNotFoundError:
+                current = None  # Being rotated
+            if current is not None and current.st_ino != os.fstat(f.fileno()).st_ino:
+                # Rotated, and this file is read to its end: continue with the new one from its start
+                f.close()
+                f = open(EVENTS_FILE, "r", encoding="utf-8")
+                continue
+            if current is not None and current.st_size < position:
+                f.seek(0)  # The file was truncated
+            stop.wait(interval)
+    finally:
+        f.close()
+
+
+def start_listener(engine):
+    """Start the background listener for this process (only once)."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return _listener
+        backend = backend_name(engine.dialect.name)
+        if backend == "none":
+            return None
+        stop = threading.Event()
+        if backend == "postgres":
+            target, args = listen_postgres, (engine, stop)
+        else:
+            target, args = listen_file, (stop,)
+        thread = threading.Thread(target=target, args=args, name="events-listener", daemon=True)
+        thread.stop = stop
+        thread.start()
+        _listener = thread
+        return thread
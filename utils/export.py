@@ -0,0 +1,123 @@
+import csv
+import io
+import zlib
+from utils.db_handler import DatabaseManager, EXPORT_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+
+CHUNK_SIZE = 10000
+
+# Media type and file name for each export format
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "sales_data.csv"),
+    "csv.gz": ("application/gzip", "sales_data.csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "sales_data.parquet"),
+}
+
+
+def export_format(file_format, compress=False):
+    """Resolve the export format key for a requested format and compression."""
+    if file_format == "csv" and compress:
+        return "csv.gz"
+    return file_format
+
+
+def iter_csv(chunk_size=CHUNK_SIZE, compress=False):
+    """Yield the sales table as CSV bytes, one chunk of rows at a time."""
+    # wbits=31 writes a gzip container instead of a raw zlib stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in DatabaseManager.stream_sales(chunk_size):
+        writer.writerows(rows)
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+
+    data = buffer.getvalue().encode("utf-8")
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the caller."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_parquet(chunk_size=CHUNK_SIZE, compress=False):
+    """Yield the sales table as Parquet bytes, one row group per chunk of rows."""
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("datesold", pa.date32()),
+        ("price", pa.float64()),
+        ("postcode", pa.string()),
+        ("property_type", pa.string()),
+        ("bedrooms", pa.int64()),
+    ])
+    sink = _ChunkSink()
+    # Parquet compresses column chunks itself, so gzip is applied as the codec
+    writer = pq.ParquetWriter(sink, schema, compression="gzip" if compress else "snappy")
+    try:
+        for rows in DatabaseManager.stream_sales(chunk_size):
+            columns = [list(column) for column in zip(*rows)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(file_format, compress=False, chunk_size=CHUNK_SIZE):
+    """Yield the export for the given format ('csv' or 'parquet')."""
+    if file_format == "csv":
+        return iter_csv(chunk_size, compress)
+    if file_format == "parquet":
+        return iter_parquet(chunk_size, compress)
+    raise ValueError(f"Unsupported export format '{file_format}'")
+
+
+def write_export(file_obj, file_format, compress=False, chunk_size=CHUNK_SIZE):
+    """Write the export to an open binary file, chunk by chunk."""
+    for chunk in iter_export(file_format, compress, chunk_size):
+        file_obj.write(chunk)
+    file_obj.flush()
+    file_obj.seek(0)
+    return file_obj
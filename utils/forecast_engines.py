@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from prophet import Prophet
+from utils import model_store
+from utils.admission import forecast_slot
+
+
+# Pandas frequency of each granularity offered in the app
+FREQUENCIES = {"Month": "M", "Quarter": "Q", "Year": "Y"}
+
+# z-score of the 80% interval Prophet reports by default
+INTERVAL_Z = 1.2816
+
+
+def future_dates(last_date, steps, granularity):
+    """Dates of the next `steps` periods, generated the same way as Prophet's future dataframe."""
+    dates = pd.date_range(start=last_date, periods=steps + 1, freq=FREQUENCIES[granularity])
+    dates = dates[dates > last_date]
+    return dates[:steps]
+
+
+def forecast_frame(dates, price, lower, upper):
+    """Build the forecast table returned by every engine."""
+    return pd.DataFrame({
+        "time": dates,
+        "price": np.round(price, 0),
+        "lowest price": lower,
+        "highest price": upper,
+    })
+
+
+# Prophet
+
+def fit_prophet(data):
+    """Fit Prophet on a monthly series with 'time' and 'price' columns, reusing stored fits."""
+    key = model_store.series_key(data)
+    model = model_store.load_model(key)
+    if model is None:
+        model = Prophet()
+        model.fit(data.rename(columns={"time": "ds", "price": "y"}))
+        model_store.save_model(key, model)
+    return model
+
+
+def predict_prophet(model, steps, granularity):
+    """Forecast the next `steps` periods with a fitted Prophet model."""
+    future = model.make_future_dataframe(periods=steps, freq=FREQUENCIES[granularity])
+    forecast = model.predict(future)
+
+    # Round the predicted price to the nearest integer
+    forecast["yhat"] = forecast[["yhat"]].round(0)
+
+    # Return the predicted price at the specified time
+    forecast = forecast.rename(columns={"ds": "time", "yhat": "price", "yhat_lower": "lowest price", "yhat_upper": "highest price"})
+    return forecast[["time", "price", "lowest price", "highest price"]].tail(steps)
+
+
+# Seasonal naive: the last observed value of the same calendar month
+
+def fit_seasonal_naive(data):
+    series = data.set_index("time")["price"].sort_index()
+    last_by_month = series.groupby(series.index.month).last()
+    # Spread of year-over-year changes sizes the interval
+    yearly_change = series.diff(12).dropna()
+    scale = yearly_change.std() if len(yearly_change) > 1 else series.std()
+    return {"last_date": series.index[-1], "last_by_month": last_by_month, "scale": scale}
+
+
+def predict_seasonal_naive(model, steps, granularity):
+    dates = future_dates(model["last_date"], steps, granularity)
+    last_by_month = model["last_by_month"]
+    price = last_by_month.reindex(dates.month).fillna(last_by_month.mean()).to_numpy()
+    years_ahead = np.maximum((dates - model["last_date"]).days / 365.25, 1 / 12)
+    spread = INTERVAL_Z * model["scale"] * np.sqrt(np.ceil(years_ahead))
+    return forecast_frame(dates, price, price - spread, price + spread)
+
+
+# Linear trend plus month-of-year seasonality, fitted by least squares
+
+def trend_design(dates, origin):
+    years = ((dates - origin).days / 365.25).to_numpy()
+    months = np.eye(12)[dates.month - 1]
+    return np.column_stack([years, months])
+
+
+def fit_linear_trend(data):
+    dates = pd.DatetimeIndex(data["time"])
+    origin = dates.min()
+    design = trend_design(dates, origin)
+    coefficients, *_ = np.linalg.lstsq(design, data["price"].to_numpy(np.float64), rcond=None)
+    residuals = data["price"].to_numpy() - design @ coefficients
+    return {"last_date": dates.max(), "origin": origin, "coefficients": coefficients, "scale": residuals.std()}
+
+
+def predict_linear_trend(model, steps, granularity):
+    dates = future_dates(model["last_date"], steps, granularity)
+    price = trend_design(dates, model["origin"]) @ model["coefficients"]
+    spread = INTERVAL_Z * model["scale"]
+    return forecast_frame(dates, price, price - spread, price + spread)
+
+
+# Available engines: name -> (fit, predict)
+ENGINES = {
+    "prophet": (fit_prophet, predict_prophet),
+    "seasonal_naive": (fit_seasonal_naive, predict_seasonal_naive),
+    "linear_trend": (fit_linear_trend, predict_linear_trend),
+}
+
+
+def forecast(data, steps, granularity, engine="prophet"):
+    """Fit `engine` on the series and forecast the next `steps` periods, once a forecast slot is free."""
+    fit, predict = ENGINES[engine]
+    with forecast_slot():
+        return predict(fit(data), steps, granularity)
@@ -0,0 +1,291 @@
+"""Resumable, idempotent bulk import of sales CSV files.
+
+Files are streamed in chunks of lines. Each chunk is normalised (ISO or
+day-first dates, quoted or bare values), given a natural key hash, loaded into
+a staging table with COPY (plain inserts on databases without it) and moved
+into `property_sales` skipping keys already present. The byte offset reached in
+each file is saved in the same transaction as its rows, so an interrupted
+import resumes where it stopped and a repeated one inserts nothing.
+
+Usage (from the repository root):
+
+    python -m utils.importer data/
+    python -m utils.importer data/property_sales.csv --chunk-rows 200000
+"""
+import argparse
+import glob
+import hashlib
+import io
+import itertools
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from utils import events, partitions
+from utils.db_handler import DatabaseManager, commit, connection, engine
+
+
+CHUNK_ROWS = 100000
+
+SALE_COLUMNS = ["datesold", "price", "postcode", "property_type", "bedrooms", "natural_key"]
+
+SCHEMA = [
+    # Replaces the first importer's index on the key alone, which ON CONFLICT (natural_key, datesold) cannot use
+    "DROP INDEX IF EXISTS property_sales_natural_key_idx",
+    """CREATE UNIQUE INDEX IF NOT EXISTS property_sales_natural_key_date_idx
+        ON property_sales (natural_key, datesold) WHERE natural_key IS NOT NULL""",
+    """CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source VARCHAR PRIMARY KEY,
+        path VARCHAR NOT NULL,
+        byte_offset BIGINT NOT NULL,
+        rows_read BIGINT NOT NULL,
+        rows_inserted BIGINT NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    )""",
+    """CREATE TEMPORARY TABLE IF NOT EXISTS import_staging (
+        datesold DATE NOT NULL,
+        price FLOAT NOT NULL,
+        postcode VARCHAR NOT NULL,
+        property_type VARCHAR NOT NULL,
+        bedrooms INTEGER NOT NULL,
+        natural_key CHAR(32) NOT NULL
+    )""",
+    """CREATE TEMPORARY TABLE IF NOT EXISTS import_keys (
+        id INTEGER NOT NULL,
+        natural_key CHAR(32) NOT NULL
+    )""",
+]
+
+
+def ensure_schema(conn):
+    if "natural_key" not in {column["name"] for column in inspect(conn).get_columns("property_sales")}:
+        conn.execute(text("ALTER TABLE property_sales ADD COLUMN natural_key CHAR(32)"))
+    for statement in SCHEMA:
+        conn.execute(text(statement))
+
+
+# Parsing
+
+def natural_keys(sales):
+    """md5 of the normalised date, price, postcode, property type and bedrooms of each sale."""
+    fields = (
+        pd.to_datetime(sales["datesold"]).dt.strftime("%Y-%m-%d")
+        + "|" + sales["price"].astype(float).map("{:.2f}".format)
+        + "|" + sales["postcode"].astype(str).str.strip()
+        + "|" + sales["property_type"].astype(str).str.strip().str.lower()
+        + "|" + sales["bedrooms"].astype(int).astype(str)
+    )
+    return [hashlib.md5(value.encode()).hexdigest() for value in fields]
+
+
+def parse_dates(values):
+    # ISO dates with or without a time; anything else is read day first
+    dates = pd.to_datetime(values, format="ISO8601", errors="coerce")
+    retry = dates.isna() & values.ne("")
+    if retry.any():
+        dates[retry] = pd.to_datetime(values[retry], format="mixed", dayfirst=True, errors="coerce")
+    return dates
+
+
+def parse_chunk(raw):
+    """Normalised sales of a CSV chunk (header included), and the number of rows rejected."""
+    frame = pd.read_csv(io.BytesIO(raw), dtype=str, keep_default_na=False, skipinitialspace=True)
+    frame.columns = [column.strip().lower() for column in frame.columns]
+    frame = frame.rename(columns={"date_sold": "datesold"})
+
+    dates = parse_dates(frame["datesold"].str.strip())
+    price = pd.to_numeric(frame["price"].str.strip(), errors="coerce")
+    bedrooms = pd.to_numeric(frame["bedrooms"].str.strip(), errors="coerce")
+    postcode = frame["postcode"].str.strip()
+    property_type = frame["property_type"].str.strip().str.lower()
+    valid = (
+        dates.notna() & (price > 0) & (bedrooms >= 0) & (bedrooms % 1 == 0)
+        & postcode.ne("") & property_type.ne("")
+    )
+
+    sales = pd.DataFrame({
+        "datesold": dates[valid].dt.strftime("%Y-%m-%d"),
+        "price": price[valid].astype(float),
+        "postcode": postcode[valid],
+        "property_type": property_type[valid],
+        "bedrooms": bedrooms[valid].astype(int),
+    })
+    sales["natural_key"] = natural_keys(sales)
+    return sales, int((~valid).sum())
+
+
+def read_chunks(path, offset, chunk_rows):
+    """Yield (CSV bytes with the header, byte offset after the chunk, lines) from `offset` on."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(max(offset, f.tell()))
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            yield header + b"".join(lines), f.tell(), len(lines)
+
+
+def source_id(path):
+    """Identity of a file for checkpoints: a hash of its beginning, so appending keeps the offset valid."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(65536)).hexdigest()
+
+
+# Loading
+
+def load_staging(conn, sales):
+    conn.execute(text("DELETE FROM import_staging"))
+    if conn.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        sales[SALE_COLUMNS].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        with conn.connection.driver_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY import_staging ({', '.join(SALE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    else:
+        placeholders = ", ".join(f":{column}" for column in SALE_COLUMNS)
+        conn.execute(
+            text(f"INSERT INTO import_staging ({', '.join(SALE_COLUMNS)}) VALUES ({placeholders})"),
+            sales[SALE_COLUMNS].to_dict(orient="records"),
+        )
+
+
+def insert_new_sales(conn):
+    """Move the staged sales into property_sales, skipping natural keys already there."""
+    columns = ", ".join(SALE_COLUMNS)
+    result = conn.execute(text(f"""
+        INSERT INTO property_sales ({columns})
+        SELECT {columns} FROM import_staging WHERE true
+        ON CONFLICT (natural_key, datesold) WHERE natural_key IS NOT NULL DO NOTHING
+    """))
+    return max(result.rowcount, 0)
+
+
+def read_checkpoint(conn, source):
+    row = conn.execute(
+        text("SELECT byte_offset, rows_read, rows_inserted FROM import_checkpoints WHERE source = :source"),
+        {"source": source},
+    ).fetchone()
+    return tuple(row) if row else (0, 0, 0)
+
+
+def save_checkpoint(conn, source, path, offset, rows_read, rows_inserted):
+    conn.execute(text("""
+        INSERT INTO import_checkpoints (source, path, byte_offset, rows_read, rows_inserted, updated_at)
+        VALUES (:source, :path, :offset, :rows_read, :rows_inserted, :updated_at)
+        ON CONFLICT (source) DO UPDATE SET
+            path = excluded.path, byte_offset = excluded.byte_offset, rows_read = excluded.rows_read,
+            rows_inserted = excluded.rows_inserted, updated_at = excluded.updated_at
+    """), {"source": source, "path": path, "offset": offset, "rows_read": rows_read,
+           "rows_inserted": rows_inserted, "updated_at": datetime.utcnow()})
+
+
+def backfill_natural_keys(chunk_rows=CHUNK_ROWS):
+    """Give natural keys to sales inserted without one (by the app), so imports skip them."""
+    updated, last_id = 0, 0
+    while True:
+        with connection() as conn:
+            ensure_schema(conn)
+            rows = pd.read_sql_query(text("""
+                SELECT id, datesold, price, postcode, property_type, bedrooms FROM property_sales
+                WHERE natural_key IS NULL AND id > :last_id ORDER BY id LIMIT :limit
+            """), conn, params={"last_id": last_id, "limit": chunk_rows})
+            if rows.empty:
+                return updated
+            last_id = int(rows["id"].max())
+            keys = pd.DataFrame({"id": rows["id"].astype(int), "natural_key": natural_keys(rows)})
+            keys = keys.drop_duplicates("natural_key")  # Identical existing sales keep a single key
+
+            conn.execute(text("DELETE FROM import_keys"))
+            conn.execute(text("INSERT INTO import_keys (id, natural_key) VALUES (:id, :natural_key)"),
+                         keys.to_dict(orient="records"))
+            result = conn.execute(text("""
+                UPDATE property_sales SET natural_key = k.natural_key
+                FROM import_keys k
+                WHERE property_sales.id = k.id
+                  AND NOT EXISTS (SELECT 1 FROM property_sales e WHERE e.natural_key = k.natural_key)
+            """))
+            updated += max(result.rowcount, 0)
+            commit(conn)
+
+
+def import_file(path, chunk_rows=CHUNK_ROWS, restart=False):
+    """Import one CSV file from its checkpoint. Returns (rows read, rows inserted, rows rejected)."""
+    source = source_id(path)
+    with connection() as conn:
+        ensure_schema(conn)
+        offset, rows_read, rows_inserted = (0, 0, 0) if restart else read_checkpoint(conn, source)
+        commit(conn)
+    if offset:
+        print(f"{path}: resuming at byte {offset:,} ({rows_read:,} rows already read)")
+
+    read = inserted = rejected = 0
+    start = time.perf_counter()
+    for raw, offset, lines in read_chunks(path, offset, chunk_rows):
+        sales, chunk_rejected = parse_chunk(raw)
+        with connection() as conn:
+            ensure_schema(conn)
+            if not sales.empty:
+                years = pd.to_datetime(sales["datesold"]).dt.year
+                partitions.ensure_partitions(conn, int(years.min()), int(years.max()))
+            load_staging(conn, sales)
+            chunk_inserted = insert_new_sales(conn)
+            # Saved with the rows: after a crash the chunk is either fully imported or redone
+            save_checkpoint(conn, source, os.path.abspath(path), offset,
+                            rows_read + read + lines, rows_inserted + inserted + chunk_inserted)
+            commit(conn)
+        read += lines
+        inserted += chunk_inserted
+        rejected += chunk_rejected
+        elapsed = time.perf_counter() - start
+        print(f"{path}: {read:,} rows read, {inserted:,} inserted, {rejected:,} rejected "
+              f"({read / elapsed:,.0f} rows/s)")
+    return read, inserted, rejected
+
+
+def csv_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "*.csv")))
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import sales CSV files into property_sales.")
+    parser.add_argument("paths", nargs="+", help="CSV files or directories of CSV files")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--restart", action="store_true", help="Ignore saved checkpoints")
+    parser.add_argument("--skip-outlier-flags", action="store_true",
+                        help="Do not recompute the outlier flags after importing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    backfilled = backfill_natural_keys(args.chunk_rows)
+    if backfilled:
+        print(f"Gave natural keys to {backfilled:,} existing sales")
+
+    totals = [0, 0, 0]
+    for path in csv_paths(args.paths):
+        for index, value in enumerate(import_file(path, args.chunk_rows, args.restart)):
+            totals[index] += value
+    read, inserted, rejected = totals
+    elapsed = time.perf_counter() - start
+    print(f"Imported {inserted:,} new sales from {read:,} rows ({rejected:,} rejected) "
+          f"in {elapsed:.1f}s ({read / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    if inserted:
+        if not args.skip_outlier_flags:
+            DatabaseManager.update_outlier_flags()
+        # Every process drops its cached sales and rebuilds the cube
+        with connection() as conn:
+            events.publish(events.SALE_INSERTED, {"imported": inserted}, conn)
+            commit(conn)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from utils.db_handler import commit, connection
+
+
+# Jobs run at once by each API process; by default the cores are shared between the workers
+JOB_CONCURRENCY = int(os.getenv(
+    "FORECAST_JOB_CONCURRENCY",
+    max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY", 1)))),
+))
+
+# Running jobs not finished after this long are taken to belong to a dead process
+STALE_SECONDS = int(os.getenv("FORECAST_JOB_STALE_SECONDS", 3600))
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id VARCHAR PRIMARY KEY,
+        kind VARCHAR NOT NULL,
+        job_key VARCHAR NOT NULL,
+        params TEXT NOT NULL,
+        status VARCHAR NOT NULL,
+        result TEXT,
+        error TEXT,
+        user_id VARCHAR,
+        created_at TIMESTAMP NOT NULL,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )""",
+    # At most one pending or running job per key: identical submissions of a user share it
+    """CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key_idx
+        ON jobs (job_key) WHERE status IN ('pending', 'running')""",
+]
+
+JOB_COLUMNS = "id, kind, status, params, result, error, created_at, started_at, finished_at"
+
+
+def job_key(kind, params, user_id=None):
+    # Keyed by user too: a job is only visible to whoever submitted it
+    return hashlib.sha1(json.dumps([kind, params, user_id], sort_keys=True).encode()).hexdigest()
+
+
+def timestamp(value):
+    # SQLite hands timestamps back as text
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def job_record(row):
+    job = {
+        "id": row.id,
+        "kind": row.kind,
+        "status": row.status,
+        "params": json.loads(row.params),
+        "created_at": timestamp(row.created_at),
+        "started_at": timestamp(row.started_at),
+        "finished_at": timestamp(row.finished_at),
+    }
+    if row.status == DONE:
+        job["result"] = json.loads(row.result)
+    elif row.status == FAILED:
+        job["error"] = row.error
+    return job
+
+
+class JobQueue:
+    """Jobs of one kind, stored in the database and run on a bounded pool of threads.
+
+    `runner(params)` computes a job's JSON-serialisable result. Submitting
+    parameters identical to a pending or running job of the same user returns
+    that job instead of queueing another.
+    """
+
+    def __init__(self, kind, runner, max_workers=JOB_CONCURRENCY):
+        self.kind = kind
+        self.runner = runner
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{kind}-job")
+        self._schema_ready = False
+
+    def ensure_schema(self, conn):
+        if not self._schema_ready:
+            for statement in SCHEMA:
+                conn.execute(text(statement))
+            self._schema_ready = True
+
+    def submit(self, params, user_id=None):
+        """Queue a job, or find the identical one already queued. Returns (job, created)."""
+        key = job_key(self.kind, params, user_id)
+        with connection() as conn:
+            self.ensure_schema(conn)
+            job_id = conn.execute(text("""
+                INSERT INTO jobs (id, kind, job_key, params, status, user_id, created_at)
+                VALUES (:id, :kind, :job_key, :params, :status, :user_id, :created_at)
+                ON CONFLICT (job_key) WHERE status IN ('pending', 'running') DO NOTHING
+                RETURNING id
+            """), {
+                "id": uuid.uuid4().hex, "kind": self.kind, "job_key": key, "params": json.dumps(params),
+                "status": PENDING, "user_id": user_id, "created_at": datetime.utcnow(),
+            }).scalar()
+            created = job_id is not None
+            if not created:
+                # The active job with this key, or the latest one if it finished meanwhile
+                job_id = conn.execute(text("""
+                    SELECT id FROM jobs WHERE job_key = :job_key
+                    ORDER BY status IN ('pending', 'running') DESC, created_at DESC LIMIT 1
+                """), {"job_key": key}).scalar()
+            commit(conn)
+        if created:
+            self._executor.submit(self._run, job_id)
+        return self.get(job_id), created
+
+    def get(self, job_id, user_id=None):
+        """The job's status, with its result once done or its error once failed.
+
+        None if unknown, or when `user_id` is given and did not submit the job.
+        """
+        query = f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = :id AND kind = :kind"
+        if user_id is not None:
+            query += " AND user_id = :user_id"
+        with connection() as conn:
+            self.ensure_schema(conn)
+            row = conn.execute(text(query), {"id": job_id, "kind": self.kind, "user_id": user_id}).fetchone()
+            commit(conn)
+        return job_record(row) if row else None
+
+    def _run(self, job_id):
+        # Claim the job so a recovering process cannot run it a second time
+        with connection() as conn:
+            claimed = conn.execute(
+                text("UPDATE jobs SET status = :running, started_at = :now WHERE id = :id AND status = :pending"),
+                {"running": RUNNING, "pending": PENDING, "now": datetime.utcnow(), "id": job_id},
+            ).rowcount
+            params = conn.execute(text("SELECT params FROM jobs WHERE id = :id"), {"id": job_id}).scalar()
+            commit(conn)
+        if not claimed:
+            return
+
+        update = {"id": job_id, "result": None, "error": None}
+        try:
+            update.update(status=DONE, result=json.dumps(self.runner(json.loads(params))))
+        except Exception as e:
+            print(f"{self.kind} job {job_id} failed: {e}")
+            update.update(status=FAILED, error=str(e))
+        with connection() as conn:
+            conn.execute(text("""
+                UPDATE jobs SET status = :status, result = :result, error = :error, finished_at = :now
+                WHERE id = :id
+            """), {**update, "now": datetime.utcnow()})
+            commit(conn)
+
+    def recover(self):
+        """Requeue jobs left pending, or running past STALE_SECONDS, by a process that stopped."""
+        try:
+            with connection() as conn:
+                self.ensure_schema(conn)
+                conn.execute(text("""
+                    UPDATE jobs SET status = :pending, started_at = NULL
+                    WHERE kind = :kind AND status = :running AND started_at < :stale
+                """), {"pending": PENDING, "running": RUNNING, "kind": self.kind,
+                       "stale": datetime.utcnow() - timedelta(seconds=STALE_SECONDS)})
+                job_ids = conn.execute(
+                    text("SELECT id FROM jobs WHERE kind = :kind AND status = :pending ORDER BY created_at"),
+                    {"kind": self.kind, "pending": PENDING},
+                ).scalars().all()
+                commit(conn)
+        except Exception as e:
+            print(f"Failed to recover {self.kind} jobs: {e}")
+            return 0
+        # Every worker may try: the claim in _run lets only one of them run each job
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+        return len(job_ids)
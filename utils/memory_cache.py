@@ -0,0 +1,212 @@
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from utils import tracing
+
+
+# Bytes all the budgeted caches of the process may hold together
+CACHE_BUDGET_MB = float(os.getenv("CACHE_BUDGET_MB", 256))
+
+
+def sizeof(value):
+    """Approximate bytes held by a cached value."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, tuple):
+        return sum(sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sum(sizeof(item) for item in value.values())
+    # Altair charts: the tables they embed dominate their size
+    layers = getattr(value, "layer", None)
+    charts = layers if isinstance(layers, list) else [value]
+    tables = {id(chart.data): chart.data for chart in charts if isinstance(getattr(chart, "data", None), pd.DataFrame)}
+    if tables:
+        return sum(sizeof(table) for table in tables.values())
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def fingerprint(value, digest=None):
+    """Content hash of a function argument, so equal DataFrames map to the same cache entry."""
+    digest = digest or hashlib.blake2b(digest_size=16)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(type(value).__name__.encode())
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(repr(list(value.dtypes) if isinstance(value, pd.DataFrame) else value.dtype).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}:{len(value)}".encode())
+        for item in value:
+            fingerprint(item, digest)
+    elif isinstance(value, dict):
+        digest.update(f"dict:{len(value)}".encode())
+        for key in sorted(value, key=repr):
+            fingerprint(key, digest)
+            fingerprint(value[key], digest)
+    else:
+        digest.update(f"{type(value).__name__}:{value!r}".encode())
+    return digest
+
+
+def detach(value):
+    # Callers get their own DataFrame object, so renaming or adding columns does not touch the cached one
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    return value
+
+
+class FunctionStats:
+    __slots__ = ("entries", "bytes", "hits", "misses", "evictions", "compute_seconds")
+
+    def __init__(self):
+        self.entries = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compute_seconds = 0.0
+
+
+class MemoryBudget:
+    """Byte budget shared by several function caches, evicting the least recently used entry first."""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = int(budget_bytes)
+        self._entries = OrderedDict()  # (function name, key) -> (value, size)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def used_bytes(self):
+        return sum(stats.bytes for stats in self._stats.values())
+
+    def register(self, name):
+        with self._lock:
+            self._stats.setdefault(name, FunctionStats())
+
+    def get(self, name, key):
+        """Return (True, value) on a hit and mark the entry as recently used, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get((name, key))
+            if entry is None:
+                self._stats[name].misses += 1
+                return False, None
+            self._entries.move_to_end((name, key))
+            self._stats[name].hits += 1
+            return True, entry[0]
+
+    def put(self, name, key, value, compute_seconds=0.0):
+        size = sizeof(value)
+        with self._lock:
+            stats = self._stats[name]
+            stats.compute_seconds += compute_seconds
+            if size > self.budget_bytes:
+                return  # Larger than the whole budget: served but never kept
+            previous = self._entries.pop((name, key), None)
+            if previous is not None:
+                stats.entries -= 1
+                stats.bytes -= previous[1]
+            self._entries[(name, key)] = (value, size)
+            stats.entries += 1
+            stats.bytes += size
+            self._evict()
+
+    def _evict(self):
+        used = self.used_bytes
+        while used > self.budget_bytes and self._entries:
+            (name, _), (_, size) = self._entries.popitem(last=False)
+            stats = self._stats[name]
+            stats.entries -= 1
+            stats.bytes -= size
+            stats.evictions += 1
+            used -= size
+
+    def clear(self, name=None):
+        """Drop every entry of one function, or of all of them."""
+        with self._lock:
+            for entry_name, key in [k for k in self._entries if name is None or k[0] == name]:
+                _, size = self._entries.pop((entry_name, key))
+                self._stats[entry_name].entries -= 1
+                self._stats[entry_name].bytes -= size
+
+    def report(self):
+        """Per-function cache statistics, plus the total under 'total'."""
+        with self._lock:
+            rows = {
+                name: {slot: getattr(stats, slot) for slot in FunctionStats.__slots__}
+                for name, stats in self._stats.items()
+            }
+        rows["total"] = {
+            "entries": sum(row["entries"] for row in rows.values()),
+            "bytes": sum(row["bytes"] for row in rows.values()),
+            "budget_bytes": self.budget_bytes,
+        }
+        return rows
+
+
+MEMORY_BUDGET = MemoryBudget(CACHE_BUDGET_MB * 2**20)
+
+
+def budget_cache(func=None, budget=None):
+    """Memoise a function within the shared memory budget (a drop-in for `st.cache_data`).
+
+    Arguments are hashed by content. A None result (how loaders report a
+    failure, e.g. the database being down) is not kept, so the next call tries
+    again. The wrapper keeps a `clear()` method that drops this function's entries.
+    """
+    if func is None:
+        return functools.partial(budget_cache, budget=budget)
+    budget = budget or MEMORY_BUDGET
+    name = func.__qualname__
+    budget.register(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = fingerprint((args, kwargs)).hexdigest()
+        hit, value = budget.get(name, key)
+        tracing.annotate("cache.hit", hit)
+        if hit:
+            return detach(value)
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        if value is not None:
+            budget.put(name, key, value, time.perf_counter() - start)
+        return detach(value)
+
+    wrapper.clear = lambda: budget.clear(name)
+    return wrapper
+
+
+def process_memory():
+    """Resident and peak resident memory of this process in bytes (None where unavailable)."""
+    resident = None
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+    except ImportError:
+        peak = None
+    return {"resident_bytes": resident, "peak_resident_bytes": peak}
@@ -0,0 +1,73 @@
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from prophet.serialize import model_to_json, model_from_json
+
+
+# Fitted Prophet models shared by every worker on the machine (disabled when unset)
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR") or (
+    os.path.join(os.environ["SHARED_STATE_DIR"], "models") if os.getenv("SHARED_STATE_DIR") else None
+)
+
+# Models kept in the store; the least recently used are removed beyond this
+MODEL_STORE_MAX_FILES = int(os.getenv("MODEL_STORE_MAX_FILES", 200))
+
+
+def series_key(data):
+    """Content hash of a training series, independent of how its dates are typed."""
+    digest = hashlib.sha1()
+    digest.update(pd.to_datetime(data["time"]).to_numpy("datetime64[ns]").view(np.int64).tobytes())
+    digest.update(data["price"].to_numpy(np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def model_path(key):
+    return os.path.join(MODEL_STORE_DIR, f"prophet-{key}.json")
+
+
+def load_model(key):
+    """Load a fitted model from the store, or None if it is not there."""
+    if MODEL_STORE_DIR is None or not os.path.exists(model_path(key)):
+        return None
+    try:
+        with open(model_path(key)) as f:
+            model = model_from_json(f.read())
+        os.utime(model_path(key))  # Marks it recently used for pruning
+        return model
+    except Exception as e:
+        print(f"Failed to load stored model {key}: {e}")
+        return None
+
+
+def save_model(key, model):
+    """Store a fitted model; the file appears atomically for other workers."""
+    if MODEL_STORE_DIR is None:
+        return
+    try:
+        os.makedirs(MODEL_STORE_DIR, exist_ok=True)
+        temporary = f"{model_path(key)}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(model_to_json(model))
+        os.replace(temporary, model_path(key))
+        prune_models()
+    except Exception as e:
+        print(f"Failed to store model {key}: {e}")
+
+
+def prune_models(max_files=None):
+    """Remove the least recently used models beyond MODEL_STORE_MAX_FILES."""
+    max_files = MODEL_STORE_MAX_FILES if max_files is None else max_files
+    paths = glob.glob(os.path.join(MODEL_STORE_DIR, "prophet-*.json"))
+    if len(paths) <= max_files:
+        return 0
+    paths.sort(key=os.path.getmtime)
+    removed = 0
+    for path in paths[:len(paths) - max_files]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass  # Pruned by another worker meanwhile
+    return removed
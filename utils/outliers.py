@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+
+# Modified z-score above which a sale is flagged (Iglewicz and Hoaglin)
+THRESHOLD = 3.5
+
+# Segments with fewer sales are too small to judge, so nothing in them is flagged
+MIN_SEGMENT_SIZE = 20
+
+# Scales the MAD to the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+
+def segment_codes(data):
+    """One integer per sale identifying its (property type, bedrooms, year) segment, and the segment keys."""
+    # Factorising before lower-casing keeps the string work to the distinct values
+    type_codes, type_labels = pd.factorize(data["property_type"])
+    lowered_codes, lowered = pd.factorize(pd.Index(type_labels).astype(str).str.lower(), sort=True)
+    columns = [
+        (lowered_codes[type_codes], lowered),
+        pd.factorize(data["bedrooms"], sort=True),
+        pd.factorize(pd.DatetimeIndex(data["datesold"]).year, sort=True),
+    ]
+    codes = np.zeros(len(data), dtype=np.int64)
+    levels = []
+    for column_codes, uniques in columns:
+        codes = codes * len(uniques) + column_codes
+        levels.append(np.asarray(uniques).tolist())
+    return codes, levels
+
+
+def sort_within_groups(groups, values):
+    """Indices ordering the rows by group, then by value, with a single float sort.
+
+    Values are shifted into [0, span) so that group * span + value orders first by
+    group and then by value, which is much faster than a two-key lexsort.
+    """
+    low = values.min()
+    span = values.max() - low + 1.0
+    return np.argsort(groups * span + (values - low))
+
+
+def group_medians(sorted_values, starts, counts):
+    # The values are sorted within each group, so the median is the middle one (or two)
+    lower = sorted_values[starts + (counts - 1) // 2]
+    upper = sorted_values[starts + counts // 2]
+    return (lower + upper) / 2
+
+
+def segment_statistics(codes, log_price):
+    """Median and MAD of the log price per segment, computed with two sorts over the whole table.
+
+    Returns the segment codes, their sizes, medians and MADs, and for every sale
+    the index of its segment in those arrays.
+    """
+    order = sort_within_groups(codes, log_price)
+    sorted_codes = codes[order]
+    sorted_values = log_price[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_codes)])
+    medians = group_medians(sorted_values, starts, counts)
+
+    group_of_sorted = np.repeat(np.arange(len(starts)), counts)
+    deviations = np.abs(sorted_values - medians[group_of_sorted])
+    deviations = deviations[sort_within_groups(group_of_sorted, deviations)]
+    mads = group_medians(deviations, starts, counts)
+
+    group_of_row = np.empty(len(codes), dtype=np.int64)
+    group_of_row[order] = group_of_sorted
+    return sorted_codes[starts], counts, medians, mads, group_of_row
+
+
+def flag_outliers(data, threshold=THRESHOLD, min_segment_size=MIN_SEGMENT_SIZE):
+    """Boolean array marking sales whose price is far from the median of their segment.
+
+    Prices are compared on a log scale within each property type, number of
+    bedrooms and year, so a mis-keyed price stands out however large the segment's
+    typical price. Non-positive prices are always flagged.
+    """
+    if len(data) == 0:
+        return np.zeros(0, dtype=bool)
+    price = data["price"].to_numpy(dtype=np.float64)
+    valid = price > 0
+    log_price = np.log(np.where(valid, price, 1.0))
+    codes, _ = segment_codes(data)
+    codes = np.where(valid, codes + 1, 0)  # Keep invalid prices out of the statistics
+
+    _, counts, medians, mads, group = segment_statistics(codes, log_price)
+    scale = MAD_SCALE * mads[group]
+    judged = (counts[group] >= min_segment_size) & (scale > 0)
+    scores = np.abs(log_price - medians[group]) / np.where(judged, scale, 1.0)
+    return ~valid | (judged & (scores > threshold))
+
+
+def segment_bounds(data, threshold=THRESHOLD, min_segment_size=MIN_SEGMENT_SIZE):
+    """Accepted price range per (property type, bedrooms, year), for flagging new sales one at a time."""
+    data = data[data["price"] > 0]
+    if len(data) == 0:
+        return {}
+    codes, levels = segment_codes(data)
+    log_price = np.log(data["price"].to_numpy(dtype=np.float64))
+    segments, counts, medians, mads, _ = segment_statistics(codes, log_price)
+
+    bounds = {}
+    keep = (counts >= min_segment_size) & (mads > 0)
+    for code, median, mad in zip(segments[keep], medians[keep], mads[keep]):
+        key = []
+        for uniques in reversed(levels):
+            code, position = divmod(int(code), len(uniques))
+            key.append(uniques[position])
+        margin = threshold * MAD_SCALE * mad
+        bounds[tuple(reversed(key))] = (float(np.exp(median - margin)), float(np.exp(median + margin)))
+    return bounds
+
+
+def is_outlier(bounds, sale):
+    """Flag a single sale against precomputed segment bounds (sales in unknown segments pass)."""
+    price = float(sale["price"])
+    if price <= 0:
+        return True
+    key = (str(sale["property_type"]).lower(), int(sale["bedrooms"]), pd.Timestamp(sale["date_sold"]).year)
+    if key not in bounds:
+        return False
+    low, high = bounds[key]
+    return not low <= price <= high
+
+
+_bounds = None
+
+
+def get_bounds(loader):
+    """Return the segment bounds, computing them from `loader()` on first use."""
+    global _bounds
+    if _bounds is None:
+        data = loader()
+        if data is None:
+            return {}
+        _bounds = segment_bounds(data)
+    return _bounds
+
+
+def invalidate_bounds():
+    global _bounds
+    _bounds = None
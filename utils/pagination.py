@@ -0,0 +1,29 @@
+import math
+import streamlit as st
+
+
+def change_page(page_key, delta):
+    """Button callback moving the stored page by `delta`."""
+    st.session_state[page_key] = st.session_state.get(page_key, 0) + delta
+
+
+def page_controls(key, total_rows, page_size=20):
+    """Render previous/next controls and return the offset of the visible page."""
+    page_key = f"{key}_page"
+    n_pages = max(1, math.ceil(total_rows / page_size))
+    page = min(max(st.session_state.get(page_key, 0), 0), n_pages - 1)
+    st.session_state[page_key] = page
+
+    col1, col2, col3 = st.columns([1, 3, 1])
+    col1.button("◀ Previous", key=f"{key}_prev", disabled=page == 0,
+                on_click=change_page, args=(page_key, -1))
+    col2.write(f"Page {page + 1} of {n_pages} ({total_rows} records)")
+    col3.button("Next ▶", key=f"{key}_next", disabled=page >= n_pages - 1,
+                on_click=change_page, args=(page_key, 1))
+
+    return page * page_size
+
+
+def reset_page(key):
+    """Go back to the first page, e.g. when the filter changes."""
+    st.session_state[f"{key}_page"] = 0
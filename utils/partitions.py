@@ -0,0 +1,153 @@
+"""Yearly partitions of the property_sales table.
+
+On PostgreSQL the table is partitioned by range of `datesold`, one partition per
+year plus a default one, so reads over a date range only scan the years they
+cover and a past year can be detached for archiving without rewriting the
+table. Other databases keep a single table and every helper is a no-op there.
+
+    python -m utils.partitions migrate             # partition the existing table
+    python -m utils.partitions ensure --ahead 1    # add partitions up to next year
+    python -m utils.partitions archive 2007        # detach a year of sales
+"""
+import argparse
+from datetime import date
+
+from sqlalchemy import text
+
+from utils import events
+
+
+TABLE = "property_sales"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+# Recreated on the partitioned table: unique keys must include the partition key
+INDEXES = [
+    f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, datesold)",
+    f"ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users(id)",
+    f"CREATE INDEX {TABLE}_user_datesold_idx ON {TABLE} (user_id, datesold DESC, id DESC)",
+    f"""CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_natural_key_date_idx
+        ON {TABLE} (natural_key, datesold) WHERE natural_key IS NOT NULL""",
+]
+
+
+def partition_name(year):
+    return f"{TABLE}_y{year}"
+
+
+def archive_name(year):
+    return f"{TABLE}_archive_y{year}"
+
+
+def is_partitioned(conn):
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+    """), {"table": TABLE}).first() is not None
+
+
+def partition_years(conn):
+    """Years that have a partition attached, oldest first."""
+    if not is_partitioned(conn):
+        return []
+    names = conn.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)
+    """), {"table": TABLE}).scalars()
+    prefix = partition_name("")
+    return sorted(int(name[len(prefix):]) for name in names if name.startswith(prefix))
+
+
+def ensure_partitions(conn, first_year, last_year):
+    """Create the missing yearly partitions between two years (inclusive) on a partitioned table."""
+    if not is_partitioned(conn):
+        return []
+    existing = set(partition_years(conn))
+    created = []
+    for year in range(first_year, last_year + 1):
+        if year in existing:
+            continue
+        conn.execute(text(
+            f"CREATE TABLE {partition_name(year)} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+        created.append(year)
+    return created
+
+
+def migrate(conn, years_ahead=1):
+    """Turn an unpartitioned property_sales table into a partitioned one, in the caller's transaction."""
+    if conn.dialect.name != "postgresql":
+        raise RuntimeError("Partitioning needs PostgreSQL")
+    if is_partitioned(conn):
+        return False
+    first_year, last_year = conn.execute(text(
+        f"SELECT EXTRACT(YEAR FROM MIN(datesold))::int, EXTRACT(YEAR FROM MAX(datesold))::int FROM {TABLE}"
+    )).one()
+    current_year = date.today().year
+    first_year = first_year or current_year
+    last_year = max(last_year or current_year, current_year + years_ahead)
+
+    old = f"{TABLE}_unpartitioned"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": TABLE}).scalar()
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+    conn.execute(text(f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (datesold)"))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+    ensure_partitions(conn, first_year, last_year)
+    conn.execute(text(f"INSERT INTO {TABLE} SELECT * FROM {old}"))
+    if sequence:
+        # The id sequence would be dropped with the table that owns it
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    for statement in INDEXES:
+        conn.execute(text(statement))
+    return True
+
+
+def archive_partition(conn, year):
+    """Detach a year of sales into its own table, which can then be dumped and dropped."""
+    if year not in partition_years(conn):
+        return None
+    conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {partition_name(year)}"))
+    conn.execute(text(f"ALTER TABLE {partition_name(year)} RENAME TO {archive_name(year)}"))
+    # Sales disappeared: every process reloads them
+    events.publish(events.SALE_DELETED, {"archived": year}, conn)
+    return archive_name(year)
+
+
+def main():
+    from utils.db_handler import commit, connection, engine
+
+    parser = argparse.ArgumentParser(description="Manage the yearly partitions of property_sales (PostgreSQL).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Partition the existing table by year")
+    migrate_parser.add_argument("--ahead", type=int, default=1, help="Years after the current one to create")
+    ensure_parser = commands.add_parser("ensure", help="Create partitions up to a few years ahead")
+    ensure_parser.add_argument("--ahead", type=int, default=1)
+    archive_parser = commands.add_parser("archive", help="Detach the partition of a year")
+    archive_parser.add_argument("year", type=int)
+    args = parser.parse_args()
+
+    with connection() as conn:
+        if args.command == "migrate":
+            print("Partitioned property_sales" if migrate(conn, args.ahead) else "property_sales is already partitioned")
+        elif args.command == "ensure":
+            years = partition_years(conn)
+            if not years:
+                raise SystemExit("property_sales is not partitioned")
+            created = ensure_partitions(conn, years[-1], date.today().year + args.ahead)
+            print(f"Created partitions for {created}" if created else "Partitions are up to date")
+        else:
+            table = archive_partition(conn, args.year)
+            if table is None:
+                raise SystemExit(f"No partition for {args.year}")
+            print(f"Detached {args.year} as {table}")
+        commit(conn)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
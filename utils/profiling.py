@@ -0,0 +1,150 @@
+import contextlib
+import cProfile
+import glob
+import os
+import tempfile
+import threading
+import time
+
+from utils import events
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # Optional: cProfile is used without it
+    Profiler = None
+
+
+# Code paths that can be profiled
+TARGETS = ("predict_months", "filter_sales", "app_page")
+
+# Most runs of a target that can be armed at once
+MAX_RUNS = 100
+
+# Where profiles are written: speedscope JSON from pyinstrument, pstats from cProfile
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "property_profiles"))
+
+# "pyinstrument", "cprofile", or "auto" for pyinstrument when it is installed
+PROFILER = os.getenv("PROFILER", "auto")
+
+# Runs left to profile per target in this process; empty when profiling is off
+_armed = {}
+_lock = threading.Lock()
+# One profile at a time: Python allows a single active cProfile per process
+_active = threading.Lock()
+
+
+def profiler_name():
+    if Profiler is not None and PROFILER in ("auto", "pyinstrument"):
+        return "pyinstrument"
+    return "cprofile"
+
+
+def set_armed(target, runs):
+    with _lock:
+        if runs > 0:
+            _armed[target] = runs
+        else:
+            _armed.pop(target, None)
+
+
+def arm(target, runs):
+    """Profile the next `runs` runs of `target` in every process (0 to stop)."""
+    if target not in TARGETS:
+        raise ValueError(f"Unknown profiling target: {target}")
+    runs = max(0, min(runs, MAX_RUNS))
+    set_armed(target, runs)
+    from utils.db_handler import commit, connection
+    try:
+        with connection() as conn:
+            events.publish(events.PROFILING_ARMED, {"target": target, "runs": runs}, conn)
+            commit(conn)
+    except Exception as e:
+        print(f"Failed to arm profiling in other processes: {e}")
+    return runs
+
+
+def claim(target):
+    """Take one of the target's armed runs, if any is left."""
+    with _lock:
+        runs = _armed.get(target, 0)
+        if runs <= 0:
+            return False
+        if runs > 1:
+            _armed[target] = runs - 1
+        else:
+            del _armed[target]
+        return True
+
+
+class CProfiler:
+    # cProfile behind the start/stop interface of pyinstrument's Profiler
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+
+def write_profile(target, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{target}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.time_ns() % 10**6:06d}")
+    if isinstance(profiler, CProfiler):
+        path = stem + ".prof"
+        profiler.profile.dump_stats(path)
+    else:
+        path = stem + ".speedscope.json"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output(SpeedscopeRenderer()))
+    return path
+
+
+@contextlib.contextmanager
+def profiled(target):
+    """Profile the enclosed block (or decorated function) when runs of `target` are armed.
+
+    When nothing is armed this costs a dictionary lookup.
+    """
+    if not _armed or not _active.acquire(blocking=False):
+        yield
+        return
+    try:
+        if not claim(target):
+            yield
+            return
+        profiler = Profiler(async_mode="disabled") if profiler_name() == "pyinstrument" else CProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            try:
+                print(f"Wrote {target} profile to {write_profile(target, profiler)}")
+            except Exception as e:
+                print(f"Failed to write {target} profile: {e}")
+    finally:
+        _active.release()
+
+
+def recent_profiles(limit=20):
+    paths = glob.glob(os.path.join(PROFILE_DIR, "*.prof")) + glob.glob(os.path.join(PROFILE_DIR, "*.speedscope.json"))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    return [os.path.basename(path) for path in paths[:limit]]
+
+
+def status():
+    with _lock:
+        armed = dict(_armed)
+    return {
+        "profiler": profiler_name(),
+        "directory": PROFILE_DIR,
+        "armed": {target: armed.get(target, 0) for target in TARGETS},
+        "recent": recent_profiles(),
+    }
+
+
+events.subscribe(events.PROFILING_ARMED, lambda event: set_armed(event.payload["target"], event.payload["runs"]))
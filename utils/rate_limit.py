@@ -0,0 +1,84 @@
+import math
+import os
+import threading
+import time
+
+
+# Proxies in front of the app that append to X-Forwarded-For. 0 (the default) ignores the header,
+# which clients can set to anything when they reach the server directly
+FORWARDED_HOPS = int(os.getenv("FORWARDED_HOPS", 0))
+
+
+class TokenBucket:
+    """Token buckets per key: bursts of up to `capacity`, refilled at `rate` tokens per second."""
+
+    def __init__(self, capacity, rate, max_keys=100000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, monotonic time of the last update)
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        """Take tokens from the key's bucket. Returns 0 if allowed, else the seconds until it would be."""
+        now = time.monotonic()
+        with self._lock:
+            level, updated = self._buckets.get(key, (self.capacity, now))
+            level = min(self.capacity, level + (now - updated) * self.rate)
+            if level >= tokens:
+                self._buckets[key] = (level - tokens, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0.0
+            self._buckets[key] = (level, now)
+            return (tokens - level) / self.rate
+
+    def _prune(self, now):
+        # Buckets that have refilled completely behave like new ones, so they can be forgotten
+        full = [key for key, (level, updated) in self._buckets.items()
+                if level + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+
+
+def bucket_from_env(name, default):
+    """Bucket allowing "<requests>/<seconds>", read from the environment variable `name`."""
+    requests, seconds = os.getenv(name, default).split("/")
+    return TokenBucket(capacity=float(requests), rate=float(requests) / float(seconds))
+
+
+# Login attempts: 10 a minute per address, 5 every 5 minutes per account
+LOGIN_PER_IP = bucket_from_env("LOGIN_LIMIT_PER_IP", "10/60")
+LOGIN_PER_EMAIL = bucket_from_env("LOGIN_LIMIT_PER_EMAIL", "5/300")
+
+# Registrations: 5 every 10 minutes per address
+SIGNUP_PER_IP = bucket_from_env("SIGNUP_LIMIT_PER_IP", "5/600")
+
+
+def client_ip(headers, peer=None):
+    """Client address: the entry the nearest trusted proxy added to X-Forwarded-For, else the peer."""
+    forwarded = headers.get("x-forwarded-for") if headers is not None else None
+    if forwarded and FORWARDED_HOPS > 0:
+        addresses = [address.strip() for address in forwarded.split(",") if address.strip()]
+        if addresses:
+            # Entries left of the ones our proxies appended are supplied by the client
+            return addresses[max(len(addresses) - FORWARDED_HOPS, 0)]
+    return peer or "unknown"
+
+
+def check_login(ip, email):
+    """Seconds the caller must wait before another login attempt (0 if it may proceed)."""
+    # An address already turned away does not drain the account's bucket as well
+    wait = LOGIN_PER_IP.consume(ip)
+    if wait:
+        return wait
+    return LOGIN_PER_EMAIL.consume(email.strip().lower())
+
+
+def check_signup(ip):
+    """Seconds the caller must wait before another registration (0 if it may proceed)."""
+    return SIGNUP_PER_IP.consume(ip)
+
+
+def retry_after_header(seconds):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True, slots=True)
+class User:
+    """A row of the users table, without its password hash."""
+
+    id: object  # UUID on PostgreSQL, a string on the SQLite stand-in
+    email: str
+    role: str
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.id, row.email, row.role)
+
+
+class ResultSet:
+    """Query result stored by column: numeric columns as NumPy arrays, the others as tuples.
+
+    Serialised straight to JSON, Arrow or Parquet, with no DataFrame and no
+    object per row in between.
+    """
+
+    __slots__ = ("columns", "_data")
+
+    def __init__(self, columns, data):
+        self.columns = list(columns)
+        self._data = data  # name -> array or tuple, all of the same length
+
+    @classmethod
+    def from_rows(cls, columns, rows, dtypes=None):
+        """Build from a list of row tuples; `dtypes` gives the NumPy type of numeric columns by name."""
+        dtypes = dtypes or {}
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        data = {}
+        for name, column in zip(columns, values):
+            if name in dtypes:
+                data[name] = np.fromiter(column, dtype=dtypes[name], count=len(column))
+            else:
+                data[name] = column
+        return cls(columns, data)
+
+    @classmethod
+    def empty(cls, columns, dtypes=None):
+        return cls.from_rows(columns, [], dtypes)
+
+    def __len__(self):
+        return len(self._data[self.columns[0]]) if self.columns else 0
+
+    def column(self, name):
+        return self._data[name]
+
+    def as_lists(self):
+        """Columns as plain Python lists, by name."""
+        return {
+            name: values.tolist() if isinstance(values, np.ndarray) else list(values)
+            for name, values in self._data.items()
+        }
+
+    def records(self):
+        """Rows as dictionaries, for the few places that display them one by one."""
+        names = self.columns
+        return [dict(zip(names, row)) for row in zip(*self.as_lists().values())]
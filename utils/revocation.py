@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+from utils.bloom import BloomFilter
+
+
+# Seconds between reloads of the revoked token ids
+REFRESH_SECONDS = int(os.getenv("REVOCATION_REFRESH_SECONDS", 60))
+
+# Seconds between attempts while no load has succeeded, when every token is refused
+RETRY_SECONDS = int(os.getenv("REVOCATION_RETRY_SECONDS", 5))
+
+
+class RevocationList:
+    """Revoked token ids held in a Bloom filter, reloaded periodically.
+
+    Checking a token costs no database query unless the filter reports a
+    possible match, which is then confirmed exactly with `confirm`. Until a
+    load succeeds every token is taken to be revoked.
+    """
+
+    def __init__(self, load, confirm, refresh_seconds=REFRESH_SECONDS, retry_seconds=RETRY_SECONDS):
+        self._load = load
+        self._confirm = confirm
+        self._refresh_seconds = refresh_seconds
+        self._retry_seconds = retry_seconds
+        self._bloom = BloomFilter()
+        self._loaded_at = None
+        self._ready = False  # Whether a load has succeeded: until then the filter knows nothing
+        self._refreshing = threading.Lock()
+
+    def stale(self):
+        interval = self._refresh_seconds if self._ready else self._retry_seconds
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > interval
+
+    def refresh(self, wait=False):
+        """Reload the revoked ids, unless another thread is already doing it (or, with `wait`, after it)."""
+        if not self._refreshing.acquire(blocking=wait):
+            return
+        try:
+            if wait and not self.stale():
+                return  # Loaded, or attempted, by the thread we waited for
+            revoked = self._load()
+            if revoked is not None:
+                self._bloom = BloomFilter.from_keys(revoked)
+                self._ready = True
+            # On failure keep the previous filter and retry after the interval
+            self._loaded_at = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    def add(self, jti):
+        """Mark a token as revoked in this process without waiting for the next reload."""
+        self._bloom.add(jti)
+
+    def is_revoked(self, jti):
+        if self.stale():
+            # Until the first load succeeds, wait for it rather than trust an empty filter
+            self.refresh(wait=not self._ready)
+        if not self._ready:
+            # Fail closed, without querying a database the load could not reach
+            return True
+        if jti not in self._bloom:
+            return False
+        return self._confirm(jti)
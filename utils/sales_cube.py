@@ -0,0 +1,313 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+# Dimensions of the cube, in storage order
+DIMENSIONS = ("month", "property_type", "bedrooms", "postcode")
+
+# Log-spaced price buckets (~5.6% wide) from 1k to 100M, well beyond the range accepted by the
+# sales form, plus an underflow and an overflow bucket so no sale is counted in the wrong bucket
+PRICE_EDGES = np.concatenate([[0.0], np.geomspace(1_000, 100_000_000, 214), [np.inf]])
+N_BINS = len(PRICE_EDGES) - 1
+
+QUANTILES = {"p10": 0.1, "median": 0.5, "p90": 0.9}
+
+
+def month_key(value):
+    """Convert a date, timestamp or 'YYYY-MM[-DD]' string into a month number."""
+    ts = pd.Timestamp(value)
+    return ts.year * 12 + ts.month - 1
+
+
+def month_label(key):
+    """Convert a month number back into a 'YYYY-MM' label."""
+    return f"{key // 12:04d}-{key % 12 + 1:02d}"
+
+
+def price_bin(prices):
+    """Map prices to their histogram bucket."""
+    bins = np.searchsorted(PRICE_EDGES, prices, side="right") - 1
+    return np.clip(bins, 0, N_BINS - 1)
+
+
+class SalesCube:
+    """In-memory OLAP cube of property sales.
+
+    Each occupied (month, property_type, bedrooms, postcode) cell stores a price
+    histogram and the price sum, so counts and means are exact and quantiles are
+    interpolated within a price bucket (~5.6% wide). A dense rollup without the
+    postcode dimension answers the most common slices without touching the
+    sparse base cells.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.is_built = False
+        self._reset()
+
+    def _reset(self):
+        self._labels = {"property_type": [], "postcode": []}
+        self._codes = {"property_type": {}, "postcode": {}}
+        self._cell_index = {}
+        self._n_cells = 0
+        self._coords = np.zeros((0, len(DIMENSIONS)), dtype=np.int64)
+        self._hist = np.zeros((0, N_BINS), dtype=np.int32)
+        self._sum = np.zeros(0, dtype=np.float64)
+        self._rollup_hist = None
+        self._rollup_sum = None
+        self._rollup_origin = 0
+
+    def _code(self, dim, label):
+        codes = self._codes[dim]
+        if label not in codes:
+            codes[label] = len(self._labels[dim])
+            self._labels[dim].append(label)
+        return codes[label]
+
+    # Building
+
+    def build(self, data):
+        """Build the cube from a property_sales DataFrame in one vectorised pass."""
+        with self._lock:
+            self._reset()
+            if data is not None and not data.empty:
+                dates = pd.to_datetime(data["datesold"])
+                types, type_labels = pd.factorize(data["property_type"].astype(str))
+                postcodes, postcode_labels = pd.factorize(data["postcode"].astype(str))
+                for label in type_labels:
+                    self._code("property_type", label)
+                for label in postcode_labels:
+                    self._code("postcode", label)
+
+                coords = np.column_stack([
+                    (dates.dt.year * 12 + dates.dt.month - 1).to_numpy(np.int64),
+                    types.astype(np.int64),
+                    data["bedrooms"].to_numpy(np.int64),
+                    postcodes.astype(np.int64),
+                ])
+                prices = data["price"].to_numpy(np.float64)
+
+                cells, inverse = np.unique(coords, axis=0, return_inverse=True)
+                inverse = inverse.ravel()
+                self._coords = cells
+                self._n_cells = len(cells)
+                self._hist = np.zeros((len(cells), N_BINS), dtype=np.int32)
+                np.add.at(self._hist, (inverse, price_bin(prices)), 1)
+                self._sum = np.bincount(inverse, weights=prices, minlength=len(cells))
+                self._cell_index = {tuple(cell): i for i, cell in enumerate(cells.tolist())}
+
+            self._build_rollup()
+            self.is_built = True
+
+    def _build_rollup(self):
+        """Aggregate the base cells into the dense month x type x bedrooms rollup."""
+        coords = self._coords[:self._n_cells]
+        if len(coords) == 0:
+            self._rollup_origin = 0
+            self._rollup_hist = np.zeros((0, 0, 0, N_BINS), dtype=np.int32)
+            self._rollup_sum = np.zeros((0, 0, 0))
+            return
+
+        self._rollup_origin = int(coords[:, 0].min())
+        shape = (
+            int(coords[:, 0].max()) - self._rollup_origin + 1,
+            len(self._labels["property_type"]),
+            int(coords[:, 2].max()) + 1,
+        )
+        self._rollup_hist = np.zeros(shape + (N_BINS,), dtype=np.int32)
+        self._rollup_sum = np.zeros(shape)
+        index = (coords[:, 0] - self._rollup_origin, coords[:, 1], coords[:, 2])
+        np.add.at(self._rollup_hist, index, self._hist[:self._n_cells])
+        np.add.at(self._rollup_sum, index, self._sum[:self._n_cells])
+
+    # Incremental refresh
+
+    def invalidate(self):
+        """Forget the cube so it is rebuilt from the database on next use."""
+        with self._lock:
+            self.is_built = False
+            self._reset()
+
+    def add_sales(self, records):
+        """Add inserted sales to the cube."""
+        self._apply(records, 1)
+
+    def remove_sales(self, records):
+        """Remove deleted sales from the cube."""
+        self._apply(records, -1)
+
+    def _apply(self, records, sign):
+        with self._lock:
+            if not self.is_built:
+                return  # The next build will read the change from the database
+            rollup_stale = False
+            for record in records:
+                date = record.get("datesold", record.get("date_sold"))
+                price = float(record["price"])
+                cell = (
+                    month_key(date),
+                    self._code("property_type", str(record["property_type"])),
+                    int(record["bedrooms"]),
+                    self._code("postcode", str(record["postcode"])),
+                )
+                index = self._cell_index.get(cell)
+                bucket = int(price_bin(price))
+                if sign < 0 and (index is None or self._hist[index, bucket] == 0):
+                    # Removing a sale the cube never counted: it is out of step, rebuild it on next use
+                    self.invalidate()
+                    return
+                if index is None:
+                    index = self._append_cell(cell)
+                self._hist[index, bucket] += sign
+                self._sum[index] += sign * price
+
+                rollup_index = (cell[0] - self._rollup_origin, cell[1], cell[2])
+                if all(0 <= i < n for i, n in zip(rollup_index, self._rollup_sum.shape)):
+                    self._rollup_hist[rollup_index + (bucket,)] += sign
+                    self._rollup_sum[rollup_index] += sign * price
+                else:
+                    rollup_stale = True
+
+            if rollup_stale:
+                self._build_rollup()
+
+    def _append_cell(self, cell):
+        if self._n_cells == len(self._coords):
+            capacity = max(16, 2 * len(self._coords))
+            self._coords = np.resize(self._coords, (capacity, len(DIMENSIONS)))
+            hist = np.zeros((capacity, N_BINS), dtype=np.int32)
+            hist[:self._n_cells] = self._hist[:self._n_cells]
+            self._hist = hist
+            self._sum = np.concatenate([self._sum[:self._n_cells], np.zeros(capacity - self._n_cells)])
+        index = self._n_cells
+        self._coords[index] = cell
+        self._hist[index] = 0
+        self._sum[index] = 0.0
+        self._cell_index[cell] = index
+        self._n_cells += 1
+        return index
+
+    # Querying
+
+    def query(self, group_by=(), start_month=None, end_month=None,
+              property_types=None, bedrooms=None, postcodes=None):
+        """Return count, mean, median, p10 and p90 price for each group of the slice."""
+        for dim in group_by:
+            if dim not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension '{dim}'")
+
+        with self._lock:
+            if "postcode" in group_by or postcodes:
+                coords, hist, sums = self._slice_cells(start_month, end_month, property_types, bedrooms, postcodes)
+            else:
+                coords, hist, sums = self._slice_rollup(start_month, end_month, property_types, bedrooms)
+
+        dims = [DIMENSIONS.index(dim) for dim in group_by]
+        if dims:
+            keys = coords[:, dims]
+            sizes = keys.max(axis=0) + 1 if len(keys) else np.ones(len(dims), dtype=np.int64)
+            flat = np.ravel_multi_index(keys.T, sizes) if len(keys) else np.zeros(0, dtype=np.int64)
+            groups, inverse = np.unique(flat, return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            starts = np.searchsorted(inverse[order], np.arange(len(groups)))
+            hist = np.add.reduceat(hist[order], starts, axis=0) if len(groups) else hist[:0]
+            sums = np.add.reduceat(sums[order], starts) if len(groups) else sums[:0]
+            group_keys = np.column_stack(np.unravel_index(groups, sizes)) if len(groups) else keys[:0]
+        else:
+            hist = hist.sum(axis=0, keepdims=True)
+            sums = np.array([sums.sum()])
+            group_keys = np.zeros((1, 0), dtype=np.int64)
+
+        counts = hist.sum(axis=1)
+        occupied = counts > 0
+        hist, sums, counts, group_keys = hist[occupied], sums[occupied], counts[occupied], group_keys[occupied]
+        quantiles = {name: self._quantile(hist, counts, q) for name, q in QUANTILES.items()}
+        means = sums / np.maximum(counts, 1)
+
+        rows = []
+        for i, key in enumerate(group_keys.tolist()):
+            row = {dim: self._decode(dim, value) for dim, value in zip(group_by, key)}
+            row["count"] = int(counts[i])
+            row["mean"] = round(float(means[i]), 0)
+            for name in QUANTILES:
+                row[name] = round(float(quantiles[name][i]), 0)
+            rows.append(row)
+        return rows
+
+    def _slice_cells(self, start_month, end_month, property_types, bedrooms, postcodes):
+        coords = self._coords[:self._n_cells]
+        mask = np.ones(len(coords), dtype=bool)
+        if start_month is not None:
+            mask &= coords[:, 0] >= start_month
+        if end_month is not None:
+            mask &= coords[:, 0] <= end_month
+        if property_types:
+            mask &= np.isin(coords[:, 1], self._encode("property_type", property_types))
+        if bedrooms:
+            mask &= np.isin(coords[:, 2], list(bedrooms))
+        if postcodes:
+            mask &= np.isin(coords[:, 3], self._encode("postcode", postcodes))
+        return coords[mask], self._hist[:self._n_cells][mask], self._sum[:self._n_cells][mask]
+
+    def _slice_rollup(self, start_month, end_month, property_types, bedrooms):
+        n_months, n_types, n_beds = self._rollup_sum.shape
+        months = np.arange(n_months)
+        if start_month is not None:
+            months = months[months >= start_month - self._rollup_origin]
+        if end_month is not None:
+            months = months[months <= end_month - self._rollup_origin]
+        types = np.arange(n_types)
+        if property_types:
+            types = np.intersect1d(types, self._encode("property_type", property_types))
+        beds = np.arange(n_beds)
+        if bedrooms:
+            beds = np.intersect1d(beds, list(bedrooms))
+
+        index = np.ix_(months, types, beds)
+        hist = self._rollup_hist[index].reshape(-1, N_BINS)
+        sums = self._rollup_sum[index].ravel()
+        grid = np.meshgrid(months + self._rollup_origin, types, beds, indexing="ij")
+        coords = np.column_stack([g.ravel() for g in grid] + [np.zeros(hist.shape[0], dtype=np.int64)])
+        return coords, hist, sums
+
+    @staticmethod
+    def _quantile(hist, counts, q):
+        """Interpolate a quantile inside the price bucket that contains it."""
+        if len(hist) == 0:
+            return np.zeros(0)
+        cumulative = np.cumsum(hist, axis=1)
+        target = np.maximum(q * counts, 1e-9)
+        bucket = np.minimum((cumulative < target[:, None]).sum(axis=1), N_BINS - 1)
+        rows = np.arange(len(hist))
+        below = cumulative[rows, bucket] - hist[rows, bucket]
+        fraction = (target - below) / np.maximum(hist[rows, bucket], 1)
+        # The underflow and overflow buckets have no width: their quantiles are the edge of the range
+        lower = np.maximum(PRICE_EDGES[bucket], PRICE_EDGES[1])
+        upper = np.minimum(PRICE_EDGES[bucket + 1], PRICE_EDGES[-2])
+        return lower * (upper / lower) ** np.clip(fraction, 0, 1)
+
+    def _encode(self, dim, labels):
+        codes = self._codes[dim]
+        return [codes[str(label)] for label in labels if str(label) in codes]
+
+    def _decode(self, dim, value):
+        if dim == "month":
+            return month_label(value)
+        if dim == "bedrooms":
+            return value
+        return self._labels[dim][value]
+
+
+# Process-wide cube shared by the API and the database layer
+SALES_CUBE = SalesCube()
+
+
+def get_cube(loader):
+    """Return the shared cube, building it with `loader` on first use."""
+    if not SALES_CUBE.is_built:
+        data = loader()
+        if data is None:
+            return None
+        SALES_CUBE.build(data)
+    return SALES_CUBE
@@ -0,0 +1,113 @@
+import io
+import uuid
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi import HTTPException
+from fastapi.responses import Response
+from utils.records import ResultSet
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow and Parquet responses are optional
+    pa = None
+    pq = None
+
+
+JSON = "application/json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+MEDIA_TYPES = (JSON, ARROW_STREAM, PARQUET)
+
+# OpenAPI description of the bulk endpoints' bodies
+BULK_RESPONSES = {200: {"content": {media_type: {} for media_type in MEDIA_TYPES}}}
+
+
+def negotiate(accept):
+    """Pick the response media type from an Accept header (JSON unless Arrow or Parquet is asked for)."""
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in (ARROW_STREAM, PARQUET):
+            return media_type
+        if media_type in ("application/x-parquet", "application/parquet"):
+            return PARQUET
+    return JSON
+
+
+def frame_columns(data):
+    """Columns of a DataFrame or ResultSet as Python lists, by name."""
+    if isinstance(data, ResultSet):
+        return data.as_lists()
+    columns = {}
+    for name in data.columns:
+        values = data[name]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime("%Y-%m-%dT%H:%M:%S")
+        columns[str(name)] = values.tolist()
+    return columns
+
+
+def json_bytes(data, layout="records"):
+    """Encode a DataFrame or ResultSet with orjson, as a list of records or as one list per column."""
+    columns = frame_columns(data)
+    if layout == "columns":
+        return orjson.dumps(columns)
+    names = list(columns)
+    return orjson.dumps([dict(zip(names, row)) for row in zip(*columns.values())])
+
+
+def arrow_table(data):
+    # Arrow has no UUID type, so ids are sent as strings
+    if isinstance(data, ResultSet):
+        columns = {}
+        for name in data.columns:
+            values = data.column(name)
+            first = None if isinstance(values, np.ndarray) else next((v for v in values if v is not None), None)
+            if isinstance(first, uuid.UUID):
+                values = [str(v) if v is not None else None for v in values]
+            columns[name] = values
+        return pa.Table.from_pydict(columns)
+    data = data.copy(deep=False)
+    for name in data.columns:
+        if data[name].dtype != object:
+            continue
+        values = data[name].dropna()
+        if len(values) and isinstance(values.iloc[0], uuid.UUID):
+            data[name] = [str(v) if v is not None else None for v in data[name].tolist()]
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def arrow_bytes(data):
+    table = arrow_table(data)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def parquet_bytes(data):
+    sink = io.BytesIO()
+    pq.write_table(arrow_table(data), sink)
+    return sink.getvalue()
+
+
+def encode_frame(data, media_type, layout="records"):
+    """Serialise a DataFrame or ResultSet in the given media type."""
+    if media_type == JSON:
+        return json_bytes(data, layout)
+    if pa is None:
+        raise HTTPException(status_code=406, detail="Arrow and Parquet responses require pyarrow")
+    if media_type == ARROW_STREAM:
+        return arrow_bytes(data)
+    return parquet_bytes(data)
+
+
+def frame_response(data, request, layout="records"):
+    """Response for a bulk DataFrame or ResultSet, in the format the client accepts, without per-row validation."""
+    media_type = negotiate(request.headers.get("accept"))
+    return Response(
+        content=encode_frame(data, media_type, layout),
+        media_type=media_type,
+        headers={"Vary": "Accept"},
+    )
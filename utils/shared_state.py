@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from utils import events
+
+
+# Directory shared by all API workers on the machine (disabled when unset)
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR")
+
+MANIFEST = "sales.json"
+PUBLISH_LOCK = ".publish.lock"
+
+# Seconds to wait after a sale event before publishing the sales again, so a burst of writes is published once
+REPUBLISH_DELAY_SECONDS = float(os.getenv("SNAPSHOT_REPUBLISH_DELAY_SECONDS", 2))
+
+_snapshot = None
+# Version made stale by a sale event (or that failed to load): read the database until a newer one is published
+_stale_version = None
+# Time of the latest sale event this process has not yet republished
+_changed_at = None
+_snapshot_lock = threading.Lock()
+
+
+def code_dtype(n_labels):
+    """Smallest integer type pandas uses for categorical codes, so loading needs no conversion."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_labels < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def publish_sales_snapshot(data, directory=None, loaded_at=None):
+    """Write the sales table as one .npy file per column and switch the manifest to it atomically.
+
+    `loaded_at` is when the data was read, so later changes are known to be missing from it.
+    """
+    directory = directory or SHARED_STATE_DIR
+    loaded_at = loaded_at or time.time()
+    version = f"sales-{time.time_ns()}"
+    target = os.path.join(directory, version)
+    os.makedirs(target)
+
+    columns = {}
+    for name in data.columns:
+        values = data[name]
+        if name == "datesold":
+            np.save(os.path.join(target, f"{name}.npy"), pd.to_datetime(values).to_numpy("datetime64[ns]"))
+            columns[name] = {"kind": "date"}
+        elif values.dtype == object:
+            # Strings are stored as integer codes plus their labels
+            codes, labels = pd.factorize(values.astype(str).where(values.notna()))
+            np.save(os.path.join(target, f"{name}.npy"), codes.astype(code_dtype(len(labels))))
+            columns[name] = {"kind": "category", "labels": [str(label) for label in labels]}
+        else:
+            np.save(os.path.join(target, f"{name}.npy"), values.to_numpy())
+            columns[name] = {"kind": "numeric"}
+
+    manifest = {"version": version, "rows": len(data), "loaded_at": loaded_at, "columns": columns}
+    temporary = os.path.join(directory, f".{MANIFEST}.{os.getpid()}")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f)
+    previous = read_manifest(directory)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+    # Workers keep their mappings of the old files valid even once unlinked
+    if previous is not None:
+        shutil.rmtree(os.path.join(directory, previous["version"]), ignore_errors=True)
+    return version
+
+
+def read_manifest(directory=None):
+    path = os.path.join(directory or SHARED_STATE_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_sales_snapshot(directory=None):
+    """Map the published snapshot read-only into this process as a DataFrame."""
+    directory = directory or SHARED_STATE_DIR
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+
+    columns = {}
+    for name, spec in manifest["columns"].items():
+        values = np.load(os.path.join(directory, manifest["version"], f"{name}.npy"), mmap_mode="r")
+        if spec["kind"] == "category":
+            columns[name] = pd.Categorical.from_codes(values, categories=spec["labels"])
+        else:
+            columns[name] = values
+    # copy=False keeps numeric columns backed by the shared mapping
+    return pd.DataFrame(columns, copy=False)
+
+
+def get_sales_snapshot():
+    """Return the shared snapshot, or None if there is none or the data changed since it was published."""
+    global _snapshot, _stale_version
+    if SHARED_STATE_DIR is None:
+        return None
+    with _snapshot_lock:
+        if _snapshot is None:
+            manifest = read_manifest()
+            if manifest is None or manifest["version"] == _stale_version:
+                return None
+            try:
+                _snapshot = load_sales_snapshot()
+                _stale_version = None
+            except Exception as e:
+                print(f"Failed to load the shared sales snapshot: {e}")
+                _stale_version = manifest["version"]
+        return _snapshot
+
+
+def republish_sales_snapshot():
+    """Read the sales again and publish them, once per burst of changes across the workers of the machine."""
+    global _changed_at
+    time.sleep(REPUBLISH_DELAY_SECONDS)
+    with _snapshot_lock:
+        changed_at, _changed_at = _changed_at, None
+
+    import fcntl
+    from utils.db_handler import DatabaseManager
+    try:
+        with open(os.path.join(SHARED_STATE_DIR, PUBLISH_LOCK), "a") as lock:
+            # Workers take turns; those that get the lock after a fresh enough publication have nothing to do
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = read_manifest()
+            if manifest is not None and manifest.get("loaded_at", 0) >= changed_at:
+                return
+            loaded_at = time.time()
+            data = DatabaseManager.load_data.__wrapped__()  # Not this process' cache, which may predate the change
+            if data is None or data.empty:
+                return
+            version = publish_sales_snapshot(data, loaded_at=loaded_at)
+            print(f"Republished sales snapshot {version} ({len(data)} rows)")
+    except Exception as e:
+        print(f"Failed to republish the shared sales snapshot: {e}")
+
+
+def drop_sales_snapshot(event):
+    """Sales changed: read through the database cache until the snapshot is published again."""
+    global _snapshot, _stale_version, _changed_at
+    if SHARED_STATE_DIR is None:
+        return
+    manifest = read_manifest()
+    with _snapshot_lock:
+        if manifest is not None:
+            _stale_version = manifest["version"]
+        _snapshot = None
+        schedule = _changed_at is None
+        _changed_at = time.time()
+    if schedule:
+        threading.Thread(target=republish_sales_snapshot, name="snapshot-republish", daemon=True).start()
+
+
+events.subscribe(events.SALE_EVENTS, drop_sales_snapshot)
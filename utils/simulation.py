@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from utils import events
+from utils.bundle import horizon_steps
+from utils.forecast_engines import fit_prophet
+from utils.admission import forecast_slot
+from utils.memory_cache import budget_cache
+from utils.model_store import series_key
+
+
+# Price paths drawn per series
+DEFAULT_PATHS = 2000
+MAX_PATHS = 10000
+
+DEFAULT_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def in_sample_residuals(model):
+    """Observed minus fitted price over the training history."""
+    history = model.history[["ds", "y"]]
+    fitted = predict_mean(model, pd.DataFrame({"ds": model.history_dates}))
+    fitted = pd.Series(fitted["yhat"].to_numpy(), index=fitted["ds"])
+    return (history["y"] - fitted.reindex(history["ds"]).to_numpy()).to_numpy(np.float64)
+
+
+def predict_mean(model, dates):
+    # Prophet only samples its own intervals when uncertainty_samples is set
+    uncertainty_samples = model.uncertainty_samples
+    model.uncertainty_samples = 0
+    try:
+        return model.predict(dates)
+    finally:
+        model.uncertainty_samples = uncertainty_samples
+
+
+def trend_shocks(model, times, n_paths, rng):
+    """Future trend deviations per path, drawn the way Prophet samples trend uncertainty.
+
+    Rate changes occur at the rate changepoints were placed in the history, with
+    Laplace-distributed size scaled to the fitted changes. Each period holds at
+    most one change, which then bends the trend for every later period.
+    """
+    if model.growth != "linear" or not len(model.changepoints_t):
+        return np.zeros((n_paths, len(times)))
+    deltas = np.asarray(model.params["delta"]).mean(axis=0)
+    scale = np.mean(np.abs(deltas)) + 1e-8
+    periods = np.diff(np.r_[model.history["t"].max(), times])
+    change_probability = 1 - np.exp(-len(model.changepoints_t) * periods)
+
+    changes = rng.random((n_paths, len(times))) < change_probability
+    slope = np.cumsum(np.where(changes, rng.laplace(0, scale, (n_paths, len(times))), 0.0), axis=1)
+    return np.cumsum(slope * periods, axis=1) * model.y_scale
+
+
+def simulate_prophet(model, steps, n_paths, seed=None):
+    """Monthly price paths from a fitted Prophet model: its forecast plus trend shocks and bootstrapped residuals.
+
+    Returns the forecast dates and a read-only (paths x steps) matrix.
+    """
+    rng = np.random.default_rng(seed)
+    future = model.make_future_dataframe(periods=steps, freq="M", include_history=False)
+    mean = predict_mean(model, future)["yhat"].to_numpy(np.float64)
+    times = ((future["ds"] - model.start) / model.t_scale).to_numpy(np.float64)
+
+    residuals = in_sample_residuals(model)
+    noise = rng.choice(residuals, size=(n_paths, steps)) if len(residuals) else 0.0
+    paths = mean + trend_shocks(model, times, n_paths, rng) + noise
+    paths.setflags(write=False)
+    return pd.DatetimeIndex(future["ds"]), paths
+
+
+@budget_cache
+def sample_paths(data, n_paths=DEFAULT_PATHS):
+    """Price paths for a monthly series up to the furthest year the page offers, memoised per series.
+
+    The seed is derived from the series, so every worker draws the same paths.
+    """
+    key = series_key(data)
+    steps = horizon_steps(pd.to_datetime(data["time"]).max(), "Month")
+    with forecast_slot():
+        return simulate_prophet(fit_prophet(data), steps, n_paths, seed=int(key[:8], 16))
+
+
+def quantile_table(dates, paths, quantiles, year=None, months=None):
+    """Mean and quantiles of the simulated price per month, optionally for one year and some months only."""
+    selected = np.ones(len(dates), dtype=bool)
+    if year is not None:
+        selected &= dates.year == year
+    if months:
+        selected &= np.isin(dates.month, months)
+    values = paths[:, selected]
+    table = pd.DataFrame({"time": dates[selected], "mean": values.mean(axis=0)})
+    for quantile, row in zip(quantiles, np.quantile(values, quantiles, axis=0)):
+        table[quantile_label(quantile)] = row
+    return table
+
+
+def quantile_label(quantile):
+    return f"p{quantile * 100:g}"
+
+
+def clear_simulation_cache(event):
+    """Sales changed: the simulated series are stale."""
+    sample_paths.clear()
+
+
+events.subscribe(events.SALE_EVENTS, clear_simulation_cache)
@@ -0,0 +1,148 @@
+import contextlib
+import contextvars
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+
+# Where finished traces go: "none", "console" (stdout) or "file" (TRACE_FILE)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(tempfile.gettempdir(), "property_traces.jsonl"))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "property-sales")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Finished spans of the trace running in this context; shared with threads the trace spawns
+_trace_spans = contextvars.ContextVar("trace_spans", default=None)
+_file_lock = threading.Lock()
+
+
+class Span:
+    """A timed stage of a request or page render."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "spans")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.error = None
+        self.spans = None  # Every finished span of the trace, on the root span only
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a span, child of the span running in this context.
+
+    The outermost span starts a trace, which is exported when it ends.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    span_token = _current_span.set(current)
+    spans = _trace_spans.get()
+    trace_token = None
+    if spans is None:
+        spans = current.spans = []
+        trace_token = _trace_spans.set(spans)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(span_token)
+        spans.append(current)
+        if trace_token is not None:
+            _trace_spans.reset(trace_token)
+            export(spans)
+
+
+def annotate(key, value):
+    """Set an attribute on the span running in this context, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(key, value)
+
+
+# Export, in the OTLP/JSON layout read by OpenTelemetry collectors' file receivers
+
+def attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(span):
+    data = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": attribute_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+def otlp_trace(spans):
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "utils.tracing"}, "spans": [otlp_span(span) for span in spans]}],
+    }]}
+
+
+def export(spans):
+    if TRACE_EXPORTER == "none":
+        return
+    try:
+        line = json.dumps(otlp_trace(spans))
+        if TRACE_EXPORTER == "console":
+            print(line, file=sys.stdout, flush=True)
+        elif TRACE_EXPORTER == "file":
+            with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        print(f"Failed to export trace: {e}")
+
+
+# Server-Timing
+
+def metric_name(name):
+    # Server-Timing names are HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", "_", name)
+
+
+def server_timing(root):
+    """Server-Timing header value for a finished root span: one metric per stage plus the total."""
+    metrics = []
+    for span in sorted(root.spans or [], key=lambda s: s.start_ns):
+        if span is root:
+            continue
+        metric = metric_name(span.name)
+        if "cache.hit" in span.attributes:
+            metric += f';desc="{"hit" if span.attributes["cache.hit"] else "miss"}"'
+        metrics.append(f"{metric};dur={span.duration_ms:.1f}")
+    metrics.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(metrics)